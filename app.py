@@ -6,6 +6,8 @@ import requests
 from streamlit_mic_recorder import mic_recorder
 import streamlit.components.v1 as components
 import base64
+import math
+import time
 
 # --- Branding & Config ---
 st.set_page_config(page_title="LegacyTree", layout="wide", page_icon="🌲")
@@ -15,6 +17,30 @@ def get_base64_of_bin_file(bin_file):
         data = f.read()
     return base64.b64encode(data).decode()
 
+def backend_media_url(url):
+    # Illustrations are served by the backend blob store under relative URLs
+    if url and url.startswith("/"):
+        return f"http://localhost:8000{url}"
+    return url
+
+def poll_illustration_job(job, label, timeout=600):
+    # Poll an illustration job until it is done or failed, showing render progress
+    progress = st.progress(0, text=f"Waiting for the {label}...")
+    deadline = time.time() + timeout
+    while job["status"] in ("queued", "running") and time.time() < deadline:
+        time.sleep(1 if job["tier"] == "preview" else 2)
+        job = requests.get(
+            f"http://localhost:8000/api/illustrations/jobs/{job['job_id']}",
+            timeout=10
+        ).json()
+        if job["status"] == "running" and job["total_steps"]:
+            progress.progress(
+                job["step"] / job["total_steps"],
+                text=f"Rendering {label}: step {job['step']} of {job['total_steps']}"
+            )
+    progress.empty()
+    return job
+
 bg_image = 'background.jpg'  # Update path if needed
 bg_ext = 'jpg'       # or 'jpeg', 'png', etc.
 
@@ -115,7 +141,7 @@ def display_story_card(story):
     if story.get('image'):
         st.image(story['image'], caption="Artifact")
     if story.get('illustration_url'):
-        st.image(story['illustration_url'], caption="AI Illustration")
+        st.image(backend_media_url(story['illustration_url']), caption="AI Illustration")
     st.markdown("---")
 
 # --- Header ---
@@ -215,22 +241,42 @@ if tab == "Record Story":
     # --- AI Illustration Generator ---
     generate_illustration = st.checkbox("Generate an AI illustration for this story")
     illustration_url = None
+    # Illustrations already generated this session, so reruns don't request them again
+    generated_illustrations = st.session_state.setdefault('generated_illustrations', {})
 
-    if generate_illustration and transcript:
+    if generate_illustration and transcript in generated_illustrations:
+        illustration_url = generated_illustrations[transcript]
+        st.image(backend_media_url(illustration_url), caption=f"AI-generated illustration")
+    elif generate_illustration and transcript:
         with st.spinner("🎨 Generating AI illustration..."):
             try:
-                # Call the backend to generate illustration
+                # Queue a quick preview with a full-quality render behind it
                 response = requests.post(
-                    "http://localhost:8000/api/generate-illustration",
-                    json={"text": transcript},  # No style sent
-                    timeout=120  # Longer timeout for image generation
+                    "http://localhost:8000/api/illustrations/jobs",
+                    json={"text": transcript, "tier": "preview", "refine": True},  # No style sent
+                    timeout=10
                 )
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    illustration_url = result["illustration_url"]
-                    st.success("✅ AI illustration generated!")
-                    st.image(illustration_url, caption=f"AI-generated illustration")
+                if response.status_code == 202:
+                    submitted = response.json()
+                    image_slot = st.empty()
+                    job = poll_illustration_job(submitted, "preview")
+                    if job["status"] == "done":
+                        illustration_url = job["illustration_url"]
+                        image_slot.image(backend_media_url(illustration_url), caption="Preview, refining...")
+
+                    if submitted.get("refinement"):
+                        job = poll_illustration_job(submitted["refinement"], "full-quality illustration")
+
+                    if job["status"] == "done":
+                        illustration_url = job["illustration_url"]
+                        generated_illustrations[transcript] = illustration_url
+                        st.success("✅ AI illustration generated!")
+                        image_slot.image(backend_media_url(illustration_url), caption=f"AI-generated illustration")
+                    elif job["status"] == "failed":
+                        st.error(f"Failed to generate illustration: {job['error']}")
+                    else:
+                        st.error("Illustration is taking too long, please try again later")
                 else:
                     st.error(f"Failed to generate illustration: {response.text}")
                     illustration_url = None
@@ -336,55 +382,103 @@ elif tab == "Memory Map":
     st.header("🌍 Memory Map")
     st.markdown("Explore stories pinned to places. Click a pin to view the memory.")
     
-    # Load stories from backend
+    # Load the pre-clustered map layer (single stories as pins, crowded areas as counts)
+    MAP_ZOOM = 2
+    pins = None
+    try:
+        response = requests.get(
+            "http://localhost:8000/api/map/clusters",
+            params={"zoom": MAP_ZOOM},
+            timeout=10
+        )
+        if response.status_code == 200:
+            pins = []
+            for feature in response.json()["features"]:
+                lon, lat = feature["geometry"]["coordinates"]
+                properties = feature["properties"]
+                pins.append({
+                    "lat": lat,
+                    "lon": lon,
+                    "title": properties.get("title"),
+                    "theme": properties.get("theme"),
+                    "count": properties.get("point_count", 1),
+                })
+    except Exception as e:
+        pass
+
+    # Load the story list a page at a time, newest first
+    STORIES_PAGE_SIZE = 20
+    if 'story_pages' not in st.session_state:
+        st.session_state['story_pages'] = 1
+    next_cursor = None
     try:
-        response = requests.get("http://localhost:8000/api/stories", timeout=10)
+        backend_stories = []
+        for _ in range(st.session_state['story_pages']):
+            params = {"limit": STORIES_PAGE_SIZE, "order": "desc"}
+            if next_cursor:
+                params["cursor"] = next_cursor
+            response = requests.get("http://localhost:8000/api/stories", params=params, timeout=10)
+            if response.status_code != 200:
+                break
+            backend_stories.extend(response.json())
+            next_cursor = response.headers.get("X-Next-Cursor")
+            if not next_cursor:
+                break
         if response.status_code == 200:
-            backend_stories = response.json()
-            # Update session state with backend data
-            st.session_state['stories'] = backend_stories
+            # Update session state with backend data (oldest first, as saved locally)
+            st.session_state['stories'] = list(reversed(backend_stories))
         # else:
         #     st.warning("Could not load stories from backend, using local data.")
     except Exception as e:
         pass 
-    
 
-    if st.session_state['stories']:
-        first_story = st.session_state['stories'][0]
-        center = [first_story['lat'], first_story['lon']]
-        st.info(f"📍 Centering map on: {first_story['location']} ({first_story['lat']}, {first_story['lon']})")
+    if pins is None:
+        pins = [dict(story, count=1) for story in st.session_state['stories']]
+
+    if pins:
+        first_pin = pins[0]
+        center = [first_pin['lat'], first_pin['lon']]
+        st.info(f"📍 Centering map on: {first_pin['title'] or 'a cluster of stories'} ({first_pin['lat']:.4f}, {first_pin['lon']:.4f})")
     else:
         center = [20, 0]
         st.info("📍 No stories found, using default center")
     
     # Create the map
-    m = folium.Map(location=center, zoom_start=2)
+    m = folium.Map(location=center, zoom_start=MAP_ZOOM)
     
-    # Add markers for each story
-    for idx, story in enumerate(st.session_state['stories']):
+    # Add a marker per story, or a sized circle per cluster of stories
+    for idx, pin in enumerate(pins):
         try:
+            if pin['count'] > 1:
+                folium.CircleMarker(
+                    [pin['lat'], pin['lon']],
+                    radius=8 + 4 * math.log10(pin['count']),
+                    tooltip=f"{pin['count']} stories",
+                    color='green',
+                    fill=True,
+                    fill_opacity=0.6
+                ).add_to(m)
+                continue
+
             # Create popup content
             popup_html = f"""
-            <div style="width: 300px;">
-                <h4><b>{story['title']}</b></h4>
-                <p><i>Theme: {story['theme']}</i></p>
-                <p>{story['summary'][:150]}...</p>
-                <p><i>📍 {story['location']}</i></p>
-                <p><i>📅 {story.get('date', 'Unknown')}</i></p>
+            <div style="width: 200px;">
+                <h4><b>{pin['title']}</b></h4>
+                <p><i>Theme: {pin['theme']}</i></p>
             </div>
             """
             
             # Add marker to map
             folium.Marker(
-                [story['lat'], story['lon']],
+                [pin['lat'], pin['lon']],
                 popup=folium.Popup(popup_html, max_width=300),
-                tooltip=story['title'],
+                tooltip=pin['title'],
                 icon=folium.Icon(color='green', icon='book')
             ).add_to(m)
             
         except Exception as e:
             st.error(f"Error adding story {idx} to map: {str(e)}")
-            st.write(f"Story data: {story}")
+            st.write(f"Story data: {pin}")
     
     # Display the map
     st_folium(m, width=700, height=500)
@@ -394,6 +488,10 @@ elif tab == "Memory Map":
     for story in reversed(st.session_state['stories']):
         display_story_card(story)
 
+    if next_cursor and st.button("Load more stories"):
+        st.session_state['story_pages'] += 1
+        st.rerun()
+
 # --- Guided Story Chat Tab ---
 if tab == "Guided Story Chat":
     st.header("🤖 Guided Story Chat")
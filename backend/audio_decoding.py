@@ -0,0 +1,152 @@
+"""
+Decode uploaded audio into the 16 kHz mono float32 arrays Whisper takes,
+without writing the upload to disk.
+"""
+import io
+import math
+import os
+import subprocess
+import tempfile
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = 16000  # Whisper's input rate
+FFMPEG_TIMEOUT = 300
+
+
+class AudioDecodeError(ValueError):
+    pass
+
+
+def pcm_to_float32(frames: bytes, sample_width: int, channels: int = 1) -> np.ndarray:
+    """Interleaved little-endian PCM (8-bit unsigned or 16/24/32-bit signed) to mono float32 in [-1, 1]"""
+    if sample_width in (2, 3, 4):
+        # A truncated file can end partway through a sample
+        frames = frames[:len(frames) - len(frames) % sample_width]
+    if sample_width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif sample_width == 2:
+        samples = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768.0
+    elif sample_width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3)
+        # Sign-extend the 24-bit samples into the top of an int32
+        samples = (
+            (raw[:, 0].astype(np.int32) << 8) | (raw[:, 1].astype(np.int32) << 16) | (raw[:, 2].astype(np.int32) << 24)
+        ).astype(np.float32) / 2147483648.0
+    elif sample_width == 4:
+        samples = np.frombuffer(frames, dtype="<i4").astype(np.float32) / 2147483648.0
+    else:
+        raise AudioDecodeError(f"Unsupported PCM sample width: {sample_width} bytes")
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return samples
+
+
+def _resample(samples: np.ndarray, rate: int) -> np.ndarray:
+    """Polyphase resampling to SAMPLE_RATE; raises ImportError without scipy"""
+    from scipy.signal import resample_poly
+
+    divisor = math.gcd(rate, SAMPLE_RATE)
+    return resample_poly(samples, SAMPLE_RATE // divisor, rate // divisor).astype(np.float32)
+
+
+def resample(samples: np.ndarray, rate: int) -> np.ndarray:
+    """
+    Samples at rate resampled to SAMPLE_RATE: polyphase filtering with scipy,
+    or linear interpolation (no anti-aliasing) without it
+    """
+    if rate == SAMPLE_RATE:
+        return samples
+    try:
+        return _resample(samples, rate)
+    except ImportError:
+        positions = np.arange(0, len(samples), rate / SAMPLE_RATE)
+        return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def _decode_wav(data: bytes):
+    """
+    In-process decode of a PCM WAV file. Returns None when the file needs
+    ffmpeg (not PCM, or another rate than 16 kHz and scipy is not installed).
+    """
+    try:
+        with wave.open(io.BytesIO(data)) as wav:
+            frames = wav.readframes(wav.getnframes())
+            samples = pcm_to_float32(frames, wav.getsampwidth(), wav.getnchannels())
+            rate = wav.getframerate()
+    except (wave.Error, EOFError, AudioDecodeError):
+        return None
+    if rate == SAMPLE_RATE:
+        return samples
+    try:
+        return _resample(samples, rate)
+    except ImportError:
+        return None
+
+
+def _run_ffmpeg(source: str, data: bytes = None) -> np.ndarray:
+    command = [
+        "ffmpeg", "-nostdin", "-threads", "0", "-i", source,
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "pipe:1"
+    ]
+    try:
+        result = subprocess.run(command, input=data, capture_output=True, check=True, timeout=FFMPEG_TIMEOUT)
+    except FileNotFoundError as e:
+        raise AudioDecodeError("ffmpeg is not installed, only PCM WAV audio can be decoded") from e
+    except subprocess.TimeoutExpired as e:
+        raise AudioDecodeError(f"ffmpeg did not finish decoding within {FFMPEG_TIMEOUT}s") from e
+    except subprocess.CalledProcessError as e:
+        raise AudioDecodeError(f"ffmpeg could not decode the audio: {e.stderr.decode(errors='replace')[-500:]}") from e
+    return pcm_to_float32(result.stdout, 2)
+
+
+def _mp4_index_at_end(data: bytes) -> bool:
+    """True for an MP4/M4A file whose index (moov box) comes after the media data"""
+    if data[4:8] != b"ftyp":
+        return False
+    position = 0
+    while position + 8 <= len(data):
+        size = int.from_bytes(data[position:position + 4], "big")
+        box = data[position + 4:position + 8]
+        if box == b"moov":
+            return False
+        if box == b"mdat":
+            return True
+        if size == 1:
+            size = int.from_bytes(data[position + 8:position + 16], "big")
+        if size < 8:
+            return False
+        position += size
+    return False
+
+
+def _decode_ffmpeg(data: bytes) -> np.ndarray:
+    """
+    Decode any format ffmpeg reads, piping the bytes through stdin and the
+    samples back through stdout. MP4/M4A files with the index at the end
+    cannot be decoded from a pipe, since ffmpeg has to seek back to the
+    media data; those are written to a temporary file, removed however
+    decoding ends.
+    """
+    if not _mp4_index_at_end(data):
+        return _run_ffmpeg("pipe:0", data)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "audio")
+        with open(path, "wb") as f:
+            f.write(data)
+        return _run_ffmpeg(path)
+
+
+def decode_audio(data: bytes) -> np.ndarray:
+    """Uploaded audio (any format ffmpeg reads) as 16 kHz mono float32 samples"""
+    if not data:
+        raise AudioDecodeError("Audio is empty")
+    samples = None
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        samples = _decode_wav(data)
+    if samples is None:
+        samples = _decode_ffmpeg(data)
+    if not len(samples):
+        raise AudioDecodeError("Audio contains no samples")
+    return samples
@@ -0,0 +1,91 @@
+"""
+Measure how long `import main` takes in a fresh interpreter, for a CRUD-only
+deployment (ML services disabled) and with every service enabled, and list
+the slowest imports.
+
+    cd backend && python benchmarks/bench_import_time.py --runs 5 --budget 1.0
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROFILES = {
+    "crud-only": {
+        "LEGACYTREE_ENABLE_CONVERSATION": "false",
+        "LEGACYTREE_ENABLE_SPEECH": "false",
+        "LEGACYTREE_ENABLE_IMAGE_GENERATION": "false",
+        "LEGACYTREE_ENABLE_SUMMARIZATION_MODEL": "false",
+    },
+    "all-services": {},
+}
+
+
+def run_import(env_overrides: dict, workdir: str, importtime: bool = False) -> tuple[float, str]:
+    """Wall time of `import main` in a new interpreter, and its stderr"""
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR, **env_overrides)
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", "import main"]
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"import main failed:\n{result.stderr}")
+    return elapsed, result.stderr
+
+
+def slowest_imports(importtime_log: str, top: int) -> list[tuple[int, str]]:
+    """Top-level packages by cumulative import time (microseconds) from -X importtime output"""
+    totals = {}
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # Nesting is shown by indentation: count imports made by main itself
+        # (depth 1) and anything imported before it (depth 0), not nested ones
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        package = name.strip().split(".")[0]
+        if depth <= 1 and package != "main":
+            totals[package] = totals.get(package, 0) + int(cumulative)
+    return sorted(((us, name) for name, us in totals.items()), reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list per profile")
+    parser.add_argument("--budget", type=float, default=None, help="fail if crud-only import exceeds this (seconds)")
+    parser.add_argument("--profile", choices=list(PROFILES), action="append", help="default: all profiles")
+    args = parser.parse_args()
+
+    results = {}
+    for profile in args.profile or list(PROFILES):
+        overrides = PROFILES[profile]
+        # Each run gets an empty working directory, so it creates its own database and blob store
+        with tempfile.TemporaryDirectory() as workdir:
+            run_import(overrides, workdir)  # create the database outside the timed runs
+            timings = [run_import(overrides, workdir)[0] for _ in range(args.runs)]
+            _, log = run_import(overrides, workdir, importtime=True)
+        results[profile] = statistics.median(timings)
+        print(f"{profile}: median {results[profile]:.3f}s, min {min(timings):.3f}s over {args.runs} runs")
+        for microseconds, package in slowest_imports(log, args.top):
+            print(f"    {microseconds / 1e6:8.3f}s  {package}")
+
+    if args.budget is not None and "crud-only" in results:
+        if results["crud-only"] > args.budget:
+            print(f"❌ crud-only import took {results['crud-only']:.3f}s, budget {args.budget:.3f}s")
+            sys.exit(1)
+        print(f"✅ crud-only import within {args.budget:.3f}s budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Microbenchmark of the shared keyword matcher against the per-function
+substring scans it replaced (title, theme and illustration prompt scenes),
+checking that both give the same results.
+
+    cd backend && python benchmarks/bench_keyword_matcher.py --texts 2000 --words 2000 --vocabulary 5000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from keyword_matcher import (
+    PROMPT_SCENE_KEYWORDS, STORY_MATCHER, THEME_KEYWORDS, TITLE_KEYWORDS, prompt_scenes_for, theme_for, title_for
+)
+
+FILLER = "the a we they said remember summer house river morning evening old new little".split()
+# Filler words that contain keywords, so substring (not word) matching is checked
+TRICKY_FILLER = "award hardly homework networking snowing dadaism grandparents wartime lovely".split()
+
+
+def legacy_title(text: str) -> str:
+    text_lower = text.lower()
+    for title, keywords in TITLE_KEYWORDS:
+        if any(word in text_lower for word in keywords):
+            return title
+    return "A Special Memory"
+
+
+def legacy_theme(text: str) -> str:
+    text_lower = text.lower()
+    theme_scores = {}
+    for theme, keywords in THEME_KEYWORDS.items():
+        theme_scores[theme] = sum(1 for keyword in keywords if keyword in text_lower)
+    best_theme = max(theme_scores, key=theme_scores.get)
+    return best_theme if theme_scores[best_theme] > 0 else "family"
+
+
+def legacy_scenes(text: str) -> list[str]:
+    story_lower = text.lower()
+    return [scene for scene, keywords in PROMPT_SCENE_KEYWORDS if any(word in story_lower for word in keywords)]
+
+
+def make_texts(count: int, words: int, vocabulary_size: int, tricky: bool = True, seed: int = 7) -> list[str]:
+    """
+    Filler text with a few keywords sprinkled in (and, if tricky, filler
+    words containing them), drawn from FILLER plus vocabulary_size random words
+    """
+    rng = random.Random(seed)
+    filler = FILLER + (TRICKY_FILLER if tricky else []) + [
+        "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 10)))
+        for _ in range(vocabulary_size)
+    ]
+    vocabulary = STORY_MATCHER.keywords
+    texts = []
+    for _ in range(count):
+        tokens = [rng.choice(filler) for _ in range(words)]
+        for _ in range(rng.randint(0, 6)):
+            tokens[rng.randrange(words)] = rng.choice(vocabulary).capitalize()
+        texts.append(" ".join(tokens))
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=2000)
+    parser.add_argument("--vocabulary", type=int, default=5000, help="Distinct filler words")
+    parser.add_argument(
+        "--no-tricky-filler", action="store_true",
+        help="Leave out filler words containing keywords; most keywords are then absent, as in typical stories"
+    )
+    args = parser.parse_args()
+
+    texts = make_texts(args.texts, args.words, args.vocabulary, tricky=not args.no_tricky_filler)
+
+    start = time.perf_counter()
+    legacy = [(legacy_title(text), legacy_theme(text), legacy_scenes(text)) for text in texts]
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matched = [
+        (title_for(found), theme_for(found), prompt_scenes_for(found))
+        for found in STORY_MATCHER.matches_batch(texts)
+    ]
+    matcher_seconds = time.perf_counter() - start
+
+    mismatches = sum(1 for old, new in zip(legacy, matched) if old != new)
+    print(f"{args.texts} texts x {args.words} words, {args.vocabulary} word vocabulary")
+    print(f"  substring scans: {legacy_seconds:7.3f}s")
+    print(f"  shared matcher:  {matcher_seconds:7.3f}s  ({legacy_seconds / matcher_seconds:.2f}x)")
+    print(f"  {len(STORY_MATCHER.keywords)} keywords, {mismatches} mismatching results")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
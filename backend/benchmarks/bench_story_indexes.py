@@ -0,0 +1,124 @@
+"""
+Seed a scratch database with stories and check that the story list filters
+and text search are answered from an index instead of a full table scan.
+
+    cd backend && python benchmarks/bench_story_indexes.py --rows 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from migrations import migrate
+from models import Base, Story
+from story_queries import bbox_filter, list_stories_query, search_stories_query
+
+THEMES = ["love", "war", "migration", "family", "tradition", "adventure", "struggle", "success"]
+VISIBILITIES = ["Public", "Private (Family Only)"]
+MEMORIES = [
+    "harvest", "wedding", "voyage", "bakery", "orchard", "factory", "lighthouse", "railway",
+    "snowstorm", "festival", "classroom", "shipyard", "vineyard", "market", "mine", "choir",
+]
+
+
+def seed(path: str, rows: int, batch_size: int = 50_000):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    start = datetime(1900, 1, 1)
+    rng = random.Random(42)
+    for offset in range(0, rows, batch_size):
+        batch = []
+        for i in range(offset, min(rows, offset + batch_size)):
+            date = start + timedelta(days=rng.randrange(45_000))
+            batch.append((
+                f"Story {i}", f"A remembered {rng.choice(MEMORIES)} and {rng.choice(MEMORIES)}.",
+                rng.choice(THEMES), "Somewhere",
+                rng.uniform(-60, 70), rng.uniform(-180, 180), "resolved", date,
+                rng.choice(VISIBILITIES), date, date,
+            ))
+        conn.executemany(
+            "INSERT INTO stories (title, summary, theme, location, lat, lon, geocode_status, "
+            "date, visibility, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            batch,
+        )
+        conn.commit()
+    conn.close()
+
+
+def query_plan(engine, query) -> str:
+    sql = str(query.statement.compile(engine, compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    return " | ".join(row[-1] for row in rows)
+
+
+def timed(query, limit: int = 100) -> float:
+    start = time.perf_counter()
+    query.limit(limit).all()
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        engine = create_engine(f"sqlite:///{path}")
+        # Create the table without indexes, as in an existing legacytree.db
+        Story.__table__.create(bind=engine, checkfirst=True)
+        for index in list(Story.__table__.indexes):
+            index.drop(bind=engine)
+
+        start = time.perf_counter()
+        seed(path, args.rows)
+        print(f"Seeded {args.rows} stories in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        Base.metadata.create_all(bind=engine)
+        migrate(engine)
+        print(f"Migrated in {time.perf_counter() - start:.1f}s")
+
+        db = sessionmaker(bind=engine)()
+        # (query, index it must use); text search sorts its matches by rank
+        checks = {
+            "visibility": (list_stories_query(db, visibility="Public"), "ix_stories_visibility_date"),
+            "theme": (list_stories_query(db, theme="war"), "ix_stories_theme_date"),
+            "bbox": (
+                db.query(Story).filter(bbox_filter(40, 50, -80, -70, use_rtree=False)),
+                "ix_stories_lat_lon",
+            ),
+            "bbox_rtree": (
+                db.query(Story).filter(bbox_filter(40, 50, -80, -70, use_rtree=True)),
+                "stories_rtree",
+            ),
+            "text": (search_stories_query(db, "lighthouse shipyard"), "stories_fts"),
+        }
+
+        failed = False
+        for name, (query, index_name) in checks.items():
+            plan = query_plan(engine, query)
+            uses_index = index_name in plan and (name == "text" or "TEMP B-TREE" not in plan)
+            failed |= not uses_index
+            status = "OK " if uses_index else "FAIL"
+            print(f"[{status}] {name:<10} {timed(query):8.2f} ms  plan: {plan}")
+        db.close()
+        engine.dispose()
+
+    if failed:
+        sys.exit("Story list query fell back to a table scan or sort")
+
+
+if __name__ == "__main__":
+    main()
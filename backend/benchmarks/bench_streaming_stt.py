@@ -0,0 +1,92 @@
+"""
+Compare how soon text appears with streaming speech-to-text (WebSocket,
+audio sent in real time) and with the one-shot upload to /api/speech-to-text
+after the recording ends. Needs a running server and `pip install websockets`.
+
+    cd backend && python benchmarks/bench_streaming_stt.py recording.wav --url ws://localhost:8000
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import requests
+from websockets.sync.client import connect
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_decoding import SAMPLE_RATE, decode_audio
+
+CHUNK_MS = 100
+
+
+def stream(url: str, pcm: bytes, language: str, speed: float) -> list[tuple[float, float, dict]]:
+    """Send pcm in CHUNK_MS chunks at `speed` x real time; returns (wall s, audio s, message) per message"""
+    chunk_bytes = SAMPLE_RATE * CHUNK_MS // 1000 * 2
+    sent_bytes = 0
+    messages = []
+    with connect(f"{url}/api/speech-to-text/stream?language={language}") as websocket:
+        start = time.perf_counter()
+
+        def receive():
+            for raw in websocket:
+                message = json.loads(raw)
+                messages.append((time.perf_counter() - start, sent_bytes / 2 / SAMPLE_RATE, message))
+                if message["type"] == "done":
+                    return
+
+        receiver = threading.Thread(target=receive)
+        receiver.start()
+        for offset in range(0, len(pcm), chunk_bytes):
+            websocket.send(pcm[offset:offset + chunk_bytes])
+            sent_bytes = min(len(pcm), offset + chunk_bytes)
+            time.sleep(CHUNK_MS / 1000 / speed)
+        websocket.send(json.dumps({"type": "end"}))
+        receiver.join()
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("audio", help="Recording to transcribe (any format ffmpeg reads)")
+    parser.add_argument("--url", default="ws://localhost:8000")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--speed", type=float, default=1.0, help="Playback speed relative to real time")
+    args = parser.parse_args()
+
+    with open(args.audio, "rb") as f:
+        data = f.read()
+    samples = decode_audio(data)
+    duration = len(samples) / SAMPLE_RATE
+    pcm = (np.clip(samples, -1, 1) * 32767).astype("<i2").tobytes()
+    print(f"{args.audio}: {duration:.1f}s of audio")
+
+    messages = stream(args.url, pcm, args.language, args.speed)
+    recording_ends = duration / args.speed
+    print(f"\n{'wall s':>7} {'audio s':>8}  message")
+    for wall, audio, message in messages:
+        print(f"{wall:7.2f} {audio:8.2f}  {message['type']:<7} {message.get('text', '')[:70]}")
+    first = next((wall for wall, _, message in messages if message["type"] in ("partial", "final")), None)
+    done = messages[-1][0] if messages else float("nan")
+    print(f"\nStreaming: first text after {first:.2f}s, complete {done - recording_ends:.2f}s after the recording ended"
+          if first is not None else "\nStreaming: no speech detected")
+
+    # One-shot: nothing is shown until the whole recording has been uploaded and transcribed
+    http_url = args.url.replace("ws://", "http://").replace("wss://", "https://")
+    start = time.perf_counter()
+    response = requests.post(
+        f"{http_url}/api/speech-to-text",
+        json={"audio_data": base64.b64encode(data).decode(), "language": args.language},
+        timeout=600
+    )
+    elapsed = time.perf_counter() - start
+    print(f"One-shot:  {response.status_code}, text {elapsed:.2f}s after the recording ended "
+          f"({len(data) / 1024:.0f} KB upload as {len(base64.b64encode(data)) / 1024:.0f} KB of base64)")
+
+
+if __name__ == "__main__":
+    main()
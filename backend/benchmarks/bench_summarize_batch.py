@@ -0,0 +1,69 @@
+"""
+Compare summarization throughput of one-at-a-time summarize_text calls with
+summarize_batch at several batch sizes, on synthetic transcripts of mixed length.
+
+    cd backend && python benchmarks/bench_summarize_batch.py --texts 64 --batch-sizes 4 8 16
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from summarization import SummarizationService
+
+SENTENCES = [
+    "My grandmother grew up on a small farm outside the village.",
+    "Every summer the whole family gathered to bring in the harvest.",
+    "During the war my grandfather served as a radio operator.",
+    "They wrote letters to each other for three years before they married.",
+    "When the factory closed, we packed everything and moved to the city.",
+    "She was the first in our family to go to university.",
+    "On Sundays we cooked together and told stories late into the night.",
+    "The journey across the ocean took almost two weeks.",
+]
+
+
+def make_texts(count: int, seed: int = 42) -> list[str]:
+    """Transcripts between 3 and 40 sentences long, in random order"""
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(SENTENCES) for _ in range(rng.randint(3, 40))) for _ in range(count)]
+
+
+def timed(label: str, texts: list[str], summarize) -> float:
+    start = time.perf_counter()
+    summaries = summarize(texts)
+    elapsed = time.perf_counter() - start
+    assert len(summaries) == len(texts)
+    print(f"{label:>24}: {elapsed:7.2f}s  {len(texts) / elapsed:6.2f} texts/s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=64)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[4, 8, 16])
+    args = parser.parse_args()
+
+    service = SummarizationService(use_ai_model=True)
+    if service.summarizer is None:
+        sys.exit("Summarization model could not be loaded")
+    texts = make_texts(args.texts)
+
+    # Warm-up, so model initialisation is not counted against the first run
+    service.summarize_text(texts[0])
+
+    baseline = timed("one at a time", texts, lambda batch: [service.summarize_text(text) for text in batch])
+    for batch_size in args.batch_sizes:
+        elapsed = timed(
+            f"summarize_batch({batch_size})",
+            texts,
+            lambda batch: list(service.summarize_batch(batch, batch_size=batch_size))
+        )
+        print(f"{'':>24}  {baseline / elapsed:.2f}x vs one at a time")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Compare summarizer inference backends (pytorch fp32, dynamic int8, onnxruntime)
+on a fixed corpus of story texts: load time, peak memory, per-summary latency,
+and ROUGE-1 / ROUGE-L F1 of each backend's summaries against the pytorch ones.
+
+Each backend runs in its own interpreter so memory figures do not mix.
+
+    cd backend && python benchmarks/bench_summarizer_backends.py --backends pytorch int8 onnx
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CORPUS = [
+    "My grandmother grew up on a small farm outside the village, the youngest of seven children. "
+    "Every morning before school she walked the cows to the river and back, and in winter she "
+    "carried water from the well because the pipes froze. When she was fourteen her father fell ill "
+    "and she left school to run the farm with her older brother. She always said those years taught "
+    "her that nothing comes for free, and she made sure each of her own children finished school.",
+    "During the war my grandfather served as a radio operator on a supply ship in the North Atlantic. "
+    "He rarely spoke about it, but one Christmas he told us about the night the convoy was attacked "
+    "and the ship next to theirs went down. He spent hours relaying messages while the crew pulled "
+    "survivors from the water. He kept the headphones he wore that night in a box in the attic until "
+    "the day he died, and my mother still has them.",
+    "My parents met at a dance in the town hall in 1962. My father had borrowed his brother's suit, "
+    "which was two sizes too big, and my mother laughed at him the whole evening. They wrote letters "
+    "to each other for three years while he worked on the railway in the north, and they married the "
+    "week he came home. They were together for fifty-one years, and they still danced in the kitchen "
+    "every Saturday night.",
+    "When the factory closed in 1983 there was no more work in our town, so we packed everything we "
+    "owned into a borrowed van and moved to the city. I was nine and cried for the whole drive. We "
+    "lived in a two-room apartment above a bakery, and my mother took night shifts cleaning offices "
+    "while my father looked for work. It took him almost a year to find a steady job, but he never let "
+    "us see how worried he was.",
+    "My aunt was the first person in our family to go to university. Nobody in the village understood "
+    "why a girl would want to study engineering, and some of the neighbours stopped speaking to my "
+    "grandparents. She graduated at the top of her class and went on to design bridges, including the "
+    "one that finally connected our village to the main road. At the opening ceremony the same "
+    "neighbours lined up to shake her hand.",
+    "The journey across the ocean took almost two weeks. My great-grandparents travelled in steerage "
+    "with their three children and a trunk that held everything they owned, including a sewing machine "
+    "my great-grandmother refused to leave behind. That sewing machine paid the rent for their first "
+    "years in the new country, as she took in mending from the whole street. It still works, and my "
+    "daughter learned to sew on it last summer.",
+]
+
+
+# --- ROUGE (unigram and longest common subsequence F1 over lowercase words) ---
+
+def _tokens(text: str) -> list[str]:
+    return [word.strip(".,;:!?\"'()").lower() for word in text.split() if word.strip(".,;:!?\"'()")]
+
+
+def _f1(overlap: int, candidate_len: int, reference_len: int) -> float:
+    if not overlap:
+        return 0.0
+    precision, recall = overlap / candidate_len, overlap / reference_len
+    return 2 * precision * recall / (precision + recall)
+
+
+def rouge_1(candidate: str, reference: str) -> float:
+    cand, ref = _tokens(candidate), _tokens(reference)
+    counts = {}
+    for word in ref:
+        counts[word] = counts.get(word, 0) + 1
+    overlap = 0
+    for word in cand:
+        if counts.get(word, 0) > 0:
+            counts[word] -= 1
+            overlap += 1
+    return _f1(overlap, len(cand), len(ref))
+
+
+def rouge_l(candidate: str, reference: str) -> float:
+    cand, ref = _tokens(candidate), _tokens(reference)
+    previous = [0] * (len(ref) + 1)
+    for word in cand:
+        current = [0]
+        for j, ref_word in enumerate(ref):
+            current.append(previous[j] + 1 if word == ref_word else max(previous[j + 1], current[j]))
+        previous = current
+    return _f1(previous[-1], len(cand), len(ref))
+
+
+# --- Runs ---
+
+def run_backend(backend: str, repeats: int) -> dict:
+    """Runs inside the child interpreter: load one backend and summarize the corpus"""
+    from summarization import SummarizationService
+
+    start = time.perf_counter()
+    service = SummarizationService(use_ai_model=True, backend=backend)
+    load_seconds = time.perf_counter() - start
+    if service.summarizer is None:
+        return {"backend": backend, "error": "model could not be loaded"}
+    if service.backend != backend:
+        return {"backend": backend, "error": f"backend unavailable, fell back to {service.backend}"}
+
+    service.summarize_text(CORPUS[0])  # Warm-up
+    latencies, summaries = [], []
+    for _ in range(repeats):
+        summaries = []
+        for text in CORPUS:
+            start = time.perf_counter()
+            summaries.append(service.summarize_text(text))
+            latencies.append(time.perf_counter() - start)
+
+    return {
+        "backend": backend,
+        "load_seconds": load_seconds,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "latencies": latencies,
+        "summaries": summaries,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["pytorch", "int8", "onnx"])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_backend(args.child, args.repeats)))
+        return
+
+    backends = ["pytorch"] + [backend for backend in args.backends if backend != "pytorch"]
+    results = {}
+    for backend in backends:
+        output = subprocess.run(
+            [sys.executable, __file__, "--child", backend, "--repeats", str(args.repeats)],
+            capture_output=True, text=True
+        )
+        if output.returncode != 0:
+            print(f"❌ {backend} failed:\n{output.stderr}")
+            continue
+        results[backend] = json.loads(output.stdout.strip().splitlines()[-1])
+
+    reference = results.get("pytorch", {}).get("summaries")
+    print(f"{'backend':>8} {'load s':>8} {'peak MB':>8} {'p50 s':>7} {'mean s':>7} {'ROUGE-1':>8} {'ROUGE-L':>8}")
+    for backend, result in results.items():
+        if "error" in result:
+            print(f"{backend:>8}  {result['error']}")
+            continue
+        latencies = result["latencies"]
+        rouge1 = rougel = float("nan")
+        if reference:
+            pairs = list(zip(result["summaries"], reference))
+            rouge1 = statistics.mean(rouge_1(c, r) for c, r in pairs)
+            rougel = statistics.mean(rouge_l(c, r) for c, r in pairs)
+        print(
+            f"{backend:>8} {result['load_seconds']:8.1f} {result['peak_rss_mb']:8.0f} "
+            f"{statistics.median(latencies):7.2f} {statistics.mean(latencies):7.2f} "
+            f"{rouge1:8.3f} {rougel:8.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
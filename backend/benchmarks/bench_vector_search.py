@@ -0,0 +1,83 @@
+"""
+Query latency and recall of the story search vector index on synthetic
+embeddings: clustered unit vectors (like sentence embeddings of stories on
+a limited set of topics), indexed in a temporary directory.
+
+Recall@k is measured against exact search over all vectors.
+
+    cd backend && python benchmarks/bench_vector_search.py --stories 1000000 --nprobe 8 16 32
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from story_search import VectorIndex
+
+
+def unit(vectors: np.ndarray) -> np.ndarray:
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stories", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=384, help="Embedding size (all-MiniLM-L6-v2 is 384)")
+    parser.add_argument("--topics", type=int, default=2000)
+    parser.add_argument("--noise", type=float, default=0.03, help="Spread of stories around their topic (per dimension)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[8, 16, 32])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    topics = unit(rng.standard_normal((args.topics, args.dim)))
+
+    def stories(count: int) -> np.ndarray:
+        return unit(topics[rng.integers(0, args.topics, count)] + rng.standard_normal((count, args.dim)) * args.noise)
+
+    with tempfile.TemporaryDirectory() as directory:
+        index = VectorIndex(directory, "synthetic", ivf_min_rows=0)
+        index.load()
+
+        start = time.perf_counter()
+        for first in range(0, args.stories, 10000):
+            count = min(10000, args.stories - first)
+            index.upsert(list(range(first, first + count)), stories(count))
+        index.flush()
+        print(f"Indexed {args.stories} x {args.dim} vectors in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        index.train()
+        print(f"Trained in {time.perf_counter() - start:.1f}s")
+
+        queries = stories(args.queries)
+        vectors = np.asarray(index._vectors[:index.rows])
+        exact = [set(np.argpartition(-(vectors @ query), args.k)[:args.k].tolist()) for query in queries]
+        del vectors
+
+        print(f"{'nprobe':>6} {'p50 ms':>8} {'p95 ms':>8} {'recall@' + str(args.k):>10}")
+        for nprobe in args.nprobe:
+            index.nprobe = nprobe
+            index.search(queries[0], args.k)  # Warm-up
+            latencies, recalls = [], []
+            for query, truth in zip(queries, exact):
+                start = time.perf_counter()
+                found = index.search(query, args.k)
+                latencies.append((time.perf_counter() - start) * 1000)
+                recalls.append(len(truth & {story_id for story_id, _ in found}) / args.k)
+            latencies.sort()
+            print(
+                f"{nprobe:>6} {statistics.median(latencies):8.2f} "
+                f"{latencies[int(len(latencies) * 0.95)]:8.2f} {statistics.mean(recalls):10.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
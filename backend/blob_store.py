@@ -0,0 +1,142 @@
+import base64
+import hashlib
+import os
+import re
+import tempfile
+from typing import Iterator, Optional
+
+BLOB_URL_PREFIX = "/api/blobs/"
+
+_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+_DATA_URL_PATTERN = re.compile(r"^data:[\w/+.-]+;base64,")
+
+# Magic numbers of the formats we store, for the Content-Type header
+_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+    (b"ID3", "audio/mpeg"),
+    (b"\xff\xfb", "audio/mpeg"),
+]
+
+
+def blob_url(blob_hash: str) -> str:
+    return f"{BLOB_URL_PREFIX}{blob_hash}"
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """
+    Parse a single-range "Range: bytes=..." header into inclusive (start, end).
+    Returns None when the header is absent, unsupported (multiple ranges) or
+    not in bytes, in which case the whole blob is sent.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first == "":
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                raise RangeNotSatisfiable(header)
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise RangeNotSatisfiable(header)
+    return start, min(end, size - 1)
+
+
+class BlobStore:
+    """
+    Content-addressed file store: blobs are named by the SHA-256 of their bytes,
+    so identical content is stored once and a blob never changes once written.
+    Files are sharded as <root>/ab/cd/abcd... to keep directories small.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def is_valid_hash(blob_hash: str) -> bool:
+        return bool(_HASH_PATTERN.match(blob_hash))
+
+    def path(self, blob_hash: str) -> str:
+        return os.path.join(self.root, blob_hash[:2], blob_hash[2:4], blob_hash)
+
+    def exists(self, blob_hash: str) -> bool:
+        return self.is_valid_hash(blob_hash) and os.path.exists(self.path(blob_hash))
+
+    def size(self, blob_hash: str) -> int:
+        return os.path.getsize(self.path(blob_hash))
+
+    def put(self, data: bytes) -> str:
+        """Store bytes and return their hash (a no-op if already stored)"""
+        blob_hash = hashlib.sha256(data).hexdigest()
+        path = self.path(blob_hash)
+        if os.path.exists(path):
+            return blob_hash
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename, so readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return blob_hash
+
+    def get(self, blob_hash: str) -> bytes:
+        with open(self.path(blob_hash), "rb") as f:
+            return f.read()
+
+    def delete(self, blob_hash: str):
+        """Remove a blob; the caller checks that nothing refers to it any more"""
+        try:
+            os.unlink(self.path(blob_hash))
+        except FileNotFoundError:
+            pass
+
+    def content_type(self, blob_hash: str) -> str:
+        with open(self.path(blob_hash), "rb") as f:
+            head = f.read(16)
+        for signature, content_type in _SIGNATURES:
+            if head.startswith(signature):
+                return content_type
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+            return "image/webp"
+        return "application/octet-stream"
+
+    def iter_range(self, blob_hash: str, start: int, end: int, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """Yield bytes start..end (inclusive) of a blob in chunks"""
+        with open(self.path(blob_hash), "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def put_url(self, url: Optional[str]) -> Optional[str]:
+        """
+        Normalize an illustration URL for storage: inline data: URLs are moved
+        into the store and replaced by their blob URL; other URLs are kept.
+        Raises ValueError if a data: URL is not valid base64.
+        """
+        if not url or not _DATA_URL_PATTERN.match(url):
+            return url
+        data = base64.b64decode(url.split(",", 1)[1], validate=True)
+        return blob_url(self.put(data))
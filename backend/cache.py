@@ -0,0 +1,388 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from blob_store import blob_url
+
+# Returned by cache lookups when a key is absent or expired. A stored value of
+# None is a legitimate (negative) result, so it cannot double as "missing".
+MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe in-process LRU cache with optional per-entry TTL
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Any, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return MISSING
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key: str) -> Any:
+        """Like get(), without counting a hit or miss or refreshing recency"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or (entry[1] is not None and entry[1] <= time.time()):
+            return MISSING
+        return entry[0]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SQLiteCache:
+    """
+    Persistent key/value cache stored as JSON in a SQLite table, with TTL.
+    With max_entries, expired rows and then the oldest rows beyond
+    max_entries are pruned every PRUNE_INTERVAL writes.
+    """
+
+    PRUNE_INTERVAL = 100
+
+    def __init__(self, db_path: str, table: str, max_entries: Optional[int] = None):
+        self.db_path = db_path
+        self.table = table
+        self.max_entries = max_entries
+        self._writes_since_prune = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, "
+            "value TEXT, "
+            "expires_at REAL, "
+            "created_at REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_created_at ON {table} (created_at)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return MISSING
+
+            value, expires_at = row
+            if expires_at is not None and expires_at <= time.time():
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return MISSING
+
+            self.hits += 1
+            return json.loads(value)
+
+    def peek(self, key: str) -> Any:
+        """Like get(), without counting a hit or miss"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return MISSING
+        return json.loads(row[0])
+
+    def remaining_ttl(self, key: str) -> Optional[float]:
+        """Seconds until the entry expires, or None if it never does"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, now),
+            )
+            self._conn.commit()
+            self._writes_since_prune += 1
+            due = self.max_entries is not None and self._writes_since_prune >= self.PRUNE_INTERVAL
+        if due:
+            self.prune()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def purge_expired(self) -> int:
+        """Drop expired rows, returns the number removed"""
+        with self._lock:
+            cursor = self._conn.execute(
+                f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                (time.time(),),
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def prune(self) -> int:
+        """Drop expired rows, then the oldest rows beyond max_entries; returns the number removed"""
+        removed = self.purge_expired()
+        with self._lock:
+            self._writes_since_prune = 0
+            if self.max_entries is not None:
+                cursor = self._conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN ("
+                    f"SELECT key FROM {self.table} ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                self._conn.commit()
+                removed += cursor.rowcount
+        return removed
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def stats(self) -> dict:
+        return {
+            "entries": self.count(),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class TwoTierCache:
+    """
+    In-process LRU in front of an optional persistent SQLite tier.
+    Persistent hits are promoted into the LRU with their remaining TTL.
+    """
+
+    def __init__(self, memory: LRUCache, persistent: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.persistent = persistent
+
+    def get(self, key: str) -> Any:
+        value = self.memory.get(key)
+        if value is not MISSING or self.persistent is None:
+            return value
+
+        value = self.persistent.get(key)
+        if value is not MISSING:
+            self.memory.set(key, value, self.persistent.remaining_ttl(key))
+        return value
+
+    def peek(self, key: str) -> Any:
+        """Like get(), without counting hits or misses or promoting persistent entries"""
+        value = self.memory.peek(key)
+        if value is not MISSING or self.persistent is None:
+            return value
+        return self.persistent.peek(key)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self.memory.set(key, value, ttl)
+        if self.persistent is not None:
+            self.persistent.set(key, value, ttl)
+
+    def delete(self, key: str):
+        self.memory.delete(key)
+        if self.persistent is not None:
+            self.persistent.delete(key)
+
+    def stats(self) -> dict:
+        stats = {"memory": self.memory.stats()}
+        if self.persistent is not None:
+            stats["persistent"] = self.persistent.stats()
+        return stats
+
+
+class BlobCache:
+    """
+    Least-recently-used cache of byte values kept in a content-addressed
+    BlobStore, bounded by the total size of its values. A SQLite index maps
+    each key to the hash, size and last access time of its value, so a value
+    that is also stored for other reasons (an illustration a story uses)
+    exists once. Evicted blobs are deleted unless another key or a story's
+    illustration_url still refers to them.
+    """
+
+    def __init__(self, blob_store, db_path: str, table: str, max_bytes: int):
+        self.blob_store = blob_store
+        self.table = table
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        rows = self._key_value_rows()
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, "
+            "blob_hash TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "last_access REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_last_access ON {table} (last_access)")
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_blob_hash ON {table} (blob_hash)")
+        for key, blob_hash, last_access in rows:
+            if self.blob_store.exists(blob_hash):
+                self._conn.execute(
+                    f"INSERT INTO {table} VALUES (?, ?, ?, ?)",
+                    (key, blob_hash, self.blob_store.size(blob_hash), last_access),
+                )
+        self._conn.commit()
+
+    def _key_value_rows(self) -> list:
+        """
+        Take over an index written by SQLiteCache (key -> JSON hash), from before
+        sizes were tracked: returns its (key, hash, created_at) rows and drops it
+        """
+        columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({self.table})")}
+        if not columns or "blob_hash" in columns:
+            return []
+        rows = self._conn.execute(f"SELECT key, value, created_at FROM {self.table}").fetchall()
+        self._conn.execute(f"DROP TABLE {self.table}")
+        return [(key, json.loads(value), created_at) for key, value, created_at in rows]
+
+    def get_hash(self, key: str) -> Any:
+        """Blob hash of the cached value (marking it recently used), or MISSING"""
+        with self._lock:
+            row = self._conn.execute(f"SELECT blob_hash FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is not None and not self.blob_store.exists(row[0]):
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                row = None
+            elif row is not None:
+                self._conn.execute(
+                    f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (time.time(), key)
+                )
+            self._conn.commit()
+            if row is None:
+                self.misses += 1
+                return MISSING
+            self.hits += 1
+            return row[0]
+
+    def get(self, key: str) -> Any:
+        blob_hash = self.get_hash(key)
+        if blob_hash is MISSING:
+            return MISSING
+        return self.blob_store.get(blob_hash)
+
+    def set(self, key: str, data: bytes) -> str:
+        """Store data in the blob store under key, evicting beyond max_bytes; returns its hash"""
+        blob_hash = self.blob_store.put(data)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, blob_hash, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, blob_hash, len(data), time.time()),
+            )
+            self._conn.commit()
+            self._evict()
+        return blob_hash
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def _evict(self):
+        """Drop least recently used entries until the total size fits max_bytes"""
+        excess = self._total_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+        evicted = []
+        for key, blob_hash, size in self._conn.execute(
+            f"SELECT key, blob_hash, size FROM {self.table} ORDER BY last_access"
+        ).fetchall():
+            if excess <= 0:
+                break
+            evicted.append((key, blob_hash))
+            excess -= size
+        self._conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", [(key,) for key, _ in evicted])
+        self._conn.commit()
+        self.evictions += len(evicted)
+        for blob_hash in {blob_hash for _, blob_hash in evicted}:
+            if not self._blob_in_use(blob_hash):
+                self.blob_store.delete(blob_hash)
+
+    def _blob_in_use(self, blob_hash: str) -> bool:
+        if self._conn.execute(f"SELECT 1 FROM {self.table} WHERE blob_hash = ?", (blob_hash,)).fetchone():
+            return True
+        try:
+            return self._conn.execute(
+                "SELECT 1 FROM stories WHERE illustration_url = ? LIMIT 1", (blob_url(blob_hash),)
+            ).fetchone() is not None
+        except sqlite3.OperationalError:
+            # No stories table in this database: keep the blob
+            return True
+
+    def _total_bytes(self) -> int:
+        return self._conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, total_bytes = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}"
+            ).fetchone()
+        return {
+            "entries": entries,
+            "bytes": total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,98 @@
+"""
+Deployment settings, read from LEGACYTREE_* environment variables.
+"""
+import os
+
+
+def env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+# --- Services ---
+# Disable services a deployment does not use; their ML packages are then never imported
+ENABLE_CONVERSATION = env_bool("LEGACYTREE_ENABLE_CONVERSATION", True)
+ENABLE_SPEECH = env_bool("LEGACYTREE_ENABLE_SPEECH", True)
+ENABLE_IMAGE_GENERATION = env_bool("LEGACYTREE_ENABLE_IMAGE_GENERATION", True)
+# Without the AI model, summaries use the lightweight fallback
+ENABLE_SUMMARIZATION_MODEL = env_bool("LEGACYTREE_ENABLE_SUMMARIZATION_MODEL", True)
+
+# --- Summarization ---
+# Inference backend for the summarizer on CPU: pytorch (fp32), int8 (dynamic
+# quantization) or onnx (onnxruntime, needs optimum[onnxruntime])
+SUMMARY_BACKEND = os.getenv("LEGACYTREE_SUMMARY_BACKEND", "pytorch")
+# Texts per model call in batch summarization
+SUMMARY_BATCH_SIZE = env_int("LEGACYTREE_SUMMARY_BATCH_SIZE", 8)
+# Keep summaries, titles and themes in the database as well as in memory
+SUMMARY_CACHE_PERSISTENT = env_bool("LEGACYTREE_SUMMARY_CACHE_PERSISTENT", True)
+# Long transcripts are summarized in overlapping chunks of this many tokens
+# (the model reads at most 1024), then the chunk summaries are summarized
+SUMMARY_CHUNK_TOKENS = env_int("LEGACYTREE_SUMMARY_CHUNK_TOKENS", 900)
+SUMMARY_CHUNK_OVERLAP = env_int("LEGACYTREE_SUMMARY_CHUNK_OVERLAP", 100)
+SUMMARY_CHUNK_SUMMARY_TOKENS = env_int("LEGACYTREE_SUMMARY_CHUNK_SUMMARY_TOKENS", 120)
+# Upper bound on chunks per level, which bounds latency for very long transcripts
+SUMMARY_MAX_CHUNKS = env_int("LEGACYTREE_SUMMARY_MAX_CHUNKS", 128)
+
+# --- Geocoding ---
+# GeoNames-style cities dump (e.g. cities15000.txt) for offline geocoding.
+# countryInfo.txt and admin1CodesASCII.txt next to it are used when present.
+GAZETTEER_PATH = os.getenv("LEGACYTREE_GAZETTEER_PATH", "")
+# Query Nominatim for locations the local gazetteer cannot resolve
+NOMINATIM_FALLBACK = env_bool("LEGACYTREE_NOMINATIM_FALLBACK", True)
+
+# --- Search ---
+# Semantic story search with sentence embeddings (GET /api/stories/search)
+ENABLE_SEARCH = env_bool("LEGACYTREE_ENABLE_SEARCH", True)
+SEARCH_MODEL = os.getenv("LEGACYTREE_SEARCH_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+SEARCH_INDEX_DIR = os.getenv("LEGACYTREE_SEARCH_INDEX_DIR", "./search_index")
+# Exact search up to this many stories; beyond it, an IVF index scoring the
+# stories of the SEARCH_NPROBE clusters nearest to the query
+SEARCH_IVF_MIN_STORIES = env_int("LEGACYTREE_SEARCH_IVF_MIN_STORIES", 20000)
+SEARCH_NPROBE = env_int("LEGACYTREE_SEARCH_NPROBE", 16)
+
+# --- Speech ---
+# Streaming speech-to-text (WebSocket /api/speech-to-text/stream): seconds of
+# speech between partial transcripts, the pause that ends an utterance, and the
+# longest utterance transcribed in one piece
+STT_PARTIAL_INTERVAL = env_float("LEGACYTREE_STT_PARTIAL_INTERVAL", 1.0)
+STT_SILENCE_MS = env_int("LEGACYTREE_STT_SILENCE_MS", 700)
+STT_MAX_SEGMENT_SECONDS = env_float("LEGACYTREE_STT_MAX_SEGMENT_SECONDS", 20.0)
+# A frame is speech when it is this many dB above the tracked background noise
+STT_VAD_THRESHOLD_DB = env_float("LEGACYTREE_STT_VAD_THRESHOLD_DB", 9.0)
+
+# --- Storage ---
+# Content-addressed store for generated illustrations and other media
+BLOB_STORE_DIR = os.getenv("LEGACYTREE_BLOB_DIR", "./blobs")
+
+# --- Illustrations ---
+# Rendered illustrations keyed by model, prompt and render settings, kept in the
+# blob store up to this many megabytes, least recently used evicted (0 disables)
+IMAGE_CACHE_MAX_BYTES = env_int("LEGACYTREE_IMAGE_CACHE_MB", 2048) * 1024 * 1024
+# Seed for illustration renders; the same story and style give the same image
+ILLUSTRATION_SEED = env_int("LEGACYTREE_ILLUSTRATION_SEED", 1234)
+# Illustration requests arriving within this window are rendered in one batch
+ILLUSTRATION_BATCH_WINDOW = env_float("LEGACYTREE_ILLUSTRATION_BATCH_WINDOW", 0.5)
+ILLUSTRATION_MAX_BATCH = env_int("LEGACYTREE_ILLUSTRATION_MAX_BATCH", 4)
+# Seconds POST /api/generate-illustration waits for a render before returning 202
+ILLUSTRATION_SYNC_WAIT = env_float("LEGACYTREE_ILLUSTRATION_SYNC_WAIT", 5.0)
+# Tiers whose models the illustration worker loads at startup (others load on
+# first use). Only the small preview model by default: loading SDXL base as
+# well holds two fp32 pipelines in memory on CPU
+ILLUSTRATION_PRELOAD_TIERS = [
+    tier.strip() for tier in os.getenv("LEGACYTREE_ILLUSTRATION_PRELOAD", "preview").split(",") if tier.strip()
+]
+# UNet optimizations, applied to tiers that are not CPU-offloaded
+ILLUSTRATION_CHANNELS_LAST = env_bool("LEGACYTREE_ILLUSTRATION_CHANNELS_LAST", False)
+ILLUSTRATION_TORCH_COMPILE = env_bool("LEGACYTREE_ILLUSTRATION_TORCH_COMPILE", False)
@@ -0,0 +1,194 @@
+import os
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Optional
+
+from geocoding import GeocoderBackend
+
+# GeoNames cities*.txt column positions
+_GEONAMEID, _NAME, _ASCIINAME, _ALTERNATENAMES, _LAT, _LON = 0, 1, 2, 3, 4, 5
+_COUNTRY_CODE, _ADMIN1_CODE, _POPULATION = 8, 10, 14
+
+
+def normalize_name(name: str) -> str:
+    """Lowercase, strip accents and punctuation ("São Paulo" -> "sao paulo")"""
+    decomposed = unicodedata.normalize("NFKD", name)
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    cleaned = "".join(ch if ch.isalnum() else " " for ch in stripped.lower())
+    return " ".join(cleaned.split())
+
+
+class GazetteerGeocoder(GeocoderBackend):
+    """
+    Offline geocoder over a GeoNames-style cities dump.
+
+    Places are held in parallel arrays (coordinates, population, country and
+    admin1 codes). Names are indexed as a sorted array of normalized keys, so
+    the places with a name are a contiguous range found by binary search.
+    Within a key, places are ordered by population, so the most populous match
+    comes first.
+    """
+
+    name = "gazetteer"
+    is_remote = False
+
+    def __init__(self, path: str, include_alternate_names: bool = True):
+        self.path = path
+        self.names: list[str] = []
+        self.lats = array("d")
+        self.lons = array("d")
+        self.populations = array("q")
+        self.geonameids = array("q")
+        self.country_codes: list[str] = []
+        self.admin1_codes: list[str] = []
+
+        # Sorted normalized name keys and the place index each one points to
+        self.keys: list[str] = []
+        self.key_places = array("i")
+
+        # Optional lookup tables for "City, Region, Country" qualifiers
+        self.country_names: dict[str, str] = {}  # normalized name/ISO code -> ISO code
+        self.country_display: dict[str, str] = {}  # ISO code -> country name
+        self.admin1_names: dict[str, str] = {}  # "CC.code" -> region name
+
+        self._load_places(include_alternate_names)
+        directory = os.path.dirname(os.path.abspath(path))
+        self._load_countries(os.path.join(directory, "countryInfo.txt"))
+        self._load_admin1(os.path.join(directory, "admin1CodesASCII.txt"))
+        print(f"✅ Gazetteer loaded: {len(self.names)} places, {len(self.keys)} names from {path}")
+
+    def _load_places(self, include_alternate_names: bool):
+        entries = []
+        intern = {}
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) <= _POPULATION:
+                    continue
+                try:
+                    lat, lon = float(fields[_LAT]), float(fields[_LON])
+                    population = int(fields[_POPULATION] or 0)
+                    geonameid = int(fields[_GEONAMEID])
+                except ValueError:
+                    continue
+
+                index = len(self.names)
+                self.names.append(fields[_NAME])
+                self.lats.append(lat)
+                self.lons.append(lon)
+                self.populations.append(population)
+                self.geonameids.append(geonameid)
+                country = fields[_COUNTRY_CODE]
+                self.country_codes.append(intern.setdefault(country, country))
+                admin1 = fields[_ADMIN1_CODE]
+                self.admin1_codes.append(intern.setdefault(admin1, admin1))
+
+                names = {fields[_NAME], fields[_ASCIINAME]}
+                if include_alternate_names and fields[_ALTERNATENAMES]:
+                    names.update(fields[_ALTERNATENAMES].split(","))
+                for name in names:
+                    key = normalize_name(name)
+                    if key:
+                        entries.append((key, -population, index))
+
+        entries.sort()
+        self.keys = [key for key, _, _ in entries]
+        self.key_places = array("i", (index for _, _, index in entries))
+
+    def _load_countries(self, path: str):
+        if not os.path.exists(path):
+            return
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("#"):
+                    continue
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) < 5:
+                    continue
+                iso, iso3, name = fields[0], fields[1], fields[4]
+                self.country_display[iso] = name
+                for alias in (iso, iso3, name):
+                    self.country_names[normalize_name(alias)] = iso
+
+    def _load_admin1(self, path: str):
+        if not os.path.exists(path):
+            return
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) >= 3:
+                    self.admin1_names[fields[0]] = fields[1]
+
+    def _range(self, key: str) -> tuple[int, int]:
+        return bisect_left(self.keys, key), bisect_right(self.keys, key)
+
+    def _qualifier_score(self, index: int, qualifiers: list[str]) -> int:
+        """Number of qualifiers ("ontario", "on", "canada", "ca") that match the place"""
+        country = self.country_codes[index]
+        admin1_code = self.admin1_codes[index]
+        admin1 = self.admin1_names.get(f"{country}.{admin1_code}", "")
+        matches = {normalize_name(country)}
+        if admin1_code:
+            matches.add(normalize_name(admin1_code))
+        if admin1:
+            matches.add(normalize_name(admin1))
+        country_name = self.country_display.get(country)
+        if country_name:
+            matches.add(normalize_name(country_name))
+
+        score = 0
+        for qualifier in qualifiers:
+            if qualifier in matches or self.country_names.get(qualifier) == country:
+                score += 1
+        return score
+
+    def _best_match(self, location: str) -> Optional[int]:
+        parts = [normalize_name(part) for part in location.split(",")]
+        parts = [part for part in parts if part]
+        if not parts:
+            return None
+
+        start, end = self._range(parts[0])
+        if start == end:
+            # Maybe the commas are part of the name itself
+            start, end = self._range(normalize_name(location))
+            parts = parts[:1]
+        if start == end:
+            return None
+
+        qualifiers = parts[1:]
+        best, best_rank = None, None
+        for position in range(start, end):
+            index = self.key_places[position]
+            rank = (self._qualifier_score(index, qualifiers), self.populations[index])
+            if best_rank is None or rank > best_rank:
+                best, best_rank = index, rank
+
+        # Qualifiers were given but none matched: let a better-informed tier answer
+        if qualifiers and best_rank[0] == 0 and (self.country_names or self.admin1_names):
+            return None
+        return best
+
+    def _info(self, index: int) -> dict:
+        country = self.country_codes[index]
+        parts = [self.names[index]]
+        admin1 = self.admin1_names.get(f"{country}.{self.admin1_codes[index]}")
+        if admin1:
+            parts.append(admin1)
+        parts.append(self.country_display.get(country, country))
+        return {
+            "latitude": self.lats[index],
+            "longitude": self.lons[index],
+            "address": ", ".join(parts),
+            "raw": {
+                "source": self.name,
+                "geonameid": self.geonameids[index],
+                "population": self.populations[index],
+                "country_code": country,
+            }
+        }
+
+    def geocode(self, location: str) -> Optional[dict]:
+        index = self._best_match(location)
+        return self._info(index) if index is not None else None
@@ -1,86 +1,253 @@
+from abc import ABC, abstractmethod
 from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
-import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+import threading
 import ssl
 import certifi
 
-class GeocodingService:
-    def __init__(self):
+import config
+from cache import MISSING, LRUCache, SQLiteCache, TwoTierCache
+from rate_limiter import TokenBucket
+
+GEOCODE_CACHE_DB_PATH = "./legacytree.db"
+GEOCODE_CACHE_TABLE = "geocode_cache"
+GEOCODE_CACHE_MAX_ENTRIES = 4096
+GEOCODE_CACHE_MAX_PERSISTENT = 100000
+GEOCODE_CACHE_TTL = 90 * 24 * 3600  # 90 days for successful lookups
+GEOCODE_NEGATIVE_CACHE_TTL = 24 * 3600  # 1 day for "not found" locations
+GEOCODE_MAX_WORKERS = 4
+
+# Nominatim usage policy allows at most 1 request per second for the whole
+# application, so the limiter is shared by every GeocodingService instance
+NOMINATIM_RATE_LIMITER = TokenBucket(rate=1.0, capacity=1.0)
+
+
+def normalize_location(location: str) -> str:
+    """Normalize a location string into a cache key ("  toronto ,CANADA" -> "toronto, canada")"""
+    parts = [" ".join(part.split()) for part in location.lower().split(",")]
+    return ", ".join(part for part in parts if part)
+
 
+class GeocoderBackend(ABC):
+    """
+    A geocoding tier. geocode() returns a location info dict, None if the tier
+    does not know the location, and raises on lookup errors.
+    Remote tiers are called from the rate-limited geocoder pool; local tiers are
+    called inline, so they must answer without blocking.
+    """
+
+    name = "base"
+    is_remote = False
+
+    @abstractmethod
+    def geocode(self, location: str) -> Optional[dict]:
+        ...
+
+
+class NominatimGeocoder(GeocoderBackend):
+    name = "nominatim"
+    is_remote = True
+
+    def __init__(self, rate_limiter: TokenBucket = NOMINATIM_RATE_LIMITER):
         ssl_context = ssl.create_default_context(cafile=certifi.where())
-        
+
         self.geolocator = Nominatim(
             user_agent="LegacyTree Family Story Preservation App",
             timeout=10,
             ssl_context=ssl_context
         )
-    
-    def get_coordinates(self, location: str) -> tuple[float, float]:
+        self.rate_limiter = rate_limiter
+
+    def geocode(self, location: str) -> Optional[dict]:
+        self.rate_limiter.acquire()
+        location_data = self.geolocator.geocode(location)
+        if not location_data:
+            return None
+        return {
+            "latitude": location_data.latitude,
+            "longitude": location_data.longitude,
+            "address": location_data.address,
+            "raw": location_data.raw
+        }
+
+
+def build_geocoder_backends() -> list[GeocoderBackend]:
+    """Geocoder tiers from config: the offline gazetteer first, Nominatim as fallback"""
+    backends = []
+    if config.GAZETTEER_PATH:
+        from gazetteer import GazetteerGeocoder
+        try:
+            backends.append(GazetteerGeocoder(config.GAZETTEER_PATH))
+        except OSError as e:
+            print(f"❌ Could not load gazetteer from {config.GAZETTEER_PATH}: {e}")
+    if config.NOMINATIM_FALLBACK:
+        backends.append(NominatimGeocoder())
+    if not backends:
+        print("⚠️ No geocoder backends configured, locations will not be geocoded")
+    return backends
+
+
+class GeocodingService:
+    def __init__(
+        self,
+        backends: Optional[list[GeocoderBackend]] = None,
+        cache_db_path: Optional[str] = GEOCODE_CACHE_DB_PATH
+    ):
+        if backends is None:
+            backends = build_geocoder_backends()
+        self.local_backends = [b for b in backends if not b.is_remote]
+        self.remote_backends = [b for b in backends if b.is_remote]
+
+        # In-process LRU in front of a persistent SQLite table, so warm lookups
+        # never touch the network (or the Nominatim throttle)
+        self.cache = TwoTierCache(
+            LRUCache(max_entries=GEOCODE_CACHE_MAX_ENTRIES),
+            SQLiteCache(cache_db_path, GEOCODE_CACHE_TABLE, GEOCODE_CACHE_MAX_PERSISTENT) if cache_db_path else None
+        )
+        if self.cache.persistent is not None:
+            # Later writes prune every SQLiteCache.PRUNE_INTERVAL; drop what expired while stopped
+            removed = self.cache.persistent.prune()
+            if removed:
+                print(f"✅ Removed {removed} expired geocode cache entries")
+        self.network_lookups = 0
+        self.coalesced_lookups = 0
+        self.backend_hits = {b.name: 0 for b in backends}
+
+        # Network lookups run on a small dedicated pool; concurrent requests for
+        # the same location share a single in-flight future
+        self._executor = ThreadPoolExecutor(max_workers=GEOCODE_MAX_WORKERS, thread_name_prefix="geocoder")
+        self._in_flight: dict[str, Future] = {}
+        self._in_flight_waiters: dict[str, int] = {}
+        # Reentrant: cancel_lookup() runs the done callback while holding it
+        self._in_flight_lock = threading.RLock()
+
+    def lookup_offline(self, location: str):
         """
-        Convert location string to (latitude, longitude)
-        Returns default coordinates (Toronto) if geocoding fails
+        Resolve a location from the cache and local tiers only.
+        Returns a location info dict, None if it is known not to exist, or
+        MISSING if a network lookup is needed.
         """
-        try:
-            
-            time.sleep(1)
-            
-            location_data = self.geolocator.geocode(location)
-            
-            if location_data:
-                print(f"✅ Successfully geocoded '{location}' to ({location_data.latitude}, {location_data.longitude})")
-                return (location_data.latitude, location_data.longitude)
-            else:
-                # Default to Toronto if location not found
-                print(f"❌ Location '{location}' not found, using default coordinates")
-                return (43.6532, -79.3832)
-                
-        except (GeocoderTimedOut, GeocoderUnavailable) as e:
-            print(f"❌ Geocoding error for '{location}': {e}")
-            # Default to Toronto on error
-            return (43.6532, -79.3832)
-        except Exception as e:
-            print(f"❌ Unexpected geocoding error for '{location}': {e}")
-            # Default to Toronto on error
-            return (43.6532, -79.3832)
-    
-    def get_location_info(self, location: str) -> dict:
+        key = normalize_location(location)
+        cached = self.cache.get(key)
+        if cached is not MISSING:
+            return cached
+
+        for backend in self.local_backends:
+            info = backend.geocode(location)
+            if info:
+                self.backend_hits[backend.name] += 1
+                self.cache.set(key, info, GEOCODE_CACHE_TTL)
+                return info
+
+        if not self.remote_backends:
+            self.cache.set(key, None, GEOCODE_NEGATIVE_CACHE_TTL)
+            return None
+        return MISSING
+
+    def lookup_async(self, location: str) -> Future:
         """
-        Get detailed location information
+        Resolve a location without blocking the caller.
+        Returns a Future resolving to a location info dict, or None if the location
+        does not exist; geocoder errors are raised from Future.result().
+        Use asyncio.wrap_future() to await it from async code.
         """
-        try:
-            time.sleep(1)
-            location_data = self.geolocator.geocode(location)
-            
-            if location_data:
-                print(f"✅ Successfully geocoded '{location}' to ({location_data.latitude}, {location_data.longitude})")
-                return {
-                    "latitude": location_data.latitude,
-                    "longitude": location_data.longitude,
-                    "address": location_data.address,
-                    "raw": location_data.raw
-                }
-            else:
-                print(f"❌ Location '{location}' not found, using default coordinates")
-                return {
-                    "latitude": 43.6532,
-                    "longitude": -79.3832,
-                    "address": "Toronto, Canada",
-                    "raw": None
-                }
-                
-        except (GeocoderTimedOut, GeocoderUnavailable) as e:
-            print(f"❌ Geocoding error: {e}")
-            return {
-                "latitude": 43.6532,
-                "longitude": -79.3832,
-                "address": "Toronto, Canada",
-                "raw": None
-            }
-        except Exception as e:
-            print(f"❌ Unexpected geocoding error: {e}")
-            return {
-                "latitude": 43.6532,
-                "longitude": -79.3832,
-                "address": "Toronto, Canada",
-                "raw": None
-            } 
\ No newline at end of file
+        key = normalize_location(location)
+        resolved = self.lookup_offline(location)
+        if resolved is not MISSING:
+            return self._completed(resolved)
+
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced_lookups += 1
+                self._in_flight_waiters[key] += 1
+                return future
+
+            # Another caller may have finished the lookup since we checked;
+            # peek, since lookup_offline() already counted this lookup
+            cached = self.cache.peek(key)
+            if cached is not MISSING:
+                return self._completed(cached)
+
+            future = self._executor.submit(self._fetch, location, key)
+            self._in_flight[key] = future
+            self._in_flight_waiters[key] = 1
+
+        future.add_done_callback(lambda _: self._forget_in_flight(key))
+        return future
+
+    def cancel_lookup(self, location: str) -> bool:
+        """
+        Give up on a lookup_async() result. The network lookup is cancelled
+        if it has not started yet and no other caller is waiting for it.
+        """
+        key = normalize_location(location)
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                return False
+            self._in_flight_waiters[key] -= 1
+            if self._in_flight_waiters[key] > 0:
+                return False
+            return future.cancel()
+
+    def group_locations(self, locations: list[str]) -> list[tuple[str, list[int], str]]:
+        """
+        Deduplicate locations by normalized key, without looking them up.
+        Returns (key, input positions, first spelling seen) in first-seen order.
+        """
+        positions: dict[str, list[int]] = {}
+        first_seen: dict[str, str] = {}
+        for i, location in enumerate(locations):
+            key = normalize_location(location)
+            if not key:
+                continue
+            positions.setdefault(key, []).append(i)
+            first_seen.setdefault(key, location)
+        return [(key, positions[key], first_seen[key]) for key in positions]
+
+    @staticmethod
+    def _completed(value) -> Future:
+        future = Future()
+        future.set_result(value)
+        return future
+
+    def _forget_in_flight(self, key: str):
+        with self._in_flight_lock:
+            self._in_flight.pop(key, None)
+            self._in_flight_waiters.pop(key, None)
+
+    def _fetch(self, location: str, key: str) -> Optional[dict]:
+        """
+        Query the remote tiers in order (runs on the geocoder pool).
+        Results (including "not found") are cached; errors propagate and are not cached.
+        """
+        error = None
+        for backend in self.remote_backends:
+            try:
+                self.network_lookups += 1
+                info = backend.geocode(location)
+            except Exception as e:
+                error = e
+                continue
+            if info:
+                self.backend_hits[backend.name] += 1
+                self.cache.set(key, info, GEOCODE_CACHE_TTL)
+                print(f"✅ Successfully geocoded '{location}' to ({info['latitude']}, {info['longitude']})")
+                return info
+
+        if error is not None:
+            raise error
+        self.cache.set(key, None, GEOCODE_NEGATIVE_CACHE_TTL)
+        return None
+
+    def cache_stats(self) -> dict:
+        """Hit/miss counters for the geocoding cache tiers"""
+        stats = self.cache.stats()
+        stats["network_lookups"] = self.network_lookups
+        stats["coalesced_lookups"] = self.coalesced_lookups
+        stats["in_flight"] = len(self._in_flight)
+        stats["backend_hits"] = dict(self.backend_hits)
+        stats["rate_limiter"] = NOMINATIM_RATE_LIMITER.stats()
+        return stats
@@ -0,0 +1,214 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import wait
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from geocoding import GeocodingService, normalize_location
+from models import Story
+
+GEOCODE_STATUS_PENDING = "pending"
+GEOCODE_STATUS_RESOLVED = "resolved"
+GEOCODE_STATUS_NOT_FOUND = "not_found"
+GEOCODE_STATUS_FAILED = "failed"
+
+
+class GeocodingWorker:
+    """
+    Background worker that resolves story coordinates after the story is saved.
+
+    Story ids are queued with a due time. The worker drains due ids in batches,
+    looks up each distinct location once through the (rate-limited, cached)
+    GeocodingService, and writes lat/lon back to the stories. Failed lookups are
+    retried with exponential backoff before the story is marked as failed.
+    """
+
+    def __init__(
+        self,
+        geocoding_service: GeocodingService,
+        session_factory: Callable[[], Session],
+        batch_size: int = 25,
+        max_attempts: int = 5,
+        base_backoff: float = 5.0,
+        max_backoff: float = 600.0,
+    ):
+        self.geocoding_service = geocoding_service
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        # Heap of (due_time, sequence, story_id, attempt)
+        self._queue: list[tuple[float, int, int, int]] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+        self.resolved = 0
+        self.not_found = 0
+        self.failed = 0
+        self.retries = 0
+
+    def start(self):
+        """Start the worker thread and re-queue stories left pending by a previous run"""
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="geocoding-worker", daemon=True)
+        self._thread.start()
+        self.resume_pending()
+
+    def stop(self, timeout: float = 5.0):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def enqueue(self, story_id: int, attempt: int = 0, delay: float = 0.0):
+        with self._condition:
+            heapq.heappush(self._queue, (time.monotonic() + delay, next(self._sequence), story_id, attempt))
+            self._condition.notify()
+
+    def resume_pending(self) -> int:
+        db = self.session_factory()
+        try:
+            ids = [row.id for row in db.query(Story.id).filter(Story.geocode_status == GEOCODE_STATUS_PENDING)]
+        finally:
+            db.close()
+        for story_id in ids:
+            self.enqueue(story_id)
+        if ids:
+            print(f"🔄 Re-queued {len(ids)} stories for background geocoding")
+        return len(ids)
+
+    def _next_batch(self) -> list[tuple[int, int]]:
+        """Block until at least one story is due, then pop up to batch_size due stories"""
+        with self._condition:
+            while not self._stopping:
+                if self._queue:
+                    wait_for = self._queue[0][0] - time.monotonic()
+                    if wait_for <= 0:
+                        break
+                    self._condition.wait(wait_for)
+                else:
+                    self._condition.wait()
+            if self._stopping:
+                return []
+
+            batch = []
+            now = time.monotonic()
+            while self._queue and self._queue[0][0] <= now and len(batch) < self.batch_size:
+                _, _, story_id, attempt = heapq.heappop(self._queue)
+                batch.append((story_id, attempt))
+            return batch
+
+    def _run(self):
+        while not self._stopping:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self._process_batch(batch)
+            except Exception as e:
+                print(f"❌ Background geocoding batch failed: {e}")
+                for story_id, attempt in batch:
+                    self._retry_or_fail(story_id, attempt)
+
+    def _process_batch(self, batch: list[tuple[int, int]]):
+        attempts = dict(batch)
+        db = self.session_factory()
+        try:
+            stories = (
+                db.query(Story)
+                .filter(Story.id.in_(attempts), Story.geocode_status == GEOCODE_STATUS_PENDING)
+                .all()
+            )
+
+            # One lookup per distinct location; the service coalesces and rate-limits
+            futures = {}
+            for story in stories:
+                key = normalize_location(story.location)
+                if key not in futures:
+                    futures[key] = self.geocoding_service.lookup_async(story.location)
+            wait(futures.values())
+
+            for story in stories:
+                future = futures[normalize_location(story.location)]
+                if not self._claim(db, story):
+                    # Edited or deleted during the lookup; an edit queues its own lookup
+                    continue
+                if future.exception() is not None:
+                    print(f"❌ Geocoding error for '{story.location}': {future.exception()}")
+                    self._retry_or_fail(story.id, attempts[story.id], story)
+                    continue
+
+                info = future.result()
+                if info:
+                    story.lat = info["latitude"]
+                    story.lon = info["longitude"]
+                    story.geocode_status = GEOCODE_STATUS_RESOLVED
+                    self.resolved += 1
+                else:
+                    # Keep the coordinates the story was saved with
+                    print(f"❌ Location '{story.location}' not found, keeping saved coordinates")
+                    story.geocode_status = GEOCODE_STATUS_NOT_FOUND
+                    self.not_found += 1
+
+            db.commit()
+        finally:
+            db.close()
+
+    def _claim(self, db: Session, story: Story) -> bool:
+        """
+        True if the story still has the location that was looked up and is
+        still pending. The no-op UPDATE takes the database write lock, so the
+        row cannot change again before this session commits; the story is
+        then refreshed so the write starts from its current values.
+        """
+        claimed = (
+            db.query(Story)
+            .filter(
+                Story.id == story.id,
+                Story.location == story.location,
+                Story.geocode_status == GEOCODE_STATUS_PENDING
+            )
+            .update({"geocode_status": GEOCODE_STATUS_PENDING}, synchronize_session=False)
+        )
+        if claimed:
+            db.refresh(story)
+        return bool(claimed)
+
+    def _retry_or_fail(self, story_id: int, attempt: int, story: Story = None):
+        attempt += 1
+        if attempt < self.max_attempts:
+            delay = min(self.max_backoff, self.base_backoff * (2 ** (attempt - 1)))
+            self.retries += 1
+            self.enqueue(story_id, attempt, delay)
+        else:
+            self.failed += 1
+            if story is not None:
+                story.geocode_status = GEOCODE_STATUS_FAILED
+            else:
+                db = self.session_factory()
+                try:
+                    db.query(Story).filter(Story.id == story_id).update({"geocode_status": GEOCODE_STATUS_FAILED})
+                    db.commit()
+                finally:
+                    db.close()
+
+    def stats(self) -> dict:
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "queued": len(self._queue),
+            "resolved": self.resolved,
+            "not_found": self.not_found,
+            "failed": self.failed,
+            "retries": self.retries,
+        }
@@ -0,0 +1,490 @@
+import hashlib
+import multiprocessing
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import config
+from blob_store import BlobStore, blob_url
+from cache import BlobCache
+from models import IllustrationJob
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+IMAGE_CACHE_DB_PATH = "./legacytree.db"
+IMAGE_CACHE_TABLE = "image_cache"
+
+# Delay before restarting a crashed worker, doubling while it keeps crashing
+# soon after start (e.g. when a model fails to load)
+RESTART_BACKOFF = 5.0
+RESTART_BACKOFF_MAX = 300.0
+
+
+def illustration_request_key(story_text: str, style: str, tier: str) -> str:
+    # Full-tier keys leave the tier out, as before tiers existed, so jobs
+    # created back then are still found
+    inputs = f"{style}\n{story_text}" if tier == "full" else f"{tier}\n{style}\n{story_text}"
+    return hashlib.sha256(inputs.encode()).hexdigest()
+
+
+def _next_batch(requests, window: float, max_batch: int) -> tuple[list, bool]:
+    """
+    Block for a request, then collect whatever else arrives within `window`
+    seconds, up to max_batch. Returns (batch, stop requested).
+    """
+    request = requests.get()
+    if request is None:
+        return [], True
+    batch = [request]
+    deadline = time.monotonic() + window
+    while len(batch) < max_batch:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            request = requests.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if request is None:
+            return batch, True
+        batch.append(request)
+    return batch, False
+
+
+def _illustration_worker(
+    requests,
+    events,
+    use_gpu: bool,
+    blob_root: str,
+    cache_max_bytes: int,
+    batch_window: float,
+    max_batch: int,
+    preload_tiers: list,
+):
+    """
+    Entry point of the illustration worker process, the only process that holds
+    the diffusion pipelines (one per quality tier). Reads
+    (job_id, story_text, style, tier) from `requests`, renders requests of the
+    same tier that arrive close together as one batched pipeline call, and
+    reports ("batch" | "running" | "progress" | "done" | "failed", job_id, ...)
+    on `events`, plus ("cache", None, hits, misses, evictions) with the image cache
+    lookups made since the last report.
+    """
+    from image_generation import ILLUSTRATION_TIERS, ImageGenerationService
+
+    cache = (
+        BlobCache(BlobStore(blob_root), IMAGE_CACHE_DB_PATH, IMAGE_CACHE_TABLE, cache_max_bytes)
+        if cache_max_bytes > 0 else None
+    )
+    services = {
+        tier: ImageGenerationService(use_gpu=use_gpu, cache=cache, tier=tier)
+        for tier in ILLUSTRATION_TIERS
+    }
+    for tier in preload_tiers:
+        if tier in services:
+            started = time.monotonic()
+            services[tier].load_model()
+            events.put(("ready", tier, services[tier].model_loaded, time.monotonic() - started))
+
+    stop = False
+    while not stop:
+        batch, stop = _next_batch(requests, batch_window, max_batch)
+        by_tier = {}
+        for request in batch:
+            by_tier.setdefault(request[3], []).append(request)
+        for tier, tier_batch in by_tier.items():
+            _render_batch(services[tier], tier_batch, events)
+        if cache is not None and (cache.hits or cache.misses or cache.evictions):
+            events.put(("cache", None, cache.hits, cache.misses, cache.evictions))
+            cache.hits = cache.misses = cache.evictions = 0
+
+
+def _render_batch(service, batch: list, events):
+    job_ids = [job_id for job_id, _, _, _ in batch]
+    events.put(("batch", None, len(batch)))
+    for job_id in job_ids:
+        events.put(("running", job_id, 0, service.num_inference_steps))
+
+    def on_progress(step, total):
+        for job_id in job_ids:
+            events.put(("progress", job_id, step, total))
+
+    try:
+        results = service.render_illustrations(
+            [(story_text, style) for _, story_text, style, _ in batch],
+            progress_callback=on_progress
+        )
+    except Exception as e:
+        for job_id in job_ids:
+            events.put(("failed", job_id, str(e)))
+        return
+    for job_id, png_data in zip(job_ids, results):
+        if png_data is None:
+            events.put(("failed", job_id, "Failed to generate illustration"))
+        else:
+            events.put(("done", job_id, png_data))
+
+
+class IllustrationJobManager:
+    """
+    Runs illustration generation as persisted jobs on a dedicated worker process.
+
+    Jobs are stored in the illustration_jobs table, so their status survives
+    restarts and a client retrying the same (text, style, tier) gets the existing job,
+    and its stored result, instead of a new render. A listener thread applies
+    the worker's progress events to the job rows and saves finished images to
+    the blob store. With an image cache, a request whose render settings were
+    rendered before completes on submit without reaching the worker.
+
+    Requests that arrive within batch_window seconds of each other are rendered
+    together, up to max_batch per pipeline call. A "preview" tier job can be
+    followed by a "full" tier refinement job for the same story.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        blob_store: BlobStore,
+        use_gpu: bool = False,
+        image_cache: Optional[BlobCache] = None,
+        batch_window: float = config.ILLUSTRATION_BATCH_WINDOW,
+        max_batch: int = config.ILLUSTRATION_MAX_BATCH,
+    ):
+        from image_generation import ILLUSTRATION_TIERS, ImageGenerationService
+
+        self.session_factory = session_factory
+        self.blob_store = blob_store
+        self.use_gpu = use_gpu
+        self.image_cache = image_cache
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        # Never load a model here: only used to compute render settings for cache lookups
+        self._settings_services = {
+            tier: ImageGenerationService(use_gpu=use_gpu, cache=image_cache, tier=tier)
+            for tier in ILLUSTRATION_TIERS
+        }
+
+        # Spawn, so the worker does not inherit the API server's threads and locks
+        self._context = multiprocessing.get_context("spawn")
+        self._requests = self._context.Queue()
+        self._events = self._context.Queue()
+        self._process = None
+        self._listener = None
+        self._stopping = False
+        self._finished = threading.Condition()
+        self.model_loaded = {}
+        self.model_load_seconds = {}
+        self.restarts = 0
+        self._process_started = 0.0
+        self._restart_delay = 0.0
+        self._restart_at = None
+        self.batches = 0
+        self.batched_requests = 0
+        # Image cache lookups made by the worker process
+        self.worker_cache_hits = 0
+        self.worker_cache_misses = 0
+        self.worker_cache_evictions = 0
+        # Seconds from submit to finished render, for recent jobs
+        self._latencies = deque(maxlen=500)
+
+    # --- Lifecycle ---
+
+    def start(self):
+        if self._process is not None:
+            return
+        self._stopping = False
+        self._start_process()
+        self._listener = threading.Thread(target=self._listen, name="illustration-jobs", daemon=True)
+        self._listener.start()
+        self._requeue_unfinished()
+
+    def stop(self, timeout: float = 10.0):
+        self._stopping = True
+        if self._process is not None:
+            self._requests.put(None)
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
+
+    def _start_process(self):
+        self._process = self._context.Process(
+            target=_illustration_worker,
+            args=(
+                self._requests,
+                self._events,
+                self.use_gpu,
+                self.blob_store.root,
+                self.image_cache.max_bytes if self.image_cache else 0,
+                self.batch_window,
+                self.max_batch,
+                config.ILLUSTRATION_PRELOAD_TIERS,
+            ),
+            name="illustration-worker",
+            daemon=True
+        )
+        self._process.start()
+        self._process_started = time.monotonic()
+
+    def _requeue_unfinished(self):
+        """Queue jobs left queued or running by a previous server run"""
+        db = self.session_factory()
+        try:
+            jobs = (
+                db.query(IllustrationJob)
+                .filter(IllustrationJob.status.in_([JOB_QUEUED, JOB_RUNNING]))
+                .order_by(IllustrationJob.created_at)
+                .all()
+            )
+            for job in jobs:
+                job.status = JOB_QUEUED
+                job.step = 0
+                self._requests.put((job.id, job.story_text, job.style, job.tier))
+            db.commit()
+        finally:
+            db.close()
+        if jobs:
+            print(f"🔄 Re-queued {len(jobs)} illustration jobs")
+
+    # --- Jobs ---
+
+    def submit(self, story_text: str, style: str, tier: str = "full") -> dict:
+        """
+        Create a job, or return the existing job for the same text, style and tier.
+        A failed job, or a done job whose image is gone from the blob store, is queued again.
+        """
+        settings_service = self._settings_services.get(tier)
+        if settings_service is None:
+            raise ValueError(f"Unknown illustration tier: {tier}")
+        request_key = illustration_request_key(story_text, style, tier)
+        db = self.session_factory()
+        try:
+            # request_key is unique, so of two identical requests only one inserts
+            created = db.execute(
+                sqlite_insert(IllustrationJob)
+                .values(
+                    id=uuid.uuid4().hex,
+                    request_key=request_key,
+                    story_text=story_text,
+                    style=style,
+                    tier=tier,
+                    status=JOB_QUEUED
+                )
+                .on_conflict_do_nothing(index_elements=["request_key"])
+            ).rowcount
+            job = db.query(IllustrationJob).filter(IllustrationJob.request_key == request_key).one()
+            if not created:
+                if job.status in (JOB_QUEUED, JOB_RUNNING) or (
+                    job.status == JOB_DONE and self.blob_store.exists(job.result_hash)
+                ):
+                    return self._to_dict(job)
+                # Only one of several concurrent retries moves the job back to queued
+                requeued = (
+                    db.query(IllustrationJob)
+                    .filter(IllustrationJob.id == job.id, IllustrationJob.status == job.status)
+                    .update(
+                        {"status": JOB_QUEUED, "step": 0, "result_hash": None, "error": None},
+                        synchronize_session=False
+                    )
+                )
+                if not requeued:
+                    db.rollback()
+                    db.refresh(job)
+                    return self._to_dict(job)
+            db.commit()
+
+            cached_hash = settings_service.cached_illustration_hash(story_text, style)
+            if cached_hash is not None:
+                job.result_hash = cached_hash
+                job.status = JOB_DONE
+                job.step = job.total_steps = settings_service.num_inference_steps
+                db.commit()
+            else:
+                self._requests.put((job.id, story_text, style, tier))
+            db.refresh(job)
+            return self._to_dict(job)
+        finally:
+            db.close()
+
+    def tier_loading(self, tier: str) -> bool:
+        """True while the worker is still preloading a tier's model"""
+        return tier in config.ILLUSTRATION_PRELOAD_TIERS and tier not in self.model_loaded
+
+    def get(self, job_id: str) -> Optional[dict]:
+        db = self.session_factory()
+        try:
+            job = db.get(IllustrationJob, job_id)
+            return self._to_dict(job) if job is not None else None
+        finally:
+            db.close()
+
+    def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        """Block until a job is done or failed, or the timeout passes"""
+        deadline = time.monotonic() + timeout
+        with self._finished:
+            while True:
+                job = self.get(job_id)
+                remaining = deadline - time.monotonic()
+                if job is None or job["status"] in (JOB_DONE, JOB_FAILED) or remaining <= 0:
+                    return job
+                self._finished.wait(min(remaining, 1.0))
+
+    @staticmethod
+    def _to_dict(job: IllustrationJob) -> dict:
+        return {
+            "job_id": job.id,
+            "status": job.status,
+            "step": job.step,
+            "total_steps": job.total_steps,
+            "style": job.style,
+            "tier": job.tier,
+            "illustration_url": blob_url(job.result_hash) if job.result_hash else None,
+            "illustration_hash": job.result_hash,
+            "error": job.error,
+            "created_at": job.created_at,
+            "updated_at": job.updated_at,
+        }
+
+    # --- Worker events ---
+
+    def _listen(self):
+        while not self._stopping:
+            try:
+                event = self._events.get(timeout=1.0)
+            except queue.Empty:
+                self._check_worker()
+                continue
+            try:
+                self._apply_event(event)
+            except Exception as e:
+                print(f"❌ Error applying illustration job event: {e}")
+
+    def _check_worker(self):
+        """Restart a crashed worker with backoff; the job it was running is marked failed"""
+        if self._stopping or self._process is None or self._process.is_alive():
+            return
+        now = time.monotonic()
+        if self._restart_at is None:
+            self._fail_running("Illustration worker exited")
+            if now - self._process_started > RESTART_BACKOFF_MAX:
+                self._restart_delay = 0.0
+            self._restart_delay = min(max(2 * self._restart_delay, RESTART_BACKOFF), RESTART_BACKOFF_MAX)
+            self._restart_at = now + self._restart_delay
+            print(f"❌ Illustration worker exited, restarting in {self._restart_delay:.0f}s")
+        if now >= self._restart_at:
+            self._restart_at = None
+            self.restarts += 1
+            self._start_process()
+
+    def _fail_running(self, error: str):
+        db = self.session_factory()
+        try:
+            db.query(IllustrationJob).filter(IllustrationJob.status == JOB_RUNNING).update(
+                {"status": JOB_FAILED, "error": error}
+            )
+            db.commit()
+        finally:
+            db.close()
+        with self._finished:
+            self._finished.notify_all()
+
+    def _apply_event(self, event: tuple):
+        kind, job_id = event[0], event[1]
+        if kind == "ready":
+            self.model_loaded[event[1]] = event[2]
+            self.model_load_seconds[event[1]] = round(event[3], 2)
+            return
+        if kind == "batch":
+            self.batches += 1
+            self.batched_requests += event[2]
+            return
+        if kind == "cache":
+            self.worker_cache_hits += event[2]
+            self.worker_cache_misses += event[3]
+            self.worker_cache_evictions += event[4]
+            return
+
+        db = self.session_factory()
+        try:
+            job = db.get(IllustrationJob, job_id)
+            if job is None:
+                return
+            if kind in ("running", "progress"):
+                job.status = JOB_RUNNING
+                job.step, job.total_steps = event[2], event[3]
+            elif kind == "done":
+                job.result_hash = self.blob_store.put(event[2])
+                job.status = JOB_DONE
+                job.step = job.total_steps or job.step
+                if job.created_at is not None:
+                    self._latencies.append((datetime.utcnow() - job.created_at).total_seconds())
+            elif kind == "failed":
+                job.status = JOB_FAILED
+                job.error = event[2]
+            db.commit()
+        finally:
+            db.close()
+
+        if kind in ("done", "failed"):
+            with self._finished:
+                self._finished.notify_all()
+
+    def _queued_count(self) -> Optional[int]:
+        try:
+            return self._requests.qsize()
+        except NotImplementedError:  # macOS
+            return None
+
+    def latency_stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        if not latencies:
+            return {"count": 0}
+        return {
+            "count": len(latencies),
+            "mean_seconds": round(sum(latencies) / len(latencies), 2),
+            "p50_seconds": round(latencies[len(latencies) // 2], 2),
+            "p95_seconds": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2),
+        }
+
+    def batch_stats(self) -> dict:
+        mean_size = self.batched_requests / self.batches if self.batches else None
+        return {
+            "batches": self.batches,
+            "requests": self.batched_requests,
+            "mean_batch_size": round(mean_size, 2) if mean_size else None,
+            "mean_fill": round(mean_size / self.max_batch, 2) if mean_size else None,
+            "max_batch": self.max_batch,
+            "window_seconds": self.batch_window,
+        }
+
+    def image_cache_stats(self) -> Optional[dict]:
+        """Size, lookups by this process (on submit) and the worker (before rendering), and evictions"""
+        if self.image_cache is None:
+            return None
+        stats = self.image_cache.stats()
+        stats["hits"] += self.worker_cache_hits
+        stats["misses"] += self.worker_cache_misses
+        stats["evictions"] += self.worker_cache_evictions
+        return stats
+
+    def stats(self) -> dict:
+        return {
+            "worker_alive": self._process is not None and self._process.is_alive(),
+            "model_loaded": self.model_loaded,
+            "model_load_seconds": self.model_load_seconds,
+            "queued": self._queued_count(),
+            "restarts": self.restarts,
+            "batching": self.batch_stats(),
+            "latency": self.latency_stats(),
+            "image_cache": self.image_cache_stats(),
+        }
@@ -1,26 +1,63 @@
-from diffusers import DiffusionPipeline
-import torch
-from PIL import Image
 import io
-import base64
+import json
 import os
-from typing import Optional
+from typing import Callable, List, Optional, Tuple
+
+import config
+from cache import MISSING, BlobCache
+from keyword_matcher import prompt_scenes_for, story_keywords
+
+# Quality tiers. "preview" is a few-step distilled model at reduced resolution,
+# for a first image within seconds; "full" is SDXL base.
+ILLUSTRATION_TIERS = {
+    "full": {
+        "model": "stabilityai/stable-diffusion-xl-base-1.0",
+        "steps": 20,  # Reduced for faster generation
+        "size": 512,
+        "guidance_scale": 7.5,
+        "cpu_offload": True,
+    },
+    "preview": {
+        "model": "stabilityai/sdxl-turbo",
+        "steps": 2,
+        "size": 384,
+        "guidance_scale": 0.0,  # Turbo models are trained without classifier-free guidance
+        "cpu_offload": False,
+    },
+}
+DEFAULT_TIER = "full"
 
 class ImageGenerationService:
-    def __init__(self, use_gpu=True):
-        self.use_gpu = use_gpu and torch.cuda.is_available()
+    def __init__(self, use_gpu=True, cache: Optional[BlobCache] = None, tier: str = DEFAULT_TIER):
+        self.use_gpu = use_gpu  # Checked against CUDA availability when the model loads
         self.pipeline = None
         self.model_loaded = False
+        self.tier = tier
+        tier_settings = ILLUSTRATION_TIERS[tier]
+        self.model_id = tier_settings["model"]
+        self.num_inference_steps = tier_settings["steps"]
+        self.width = tier_settings["size"]
+        self.height = tier_settings["size"]
+        self.guidance_scale = tier_settings["guidance_scale"]
+        self.cpu_offload = tier_settings["cpu_offload"]
+        # A fixed seed makes a prompt render the same image, so results can be cached
+        self.seed = config.ILLUSTRATION_SEED
+        self.cache = cache
         
     def load_model(self):
-        """Load the Stable Diffusion XL model"""
+        """Load the Stable Diffusion XL model for this tier"""
         try:
-            print("🔄 Loading Stable Diffusion XL model...")
+            # Deferred so the API process can compute render settings without torch/diffusers
+            import torch
+            from diffusers import DiffusionPipeline
+
+            print(f"🔄 Loading {self.model_id} ({self.tier} tier)...")
+            self.use_gpu = self.use_gpu and torch.cuda.is_available()
             
             if self.use_gpu:
                 
                 self.pipeline = DiffusionPipeline.from_pretrained(
-                    "stabilityai/stable-diffusion-xl-base-1.0",
+                    self.model_id,
                     torch_dtype=torch.float16,
                     use_safetensors=True,
                     variant="fp16"
@@ -32,64 +69,146 @@ class ImageGenerationService:
             else:
                 # CPU version
                 self.pipeline = DiffusionPipeline.from_pretrained(
-                    "stabilityai/stable-diffusion-xl-base-1.0",
+                    self.model_id,
                     torch_dtype=torch.float32,
                     use_safetensors=True
                 )
-                self.pipeline.enable_model_cpu_offload()
+                if self.cpu_offload:
+                    self.pipeline.enable_model_cpu_offload()
+
+            self._optimize_unet()
             
             self.model_loaded = True
-            print("✅ Stable Diffusion XL model loaded successfully!")
+            print(f"✅ {self.model_id} loaded successfully!")
             
         except Exception as e:
             print(f"❌ Error loading Stable Diffusion XL model: {e}")
             self.model_loaded = False
     
-    def generate_story_illustration(self, story_text: str, style: str = "realistic") -> Optional[str]:
+    def _optimize_unet(self):
+        """Optional channels_last layout and torch.compile for the UNet"""
+        import torch
+
+        if self.cpu_offload and not self.use_gpu:
+            # Offload hooks move the UNet between devices on every call
+            return
+        if config.ILLUSTRATION_CHANNELS_LAST:
+            self.pipeline.unet.to(memory_format=torch.channels_last)
+        if config.ILLUSTRATION_TORCH_COMPILE and hasattr(torch, "compile"):
+            self.pipeline.unet = torch.compile(self.pipeline.unet, mode="reduce-overhead")
+
+    def illustration_settings(self, story_text: str, style: str = "realistic") -> dict:
+        """Everything that determines the rendered image"""
+        return {
+            "model": self.model_id,
+            "prompt": self._create_prompt_from_story(story_text, style),
+            "style": style,
+            "steps": self.num_inference_steps,
+            "width": self.width,
+            "height": self.height,
+            "seed": self.seed,
+        }
+
+    @staticmethod
+    def cache_key(settings: dict) -> str:
+        return json.dumps(settings, sort_keys=True)
+
+    def cached_illustration_hash(self, story_text: str, style: str = "realistic") -> Optional[str]:
+        """Blob hash of a previous render with the same settings, without loading the model"""
+        if self.cache is None:
+            return None
+        blob_hash = self.cache.get_hash(self.cache_key(self.illustration_settings(story_text, style)))
+        return None if blob_hash is MISSING else blob_hash
+
+    def render_illustration(
+        self,
+        story_text: str,
+        style: str = "realistic",
+        progress_callback: Optional[Callable[[int, int], None]] = None
+    ) -> Optional[bytes]:
         """
         Generate an illustration based on story content
-        Returns base64 encoded image or None if failed
+        Returns PNG bytes or None if failed
+        progress_callback(step, total_steps) is called after each denoising step
         """
+        return self.render_illustrations([(story_text, style)], progress_callback)[0]
+
+    def render_illustrations(
+        self,
+        requests: List[Tuple[str, str]],
+        progress_callback: Optional[Callable[[int, int], None]] = None
+    ) -> List[Optional[bytes]]:
+        """
+        Generate illustrations for several (story_text, style) requests with one
+        batched pipeline call. Each prompt gets its own seeded generator, so an
+        image is the same whether it was rendered alone or in a batch.
+        Returns PNG bytes (or None if failed) in request order
+        """
+        settings = [self.illustration_settings(story_text, style) for story_text, style in requests]
+        results: List[Optional[bytes]] = [None] * len(requests)
+        pending = []
+        for i, request_settings in enumerate(settings):
+            png_data = self.cache.get(self.cache_key(request_settings)) if self.cache is not None else MISSING
+            if png_data is not MISSING:
+                print("✅ Illustration served from cache")
+                results[i] = png_data
+            else:
+                pending.append(i)
+        if not pending:
+            return results
+
         if not self.model_loaded:
             print("⚠️ Model not loaded, attempting to load now...")
             self.load_model()
             if not self.model_loaded:
-                return None
+                return results
         
         try:
-            # Create a prompt based on the story content
-            prompt = self._create_prompt_from_story(story_text, style)
+            prompts = [settings[i]["prompt"] for i in pending]
             
-            print(f"🎨 Generating illustration with prompt: {prompt}")
+            for prompt in prompts:
+                print(f"🎨 Generating illustration with prompt: {prompt}")
             
-            # Generate the image
-            image = self.pipeline(
-                prompt=prompt,
-                num_inference_steps=20,  # Reduced for faster generation
-                guidance_scale=7.5,
-                width=512,
-                height=512
-            ).images[0]
+            pipeline_kwargs = {}
+            if progress_callback is not None:
+                def on_step_end(pipeline, step, timestep, callback_kwargs):
+                    progress_callback(step + 1, self.num_inference_steps)
+                    return callback_kwargs
+                pipeline_kwargs["callback_on_step_end"] = on_step_end
+
+            import torch
+
+            device = "cuda" if self.use_gpu else "cpu"
+            generators = [torch.Generator(device=device).manual_seed(self.seed) for _ in prompts]
+
+            # Generate the images
+            images = self.pipeline(
+                prompt=prompts,
+                num_inference_steps=self.num_inference_steps,
+                guidance_scale=self.guidance_scale,
+                width=self.width,
+                height=self.height,
+                generator=generators,
+                **pipeline_kwargs
+            ).images
             
-            # Convert to base64 for storage/transmission
-            img_buffer = io.BytesIO()
-            image.save(img_buffer, format='PNG')
-            img_str = base64.b64encode(img_buffer.getvalue()).decode()
+            for i, image in zip(pending, images):
+                img_buffer = io.BytesIO()
+                image.save(img_buffer, format='PNG')
+                results[i] = img_buffer.getvalue()
+                if self.cache is not None:
+                    self.cache.set(self.cache_key(settings[i]), results[i])
             
-            print("✅ Illustration generated successfully!")
-            return f"data:image/png;base64,{img_str}"
+            print(f"✅ {len(images)} illustration(s) generated successfully!")
             
         except Exception as e:
             print(f"❌ Error generating illustration: {e}")
-            return None
+        return results
     
     def _create_prompt_from_story(self, story_text: str, style: str = "realistic") -> str:
         """
         Create an effective prompt from story content
         """
-        # Extract key elements from the story
-        story_lower = story_text.lower()
-        
         # Define style modifiers
         style_modifiers = {
             "realistic": "photorealistic, detailed, high quality",
@@ -102,19 +221,7 @@ class ImageGenerationService:
         style_desc = style_modifiers.get(style, "realistic, detailed")
         
         # Extract themes and subjects
-        themes = []
-        if any(word in story_lower for word in ["war", "soldier", "military"]):
-            themes.append("historical, wartime scene")
-        if any(word in story_lower for word in ["love", "romance", "marriage"]):
-            themes.append("romantic, emotional scene")
-        if any(word in story_lower for word in ["family", "grandfather", "grandmother"]):
-            themes.append("family, generational scene")
-        if any(word in story_lower for word in ["migration", "journey", "travel"]):
-            themes.append("journey, travel scene")
-        if any(word in story_lower for word in ["school", "education"]):
-            themes.append("educational, learning scene")
-        if any(word in story_lower for word in ["work", "job", "career"]):
-            themes.append("professional, working scene")
+        themes = prompt_scenes_for(story_keywords(story_text))
         
         # Create the prompt
         if themes:
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import re
+from functools import lru_cache
+from typing import Iterable, List
+
+LONG_TEXT_CHARS = 100000  # Above this, texts are reduced to their distinct words before scanning
+
+# Keyword tables for story titles, themes and illustration prompts. Keywords
+# match as lowercase substrings, anywhere in the text ("war" also matches "award").
+
+# (title, keywords), checked in order; the first title with a matching keyword wins
+TITLE_KEYWORDS = [
+    ("Memories of Grandfather", ["grandfather", "grandpa", "grandad"]),
+    ("Memories of Grandmother", ["grandmother", "grandma", "nana"]),
+    ("Memories of Father", ["father", "dad", "papa"]),
+    ("Memories of Mother", ["mother", "mom", "mama"]),
+    ("War Time Memories", ["war"]),
+    ("The Great Journey", ["migration", "immigration", "journey"]),
+    ("A Love Story", ["love"]),
+    ("Wedding Day Memories", ["wedding"]),
+    ("Birth Story", ["birth", "born"]),
+    ("School Days", ["school", "education"]),
+    ("Working Life", ["work", "job"]),
+]
+DEFAULT_TITLE = "A Special Memory"
+
+# Theme -> keywords; a theme scores one point per distinct keyword found
+THEME_KEYWORDS = {
+    "love": ["love", "romance", "marriage", "wedding", "kiss", "heart"],
+    "war": ["war", "battle", "soldier", "military", "army", "conflict"],
+    "migration": ["migration", "immigration", "journey", "travel", "move", "country"],
+    "family": ["family", "children", "parents", "grandparents", "home"],
+    "tradition": ["tradition", "culture", "custom", "ceremony", "ritual"],
+    "adventure": ["adventure", "explore", "discover", "travel", "journey"],
+    "struggle": ["struggle", "difficult", "hard", "challenge", "overcome"],
+    "success": ["success", "achieve", "accomplish", "win", "victory"]
+}
+DEFAULT_THEME = "family"
+
+# Illustration prompt scene -> keywords
+PROMPT_SCENE_KEYWORDS = [
+    ("historical, wartime scene", ["war", "soldier", "military"]),
+    ("romantic, emotional scene", ["love", "romance", "marriage"]),
+    ("family, generational scene", ["family", "grandfather", "grandmother"]),
+    ("journey, travel scene", ["migration", "journey", "travel"]),
+    ("educational, learning scene", ["school", "education"]),
+    ("professional, working scene", ["work", "job", "career"]),
+]
+
+
+# Changes whenever the tables do, for caches of results derived from them
+KEYWORDS_VERSION = hashlib.sha256(
+    json.dumps([TITLE_KEYWORDS, THEME_KEYWORDS, PROMPT_SCENE_KEYWORDS]).encode()
+).hexdigest()[:12]
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """
+    Regex alternation of words built as a trie, so shared prefixes are
+    matched once, e.g. grand(?:father|mother|pa(?:rents)?).
+    Optional tails are greedy, so the longest word at a position is matched.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """
+    Finds which of a fixed set of keywords occur as substrings of a text in one
+    pass of a precompiled regex, for the title, theme and illustration prompt
+    together.
+
+    finditer reports the longest keyword at each match and resumes after it,
+    so keywords overlapping a match are credited from tables built here: those
+    inside the matched keyword ("father" in "grandfather"), and those starting
+    inside it and running past its end, which are checked at the match end.
+    Keywords contain no whitespace, so every occurrence lies inside one
+    whitespace-separated word: texts longer than long_text_chars (transcripts)
+    are first reduced to their distinct words when most words repeat.
+    """
+
+    def __init__(self, keywords: Iterable[str], long_text_chars: int = LONG_TEXT_CHARS):
+        self.keywords = sorted({keyword.lower() for keyword in keywords})
+        if any(len(keyword.split()) != 1 for keyword in self.keywords):
+            raise ValueError("Keywords must be single words")
+        self.long_text_chars = long_text_chars
+        self._pattern = re.compile(_trie_pattern(self.keywords))
+        self._contained = {
+            keyword: tuple(other for other in self.keywords if other in keyword)
+            for keyword in self.keywords
+        }
+        # keyword -> (other, the part of other after the end of keyword)
+        self._straddling = {
+            keyword: tuple(
+                (other, other[len(keyword) - start:])
+                for other in self.keywords
+                for start in range(1, len(keyword))
+                if len(other) > len(keyword) - start and other.startswith(keyword[start:])
+            )
+            for keyword in self.keywords
+        }
+
+    def matches(self, text: str) -> frozenset:
+        """The keywords that occur in text (case-insensitive)"""
+        text = text.lower()
+        if len(text) > self.long_text_chars:
+            # Worth deduplicating only if words repeat, as they do in speech;
+            # judged on the start of the text
+            sample = text[:self.long_text_chars].split()
+            if len(set(sample)) * 2 < len(sample):
+                text = " ".join(set(text.split()))
+        found = set()
+        for match in self._pattern.finditer(text):
+            keyword = match.group()
+            found.update(self._contained[keyword])
+            for other, tail in self._straddling[keyword]:
+                if text.startswith(tail, match.end()):
+                    found.add(other)
+        return frozenset(found)
+
+    def matches_batch(self, texts: Iterable[str]) -> List[frozenset]:
+        return [self.matches(text) for text in texts]
+
+
+STORY_MATCHER = KeywordMatcher(
+    [keyword for _, keywords in TITLE_KEYWORDS for keyword in keywords]
+    + [keyword for keywords in THEME_KEYWORDS.values() for keyword in keywords]
+    + [keyword for _, keywords in PROMPT_SCENE_KEYWORDS for keyword in keywords]
+)
+
+
+@lru_cache(maxsize=32)
+def story_keywords(text: str) -> frozenset:
+    """
+    Story keywords found in text. Cached for the few most recent texts, since
+    the title, theme and illustration prompt of a story are computed separately.
+    """
+    return STORY_MATCHER.matches(text)
+
+
+# The tables as sets, so a story's keywords are matched against them in C
+_TITLE_SETS = [(title, frozenset(keywords)) for title, keywords in TITLE_KEYWORDS]
+_THEME_SETS = {theme: frozenset(keywords) for theme, keywords in THEME_KEYWORDS.items()}
+_PROMPT_SCENE_SETS = [(scene, frozenset(keywords)) for scene, keywords in PROMPT_SCENE_KEYWORDS]
+
+
+def title_for(found: frozenset) -> str:
+    for title, keywords in _TITLE_SETS:
+        if not keywords.isdisjoint(found):
+            return title
+    return DEFAULT_TITLE
+
+
+def theme_scores(found: frozenset) -> dict:
+    return {theme: len(keywords & found) for theme, keywords in _THEME_SETS.items()}
+
+
+def theme_for(found: frozenset) -> str:
+    """The theme with the highest score (the first listed on ties), default family"""
+    scores = theme_scores(found)
+    best_theme = max(scores, key=scores.get)
+    return best_theme if scores[best_theme] > 0 else DEFAULT_THEME
+
+
+def prompt_scenes_for(found: frozenset) -> List[str]:
+    return [scene for scene, keywords in _PROMPT_SCENE_SETS if not keywords.isdisjoint(found)]
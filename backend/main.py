@@ -1,40 +1,84 @@
-from fastapi import FastAPI, Request, Depends, HTTPException
+from fastapi import FastAPI, Request, Response, Depends, HTTPException, Query, WebSocket
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from transformers import BlenderbotTokenizer, BlenderbotForConditionalGeneration
-import torch
-from typing import List
+from typing import List, Optional
+import importlib.util
 import os
 import base64
+import asyncio
+import threading
+import json
+import queue
 
 # Import our modules
-from database import get_db, engine
+from database import get_db, engine, SessionLocal
 from models import Base, Story
-from schemas import StoryCreate, StoryUpdate, Story as StorySchema, ConversationRequest
-from geocoding import GeocodingService
-from summarization import SummarizationService
-
-# import for image generation
-try:
-    from image_generation import ImageGenerationService
-    IMAGE_GENERATION_AVAILABLE = True
-except ImportError as e:
-    print(f"⚠️ Image generation not available: {e}")
-    IMAGE_GENERATION_AVAILABLE = False
+from schemas import (
+    StoryCreate, StoryUpdate, Story as StorySchema, ConversationRequest, GeocodeBatchRequest,
+    IllustrationJobRequest, ProcessStoryBatchRequest
+)
+from migrations import migrate, move_inline_illustrations_to_blobs
+from blob_store import BlobStore, RangeNotSatisfiable, blob_url, parse_byte_range
+import config
+from story_queries import (
+    CLUSTER_MAX_ZOOM, InvalidQueryParameter, bbox_clusters, bbox_filter, bbox_pins,
+    fetch_search_page, fetch_story_page, list_stories_query, parse_fields, search_stories_query,
+    text_search_filter
+)
+from cache import MISSING, BlobCache
+from geocoding import GEOCODE_MAX_WORKERS, GeocodingService
+from map_clusters import ClusterIndex, register_story_listeners
+from geocoding_worker import (
+    GeocodingWorker, GEOCODE_STATUS_PENDING, GEOCODE_STATUS_RESOLVED, GEOCODE_STATUS_NOT_FOUND
+)
+from summarization import SUMMARY_CACHE_DB_PATH, SummarizationService
+from model_registry import ModelNotReady, ModelRegistry
 
-# import for speech services
+def service_available(name: str, enabled: bool, *packages: str) -> bool:
+    """
+    Check that a service is enabled and its packages are installed, without
+    importing them: torch, diffusers and whisper are only imported by the
+    services that use them, when their models load.
+    """
+    if not enabled:
+        print(f"⚠️ {name} disabled by configuration")
+        return False
+    missing = [package for package in packages if importlib.util.find_spec(package) is None]
+    if missing:
+        print(f"⚠️ {name} not available: No module named '{missing[0]}'")
+        return False
+    return True
 
+# image generation
+IMAGE_GENERATION_AVAILABLE = service_available(
+    "Image generation", config.ENABLE_IMAGE_GENERATION, "torch", "diffusers"
+)
+if IMAGE_GENERATION_AVAILABLE:
+    from illustration_jobs import IMAGE_CACHE_DB_PATH, IMAGE_CACHE_TABLE, IllustrationJobManager, JOB_DONE, JOB_FAILED
 
-try:
+# speech services
+SPEECH_AVAILABLE = service_available("Speech services", config.ENABLE_SPEECH, "whisper", "gtts")
+if SPEECH_AVAILABLE:
+    from audio_decoding import AudioDecodeError
     from speech_service import SpeechService
-    SPEECH_AVAILABLE = True
-except ImportError as e:
-    print(f"⚠️ Speech services not available: {e}")
-    SPEECH_AVAILABLE = False
+    from streaming_stt import stream_transcripts
+
+# semantic story search
+SEARCH_AVAILABLE = service_available("Semantic search", config.ENABLE_SEARCH, "sentence_transformers")
+if SEARCH_AVAILABLE:
+    import story_search
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
+database_features = migrate(engine)
+
+# Generated illustrations are stored by content hash; stories keep only the blob URL
+blob_store = BlobStore(config.BLOB_STORE_DIR)
+move_inline_illustrations_to_blobs(engine, blob_store)
 
 app = FastAPI(title="LegacyTree API", description="API for family story preservation")
 
@@ -45,69 +89,316 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
-# Load BlenderBot model and tokenizer at startup
+# Models load concurrently in the background once the server has started;
+# endpoints answer 503 with Retry-After until the model they need is ready
+model_registry = ModelRegistry()
+
+# BlenderBot model and tokenizer for the conversation endpoint
 MODEL_NAME = "facebook/blenderbot-400M-distill"
-tokenizer = BlenderbotTokenizer.from_pretrained(MODEL_NAME)
-model = BlenderbotForConditionalGeneration.from_pretrained(MODEL_NAME)
+
+def load_conversation_model():
+    from transformers import BlenderbotTokenizer, BlenderbotForConditionalGeneration
+    tokenizer = BlenderbotTokenizer.from_pretrained(MODEL_NAME)
+    model = BlenderbotForConditionalGeneration.from_pretrained(MODEL_NAME)
+    return tokenizer, model
+
+if config.ENABLE_CONVERSATION:
+    model_registry.register("conversation", load_conversation_model, expected_seconds=30)
 
 # Initialize geocoding service
 geocoding_service = GeocodingService()
 
-# Initialize summarization service
-summarization_service = SummarizationService(use_ai_model=True)  # Enable AI model
+# Stories are saved immediately and geocoded in the background
+geocoding_worker = GeocodingWorker(geocoding_service, SessionLocal)
+
+# Clustered map layer, kept in sync with story writes
+cluster_index = ClusterIndex(SessionLocal, use_rtree=database_features["spatial_index"])
+register_story_listeners(cluster_index)
 
-# Initialize image generation service (lazy loading)
+# Summarization service (lightweight mode if the AI model is disabled or fails to load)
+model_registry.register(
+    "summarization",
+    lambda: SummarizationService(
+        use_ai_model=config.ENABLE_SUMMARIZATION_MODEL,
+        cache_db_path=SUMMARY_CACHE_DB_PATH if config.SUMMARY_CACHE_PERSISTENT else None
+    ),
+    expected_seconds=20
+)
+
+# Initialize image generation jobs (the pipeline lives in a dedicated worker process)
 if IMAGE_GENERATION_AVAILABLE:
-    image_generation_service = ImageGenerationService(use_gpu=False)  # Start with CPU for compatibility
+    image_cache = (
+        BlobCache(blob_store, IMAGE_CACHE_DB_PATH, IMAGE_CACHE_TABLE, config.IMAGE_CACHE_MAX_BYTES)
+        if config.IMAGE_CACHE_MAX_BYTES > 0 else None
+    )
+    illustration_jobs = IllustrationJobManager(
+        SessionLocal, blob_store, use_gpu=False, image_cache=image_cache  # Start with CPU for compatibility
+    )
+else:
+    illustration_jobs = None
+
+# Stories are embedded in the background after they are saved; the search
+# index (memory-mapped vectors) loads on the embedding worker's thread
+if SEARCH_AVAILABLE:
+    model_registry.register("search", lambda: story_search.load_encoder(config.SEARCH_MODEL), expected_seconds=10)
+    story_index = story_search.VectorIndex(
+        config.SEARCH_INDEX_DIR,
+        config.SEARCH_MODEL,
+        nprobe=config.SEARCH_NPROBE,
+        ivf_min_rows=config.SEARCH_IVF_MIN_STORIES
+    )
+    story_embeddings = story_search.StoryEmbeddingWorker(
+        story_index,
+        SessionLocal,
+        lambda: model_registry.get("search") if model_registry.is_ready("search") else None
+    )
+    story_search.register_story_listeners(story_embeddings)
 else:
-    image_generation_service = None
+    story_index = None
+    story_embeddings = None
 
-# Initialize speech service (lazy loading)
+# Initialize speech service; the Whisper model loads in the background
 if SPEECH_AVAILABLE:
     speech_service = SpeechService()
-    # Pre-load the Whisper model to avoid delays
-    speech_service.load_whisper_model()
+
+    def load_whisper():
+        speech_service.load_whisper_model()
+        if not speech_service.is_available():
+            raise RuntimeError("Whisper model failed to load")
+        return speech_service
+
+    model_registry.register("whisper", load_whisper, expected_seconds=15)
 else:
     speech_service = None
 
+def require_model(name: str):
+    """The loaded model, or 503 with Retry-After while it is still loading"""
+    if name not in model_registry:
+        raise HTTPException(status_code=503, detail=f"{name} service is disabled")
+    try:
+        return model_registry.get(name)
+    except ModelNotReady as e:
+        headers = {"Retry-After": str(e.retry_after)} if e.retry_after is not None else None
+        detail = f"{name} model is still loading" if e.retry_after is not None else f"{name} model failed to load"
+        raise HTTPException(status_code=503, detail=detail, headers=headers)
+
+@app.on_event("startup")
+def start_background_workers():
+    model_registry.start()
+    geocoding_worker.start()
+    if illustration_jobs is not None:
+        illustration_jobs.start()
+    if story_embeddings is not None:
+        story_embeddings.start()
+    threading.Thread(target=cluster_index.load, name="cluster-index", daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    geocoding_worker.stop()
+    if illustration_jobs is not None:
+        illustration_jobs.stop()
+    if story_embeddings is not None:
+        story_embeddings.stop()
+
 def build_conversation_input(history: List[str]):
     # BlenderBot expects the conversation as a single string, with each turn separated by </s>
     return " </s> ".join(history)
 
+def apply_cached_geocode(db_story: Story) -> bool:
+    """
+    Fill in coordinates from the geocoding cache or an offline tier if possible.
+    Returns False when the story has to wait for the background worker.
+    """
+    cached = geocoding_service.lookup_offline(db_story.location)
+    if cached is MISSING:
+        db_story.geocode_status = GEOCODE_STATUS_PENDING
+        return False
+
+    if cached:
+        db_story.lat = cached["latitude"]
+        db_story.lon = cached["longitude"]
+        db_story.geocode_status = GEOCODE_STATUS_RESOLVED
+    else:
+        db_story.geocode_status = GEOCODE_STATUS_NOT_FOUND
+    return True
+
+
+def store_illustration_url(url: Optional[str]) -> Optional[str]:
+    """blob_store.put_url, with a malformed data: URL reported as a bad request"""
+    try:
+        return blob_store.put_url(url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid illustration data URL: {e}")
+
 # Story Management Endpoints
 @app.post("/api/stories", response_model=StorySchema)
 def create_story(story: StoryCreate, db: Session = Depends(get_db)):
     """Create a new story"""
-    # Get coordinates for the location
-    lat, lon = geocoding_service.get_coordinates(story.location)
-    
+    # Coordinates come from the cache or offline gazetteer when possible; otherwise the story
+    # is saved with the submitted coordinates and geocoded in the background
     db_story = Story(
         title=story.title,
         summary=story.summary,
         theme=story.theme,
         location=story.location,
-        lat=lat,
-        lon=lon,
+        lat=story.lat,
+        lon=story.lon,
         date=story.date,
         message_to_future=story.message_to_future,
         visibility=story.visibility,
-        illustration_url=story.illustration_url
+        illustration_url=store_illustration_url(story.illustration_url)
     )
+    geocoded = apply_cached_geocode(db_story)
     
     db.add(db_story)
     db.commit()
     db.refresh(db_story)
+
+    if not geocoded:
+        geocoding_worker.enqueue(db_story.id)
     return db_story
 
-@app.get("/api/stories", response_model=List[StorySchema])
-def get_stories(db: Session = Depends(get_db), visibility: str = None):
-    """Get all stories, optionally filtered by visibility"""
-    query = db.query(Story)
+@app.get("/api/stories")
+def get_stories(
+    response: Response,
+    db: Session = Depends(get_db),
+    visibility: str = None,
+    theme: str = None,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    q: Optional[str] = Query(None, max_length=500)
+):
+    """
+    Get stories in date order (oldest first, or newest first with order=desc),
+    optionally filtered by visibility and theme.
+    With `limit`, results are paged: pass the X-Next-Cursor response header back as `cursor`.
+    `fields` selects columns ("id,title,lat") or a preset ("pin": id, title, theme, lat, lon).
+    `q` keeps stories whose title, summary or message contain every word ("grand*"
+    for a prefix), best match first, each with a `score` and a `snippet` with the
+    matches in <mark> tags.
+    """
+    descending = order == "desc"
+    hits = None
+    try:
+        columns = parse_fields(fields)
+        if q and database_features["full_text_index"]:
+            query = search_stories_query(db, q, visibility=visibility, theme=theme, fields=columns)
+            hits, next_cursor = fetch_search_page(query, limit, cursor, columns)
+        else:
+            query = list_stories_query(db, visibility=visibility, theme=theme, descending=descending)
+            if q:
+                # No FTS5 in this SQLite build: unranked matches in date order
+                query = query.filter(text_search_filter(q))
+            rows, next_cursor = fetch_story_page(query, limit, cursor, columns, descending)
+    except InvalidQueryParameter as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if hits is not None:
+        return [
+            {
+                **(jsonable_encoder(StorySchema.model_validate(story)) if columns is None else jsonable_encoder(story)),
+                "score": round(score, 4),
+                "snippet": snippet
+            }
+            for story, score, snippet in hits
+        ]
+    if columns is None:
+        rows = [StorySchema.model_validate(row) for row in rows]
+    return jsonable_encoder(rows)
+
+@app.get("/api/stories/bbox")
+def get_stories_in_bbox(
+    min_lat: float = Query(..., ge=-90, le=90),
+    max_lat: float = Query(..., ge=-90, le=90),
+    min_lon: float = Query(..., ge=-180, le=180),
+    max_lon: float = Query(..., ge=-180, le=180),
+    zoom: int = Query(2, ge=0, le=22),
+    visibility: str = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Stories inside a map viewport. min_lon > max_lon means the box crosses the antimeridian.
+    At low zoom levels stories are returned as clusters (count and centroid per grid cell).
+    """
+    if min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="min_lat must not exceed max_lat")
+
+    bbox_clause = bbox_filter(min_lat, max_lat, min_lon, max_lon, use_rtree=database_features["spatial_index"])
+    if zoom <= CLUSTER_MAX_ZOOM:
+        return {"zoom": zoom, "clustered": True, "clusters": bbox_clusters(db, zoom, bbox_clause, visibility)}
+    return {"zoom": zoom, "clustered": False, "stories": bbox_pins(db, bbox_clause, visibility)}
+
+@app.get("/api/map/tiles/{zoom}/{x}/{y}")
+def get_map_tile(zoom: int, x: int, y: int):
+    """Clustered story pins for one web map tile as GeoJSON"""
+    if not 0 <= zoom <= 22 or not (0 <= x < 2 ** zoom and 0 <= y < 2 ** zoom):
+        raise HTTPException(status_code=404, detail="Tile out of range")
+    if not cluster_index.ready:
+        raise HTTPException(status_code=503, detail="Map index is loading", headers={"Retry-After": "5"})
+    return cluster_index.tile(zoom, x, y)
+
+@app.get("/api/map/clusters")
+def get_map_clusters(
+    zoom: int = Query(2, ge=0, le=22),
+    min_lat: float = Query(-85, ge=-90, le=90),
+    max_lat: float = Query(85, ge=-90, le=90),
+    min_lon: float = Query(-180, ge=-180, le=180),
+    max_lon: float = Query(180, ge=-180, le=180)
+):
+    """Clustered story pins for a viewport (the whole world by default) as one GeoJSON layer"""
+    if min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="min_lat must not exceed max_lat")
+    if not cluster_index.ready:
+        raise HTTPException(status_code=503, detail="Map index is loading", headers={"Retry-After": "5"})
+    try:
+        return cluster_index.layer(zoom, min_lat, max_lat, min_lon, max_lon)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/stories/search")
+def search_stories(
+    q: str = Query(..., min_length=1, max_length=1000),
+    limit: int = Query(10, ge=1, le=50),
+    visibility: str = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Stories ranked by meaning rather than exact words: the query and the
+    stories are compared as sentence embeddings. Stories are embedded in the
+    background after they are saved, so a new story shows up within seconds.
+    """
+    if story_index is None:
+        raise HTTPException(status_code=503, detail="Semantic search not available")
+    encoder = require_model("search")
+    if not story_index.ready:
+        raise HTTPException(status_code=503, detail="Search index is loading", headers={"Retry-After": "5"})
+
+    keep = None
     if visibility:
-        query = query.filter(Story.visibility == visibility)
-    return query.all()
+        def keep(story_ids):
+            rows = db.query(Story.id).filter(Story.id.in_(story_ids), Story.visibility == visibility)
+            return {story_id for (story_id,) in rows}
+
+    # With a filter, the search widens until `limit` stories pass it
+    hits = story_search.search_stories(story_index, encoder, q, limit, keep)
+    scores = dict(hits)
+    stories = sorted(
+        db.query(Story).filter(Story.id.in_(list(scores))).all(),
+        key=lambda story: scores[story.id],
+        reverse=True
+    )
+    results = [
+        {**jsonable_encoder(StorySchema.model_validate(story)), "score": round(scores[story.id], 4)}
+        for story in stories
+    ]
+    return {"query": q, "results": results}
 
 @app.get("/api/stories/{story_id}", response_model=StorySchema)
 def get_story(story_id: int, db: Session = Depends(get_db)):
@@ -126,18 +417,22 @@ def update_story(story_id: int, story_update: StoryUpdate, db: Session = Depends
     
     # Update fields that are provided
     update_data = story_update.dict(exclude_unset=True)
-    
-    # If location is being updated, get new coordinates
-    if "location" in update_data:
-        lat, lon = geocoding_service.get_coordinates(update_data["location"])
-        update_data["lat"] = lat
-        update_data["lon"] = lon
+    if "illustration_url" in update_data:
+        update_data["illustration_url"] = store_illustration_url(update_data["illustration_url"])
     
     for field, value in update_data.items():
         setattr(db_story, field, value)
+
+    # If location is being updated, get new coordinates (from cache or in the background)
+    geocoded = True
+    if "location" in update_data:
+        geocoded = apply_cached_geocode(db_story)
     
     db.commit()
     db.refresh(db_story)
+
+    if not geocoded:
+        geocoding_worker.enqueue(db_story.id)
     return db_story
 
 @app.delete("/api/stories/{story_id}")
@@ -153,11 +448,75 @@ def delete_story(story_id: int, db: Session = Depends(get_db)):
 
 # Geocoding endpoint
 @app.get("/api/geocode/{location}")
-def geocode_location(location: str):
+async def geocode_location(location: str):
     """Get coordinates for a location"""
-    location_info = geocoding_service.get_location_info(location)
+    # Await the shared, rate-limited lookup instead of parking a worker thread on it;
+    # only the cache and gazetteer read runs in the threadpool
+    try:
+        future = await run_in_threadpool(geocoding_service.lookup_async, location)
+        location_info = await asyncio.wrap_future(future)
+    except Exception as e:
+        print(f"❌ Geocoding error: {e}")
+        raise HTTPException(status_code=503, detail="Geocoding service unavailable")
+    if location_info is None:
+        raise HTTPException(status_code=404, detail="Location not found")
     return location_info
 
+@app.post("/api/geocode/batch")
+async def geocode_batch(request: GeocodeBatchRequest):
+    """
+    Geocode many locations at once, streamed back as NDJSON (one line per distinct location).
+    Cached locations are sent first; the rest follow as the rate-limited geocoder resolves them.
+    Network lookups are started a few at a time as the stream is read, and the ones not
+    started yet are cancelled if the client disconnects.
+    """
+    groups = geocoding_service.group_locations(request.locations)
+
+    def to_line(key, positions, info, error=None):
+        result = {"location": request.locations[positions[0]], "key": key, "inputs": positions}
+        if error is not None:
+            result.update(status="error", error=str(error))
+        elif info is None:
+            result.update(status="not_found")
+        else:
+            result.update(
+                status="ok",
+                latitude=info["latitude"],
+                longitude=info["longitude"],
+                address=info["address"]
+            )
+        return json.dumps(result) + "\n"
+
+    async def stream():
+        # Cache and gazetteer reads block, so they run off the event loop
+        offline = await run_in_threadpool(
+            lambda: [geocoding_service.lookup_offline(location) for _, _, location in groups]
+        )
+        remote = []
+        for group, info in zip(groups, offline):
+            if info is MISSING:
+                remote.append(group)
+            else:
+                yield to_line(group[0], group[1], info)
+
+        in_flight = {}
+        try:
+            while remote or in_flight:
+                while remote and len(in_flight) < GEOCODE_MAX_WORKERS:
+                    group = remote.pop(0)
+                    future = await run_in_threadpool(geocoding_service.lookup_async, group[2])
+                    in_flight[asyncio.wrap_future(future)] = group
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    key, positions, _ = in_flight.pop(future)
+                    error = future.exception()
+                    yield to_line(key, positions, None if error else future.result(), error)
+        finally:
+            for _, _, location in in_flight.values():
+                geocoding_service.cancel_lookup(location)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 # AI Story Processing endpoint
 @app.post("/api/process-story")
 def process_story(request: dict):
@@ -167,6 +526,8 @@ def process_story(request: dict):
     if not text:
         raise HTTPException(status_code=400, detail="Text is required")
     
+    summarization_service = require_model("summarization")
+
     try:
         # Generate AI summary
         summary = summarization_service.summarize_text(text)
@@ -188,40 +549,189 @@ def process_story(request: dict):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"AI processing error: {str(e)}")
 
-# AI Illustration Generation endpoint
-@app.post("/api/generate-illustration")
-def generate_illustration(request: dict):
-    """Generate an AI illustration based on story content"""
-    if not IMAGE_GENERATION_AVAILABLE or image_generation_service is None:
+@app.post("/api/process-story/stream")
+def process_story_stream(request: dict):
+    """
+    Process one (possibly hour-long) story text, streamed back as NDJSON:
+    {"event": "progress", "level", "done", "total"} lines while chunks are
+    summarized, then {"event": "result", ...} with the same fields as /api/process-story.
+    """
+    summarization_service = require_model("summarization")
+    text = request.get("text", "")
+    
+    if not text:
+        raise HTTPException(status_code=400, detail="Text is required")
+
+    events = queue.Queue()
+
+    def on_progress(level, done, total):
+        events.put({"event": "progress", "level": level, "done": done, "total": total})
+
+    def run():
+        try:
+            summary = summarization_service.summarize_text(text, progress_callback=on_progress)
+            events.put({
+                "event": "result",
+                "summary": summary,
+                "title": summarization_service.generate_title(text),
+                "theme": summarization_service.classify_theme(text),
+                "original_length": len(text),
+                "summary_length": len(summary)
+            })
+        except Exception as e:
+            events.put({"event": "error", "detail": f"AI processing error: {str(e)}"})
+
+    def stream():
+        threading.Thread(target=run, name="summarize-stream", daemon=True).start()
+        while True:
+            event = events.get()
+            yield json.dumps(event) + "\n"
+            if event["event"] != "progress":
+                break
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/api/process-story/batch")
+def process_story_batch(request: ProcessStoryBatchRequest):
+    """
+    Process many story texts at once, streamed back as NDJSON in input order.
+    Summaries are generated in length-sorted batches through the model.
+    """
+    summarization_service = require_model("summarization")
+    if request.batch_size is not None and request.batch_size < 1:
+        raise HTTPException(status_code=400, detail="batch_size must be at least 1")
+
+    def stream():
+        summaries = summarization_service.summarize_batch(request.texts, batch_size=request.batch_size)
+        labels = summarization_service.classify_batch(request.texts)
+        for index, (text, summary, (title, theme)) in enumerate(zip(request.texts, summaries, labels)):
+            yield json.dumps({
+                "index": index,
+                "summary": summary,
+                "title": title,
+                "theme": theme,
+                "original_length": len(text),
+                "summary_length": len(summary)
+            }) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+# AI Illustration Generation endpoints
+def require_illustration_jobs():
+    if not IMAGE_GENERATION_AVAILABLE or illustration_jobs is None:
         raise HTTPException(status_code=503, detail="Image generation service not available")
+
+@app.post("/api/illustrations/jobs", status_code=202)
+def create_illustration_job(request: IllustrationJobRequest):
+    """
+    Queue an illustration for a story and return its job immediately.
+    Submitting the same text, style and tier again returns the existing job (and its result).
+    tier "preview" renders a low-resolution image within seconds; with refine, a
+    full-quality job is queued behind it and returned as "refinement".
+    """
+    require_illustration_jobs()
+    if not request.text:
+        raise HTTPException(status_code=400, detail="Story text is required")
+    try:
+        job = illustration_jobs.submit(request.text, request.style, request.tier)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if request.refine and request.tier != "full":
+        job["refinement"] = illustration_jobs.submit(request.text, request.style, "full")
+    return job
+
+@app.get("/api/illustrations/jobs/{job_id}")
+def get_illustration_job(job_id: str):
+    """Poll an illustration job: queued, running (step of total_steps), done or failed"""
+    require_illustration_jobs()
+    job = illustration_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Illustration job not found")
+    return job
+
+@app.post("/api/generate-illustration")
+def generate_illustration(request: dict, response: Response):
+    """
+    Generate an AI illustration based on story content.
+    Waits a few seconds for the job (enough for cached images and previews); a job still
+    rendering after that is returned with 202, to be polled at /api/illustrations/jobs/{job_id}.
+    """
+    require_illustration_jobs()
     
     story_text = request.get("text", "")
     style = request.get("style", "realistic")
+    tier = request.get("tier", "full")
     
     if not story_text:
         raise HTTPException(status_code=400, detail="Story text is required")
     
+    if illustration_jobs.tier_loading(tier):
+        raise HTTPException(
+            status_code=503, detail=f"{tier} illustration model is still loading", headers={"Retry-After": "30"}
+        )
+    
     try:
-        # Generate the illustration
-        illustration_data = image_generation_service.generate_story_illustration(story_text, style)
-        
-        if illustration_data:
-            return {
-                "success": True,
-                "illustration_url": illustration_data,
-                "style": style
-            }
-        else:
-            raise HTTPException(status_code=500, detail="Failed to generate illustration")
-            
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Illustration generation error: {str(e)}")
+        job = illustration_jobs.submit(story_text, style, tier)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    job = illustration_jobs.wait(job["job_id"], timeout=config.ILLUSTRATION_SYNC_WAIT)
+
+    if job["status"] == JOB_DONE:
+        return {
+            "success": True,
+            "illustration_url": job["illustration_url"],
+            "illustration_hash": job["illustration_hash"],
+            "style": style,
+            "tier": tier
+        }
+    if job["status"] == JOB_FAILED:
+        raise HTTPException(status_code=500, detail=f"Illustration generation error: {job['error']}")
+    response.status_code = 202
+    response.headers["Location"] = f"/api/illustrations/jobs/{job['job_id']}"
+    return {"success": False, **job}
+
+# Blob endpoint (generated illustrations)
+@app.api_route("/api/blobs/{blob_hash}", methods=["GET", "HEAD"])
+def get_blob(blob_hash: str, request: Request):
+    """Stream a stored blob, with ETag revalidation and single byte-range support"""
+    if not blob_store.exists(blob_hash):
+        raise HTTPException(status_code=404, detail="Blob not found")
+
+    etag = f'"{blob_hash}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        # Content-addressed, so the bytes behind a URL never change
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    size = blob_store.size(blob_hash)
+    try:
+        byte_range = parse_byte_range(request.headers.get("range"), size)
+    except RangeNotSatisfiable:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    status_code = 200
+    start, end = 0, size - 1
+    if byte_range is not None:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    body = blob_store.iter_range(blob_hash, start, end) if request.method == "GET" else iter(())
+    return StreamingResponse(
+        body, status_code=status_code, media_type=blob_store.content_type(blob_hash), headers=headers
+    )
 
 # Existing conversation endpoint
 @app.post("/api/conversation")
 def converse(req: ConversationRequest):
     """Chat with AI using BlenderBot"""
     # Build input from history
+    tokenizer, model = require_model("conversation")
     input_text = build_conversation_input(req.history)
     inputs = tokenizer([input_text], return_tensors="pt")
     reply_ids = model.generate(**inputs, max_length=128)
@@ -235,24 +745,36 @@ def read_root():
 @app.get("/api/health")
 def health_check():
     """Check the health and availability of all services"""
+    summarization_service = model_registry.get("summarization") if model_registry.is_ready("summarization") else None
     return {
         "status": "healthy",
         "services": {
             "speech": {
                 "available": SPEECH_AVAILABLE,
                 "initialized": speech_service is not None,
-                "model_loaded": speech_service.is_available() if speech_service else False
+                "model_loaded": model_registry.is_ready("whisper")
             },
             "image_generation": {
                 "available": IMAGE_GENERATION_AVAILABLE,
-                "initialized": image_generation_service is not None
+                "initialized": illustration_jobs is not None,
+                "jobs": illustration_jobs.stats() if illustration_jobs else None
             },
             "summarization": {
                 "available": True,
-                "model_loaded": summarization_service.summarizer is not None
+                "model_loaded": summarization_service is not None and summarization_service.summarizer is not None,
+                "backend": summarization_service.backend if summarization_service else config.SUMMARY_BACKEND,
+                "cache": summarization_service.cache_stats() if summarization_service else None
+            },
+            "search": {
+                "available": SEARCH_AVAILABLE,
+                "embeddings": story_embeddings.stats() if story_embeddings else None
             },
+            "models": model_registry.stats(),
+            "map": cluster_index.stats(),
             "geocoding": {
-                "available": True
+                "available": True,
+                "cache": geocoding_service.cache_stats(),
+                "worker": geocoding_worker.stats()
             }
         }
     }
@@ -270,6 +792,8 @@ def convert_speech_to_text(request: dict):
     if not audio_data:
         raise HTTPException(status_code=400, detail="Audio data is required")
     
+    require_model("whisper")
+    
     try:
         # Decode base64 audio data
         audio_bytes = base64.b64decode(audio_data)
@@ -282,9 +806,38 @@ def convert_speech_to_text(request: dict):
         else:
             raise HTTPException(status_code=500, detail="Failed to transcribe speech")
             
+    except AudioDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Could not decode audio: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Speech-to-text error: {str(e)}")
 
+@app.websocket("/api/speech-to-text/stream")
+async def stream_speech_to_text(websocket: WebSocket, language: str = "en", sample_rate: int = 16000):
+    """
+    Streaming speech-to-text. Send binary messages of 16-bit little-endian mono
+    PCM at `sample_rate` (16000 avoids resampling) and {"type": "end"} when done.
+    Utterances are found by voice activity detection; each gets "partial"
+    transcripts while it is spoken and a "final" one after the speaker pauses.
+    """
+    await websocket.accept()
+    if not SPEECH_AVAILABLE or speech_service is None:
+        await websocket.close(code=1013, reason="Speech service not available")
+        return
+    if not model_registry.is_ready("whisper"):
+        # 1013: try again later
+        await websocket.close(code=1013, reason="whisper model is still loading")
+        return
+    if not 8000 <= sample_rate <= 48000:
+        await websocket.close(code=1003, reason="sample_rate must be between 8000 and 48000")
+        return
+
+    def transcribe(samples, previous_text: str) -> str:
+        return speech_service.transcribe_samples(
+            samples, language, initial_prompt=previous_text or None, condition_on_previous_text=False
+        )
+
+    await stream_transcripts(websocket, transcribe, sample_rate)
+
 # Text-to-Speech endpoint
 @app.post("/api/text-to-speech")
 def convert_text_to_speech(request: dict):
@@ -0,0 +1,315 @@
+import math
+import threading
+from typing import Callable, Optional
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from cache import MISSING, LRUCache
+from models import Story
+from story_queries import CLUSTER_CELLS_PER_TILE, CLUSTER_MAX_ZOOM, _lon_ranges, bbox_filter, bbox_pins
+
+MAX_TILE_ZOOM = 22
+MAX_MERCATOR_LAT = 85.05112878
+MAX_LAYER_TILES = 256  # Tiles one layer() call may render (the whole world at zoom 4)
+
+
+def lat_lon_to_tile_fraction(lat: float, lon: float, zoom: int) -> tuple[float, float]:
+    """Web Mercator position in tile units at a zoom level (x grows east, y grows south)"""
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    n = 2 ** zoom
+    x = (lon + 180.0) / 360.0 * n
+    lat_rad = math.radians(lat)
+    y = (1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * n
+    return min(max(x, 0.0), n - 1e-9), min(max(y, 0.0), n - 1e-9)
+
+
+def tile_bounds(zoom: int, x: int, y: int) -> tuple[float, float, float, float]:
+    """(min_lat, max_lat, min_lon, max_lon) of a web map tile"""
+    n = 2 ** zoom
+
+    def lat_at(tile_y: float) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return lat_at(y + 1), lat_at(y), x / n * 360.0 - 180.0, (x + 1) / n * 360.0 - 180.0
+
+
+class ClusterIndex:
+    """
+    Hierarchical grid clustering of story pins with a cache of rendered tiles.
+
+    At every zoom up to max_zoom, each web map tile is split into
+    cells_per_tile x cells_per_tile cells, and a cell keeps the count and
+    coordinate sums of the stories inside it. Cells nest exactly from one zoom
+    to the next, so adding, moving or removing a story touches one cell per
+    zoom instead of rebuilding the hierarchy. Rendered GeoJSON is cached per
+    (zoom, x, y) tile, and only the tiles that contain a changed story are evicted.
+    Above max_zoom, tiles hold individual pins read through the spatial index.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        max_zoom: int = CLUSTER_MAX_ZOOM,
+        cells_per_tile: int = CLUSTER_CELLS_PER_TILE,
+        max_cached_tiles: int = 4096,
+        use_rtree: bool = True,
+        max_layer_tiles: int = MAX_LAYER_TILES,
+    ):
+        self.session_factory = session_factory
+        self.max_zoom = max_zoom
+        self.cells_per_tile = cells_per_tile
+        self.use_rtree = use_rtree
+        self.tile_cache = LRUCache(max_entries=max_cached_tiles)
+        # A layer may fill at most a quarter of the tile cache
+        self.max_layer_tiles = min(max_layer_tiles, max_cached_tiles // 4)
+
+        self._points: dict[int, tuple[float, float, str, str]] = {}
+        # Per zoom: cell -> [count, sum_lat, sum_lon]; tile -> set of occupied cells
+        self._cells: list[dict[tuple[int, int], list]] = [{} for _ in range(max_zoom + 1)]
+        self._tiles: list[dict[tuple[int, int], set]] = [{} for _ in range(max_zoom + 1)]
+        # Story ids per cell at max_zoom, to name the story behind a single-story cell
+        self._leaf_ids: dict[tuple[int, int], set] = {}
+        self._lock = threading.RLock()
+        # Committed changes that arrive while load() reads the table, replayed after it
+        self._loading = False
+        self._buffered: list[tuple] = []
+        self.ready = False
+
+    # --- Building and incremental updates ---
+
+    def load(self):
+        """
+        Build the hierarchy from the database. Changes committed while the
+        table is read are buffered and replayed on top of the rows read, so a
+        story deleted or moved meanwhile is not left at its old state.
+        """
+        with self._lock:
+            self._loading = True
+            self._buffered = []
+        try:
+            db = self.session_factory()
+            try:
+                rows = db.query(Story.id, Story.lat, Story.lon, Story.title, Story.theme).all()
+            finally:
+                db.close()
+            with self._lock:
+                for row in rows:
+                    self.upsert(row.id, row.lat, row.lon, row.title, row.theme)
+                self._replay(self._buffered)
+                self.ready = True
+        finally:
+            with self._lock:
+                self._loading = False
+                self._buffered = []
+        print(f"✅ Map cluster index built for {len(rows)} stories")
+
+    def apply_changes(self, changes: list[tuple]):
+        """Apply committed (story_id, lat, lon, title, theme) changes; lat None removes"""
+        with self._lock:
+            if self._loading:
+                self._buffered.extend(changes)
+            else:
+                self._replay(changes)
+
+    def _replay(self, changes: list[tuple]):
+        for story_id, lat, lon, title, theme in changes:
+            if lat is None:
+                self.remove(story_id)
+            else:
+                self.upsert(story_id, lat, lon, title, theme)
+
+    def _cell(self, lat: float, lon: float, zoom: int) -> tuple[int, int]:
+        x, y = lat_lon_to_tile_fraction(lat, lon, zoom)
+        return int(x * self.cells_per_tile), int(y * self.cells_per_tile)
+
+    def _tile_of(self, cell: tuple[int, int]) -> tuple[int, int]:
+        return cell[0] // self.cells_per_tile, cell[1] // self.cells_per_tile
+
+    def _apply(self, story_id: int, lat: float, lon: float, sign: int):
+        for zoom in range(self.max_zoom + 1):
+            cell = self._cell(lat, lon, zoom)
+            tile = self._tile_of(cell)
+            stats = self._cells[zoom].setdefault(cell, [0, 0.0, 0.0])
+            stats[0] += sign
+            stats[1] += sign * lat
+            stats[2] += sign * lon
+            if stats[0] <= 0:
+                del self._cells[zoom][cell]
+                self._tiles[zoom][tile].discard(cell)
+                if not self._tiles[zoom][tile]:
+                    del self._tiles[zoom][tile]
+            else:
+                self._tiles[zoom].setdefault(tile, set()).add(cell)
+
+        leaf = self._cell(lat, lon, self.max_zoom)
+        if sign > 0:
+            self._leaf_ids.setdefault(leaf, set()).add(story_id)
+        else:
+            ids = self._leaf_ids.get(leaf)
+            if ids is not None:
+                ids.discard(story_id)
+                if not ids:
+                    del self._leaf_ids[leaf]
+
+    def _invalidate(self, lat: float, lon: float):
+        for zoom in range(MAX_TILE_ZOOM + 1):
+            x, y = lat_lon_to_tile_fraction(lat, lon, zoom)
+            self.tile_cache.delete(f"{zoom}/{int(x)}/{int(y)}")
+
+    def upsert(self, story_id: int, lat: float, lon: float, title: str, theme: str):
+        """Add a story, or move/rename it if it is already indexed"""
+        with self._lock:
+            self.remove(story_id)
+            self._points[story_id] = (lat, lon, title, theme)
+            self._apply(story_id, lat, lon, 1)
+            self._invalidate(lat, lon)
+
+    def remove(self, story_id: int):
+        with self._lock:
+            point = self._points.pop(story_id, None)
+            if point is None:
+                return
+            lat, lon, _, _ = point
+            self._apply(story_id, lat, lon, -1)
+            self._invalidate(lat, lon)
+
+    # --- Rendering ---
+
+    def _single_story_id(self, zoom: int, cell: tuple[int, int]) -> Optional[int]:
+        """Follow a single-story cell down the hierarchy to find the story"""
+        while zoom < self.max_zoom:
+            children = [(cell[0] * 2 + dx, cell[1] * 2 + dy) for dx in (0, 1) for dy in (0, 1)]
+            cell = next((child for child in children if child in self._cells[zoom + 1]), None)
+            if cell is None:
+                return None
+            zoom += 1
+        ids = self._leaf_ids.get(cell)
+        return next(iter(ids)) if ids else None
+
+    @staticmethod
+    def _pin_feature(story_id: int, lat: float, lon: float, title: str, theme: str) -> dict:
+        return {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {"cluster": False, "story_id": story_id, "title": title, "theme": theme},
+        }
+
+    def _render_tile(self, zoom: int, x: int, y: int) -> dict:
+        features = []
+        if zoom > self.max_zoom:
+            min_lat, max_lat, min_lon, max_lon = tile_bounds(zoom, x, y)
+            db = self.session_factory()
+            try:
+                pins = bbox_pins(db, bbox_filter(min_lat, max_lat, min_lon, max_lon, self.use_rtree))
+            finally:
+                db.close()
+            for pin in pins:
+                features.append(self._pin_feature(pin["id"], pin["lat"], pin["lon"], pin["title"], pin["theme"]))
+        else:
+            with self._lock:
+                for cell in self._tiles[zoom].get((x, y), ()):
+                    count, sum_lat, sum_lon = self._cells[zoom][cell]
+                    story_id = self._single_story_id(zoom, cell) if count == 1 else None
+                    if story_id is not None:
+                        lat, lon, title, theme = self._points[story_id]
+                        features.append(self._pin_feature(story_id, lat, lon, title, theme))
+                    else:
+                        features.append({
+                            "type": "Feature",
+                            "geometry": {"type": "Point", "coordinates": [sum_lon / count, sum_lat / count]},
+                            "properties": {"cluster": True, "point_count": count},
+                        })
+        return {"type": "FeatureCollection", "features": features}
+
+    def tile(self, zoom: int, x: int, y: int) -> dict:
+        """GeoJSON FeatureCollection for a web map tile, served from the tile cache"""
+        key = f"{zoom}/{x}/{y}"
+        cached = self.tile_cache.get(key)
+        if cached is not MISSING:
+            return cached
+        # Render and cache under the lock so a concurrent update cannot be missed
+        with self._lock:
+            geojson = self._render_tile(zoom, x, y)
+            self.tile_cache.set(key, geojson)
+        return geojson
+
+    def layer(self, zoom: int, min_lat=-90.0, max_lat=90.0, min_lon=-180.0, max_lon=180.0) -> dict:
+        """
+        Merge the cached tiles covering a bounding box into one FeatureCollection.
+        Above max_zoom, the pins in the box are read with one query instead.
+        Raises ValueError if the box covers more than max_layer_tiles tiles.
+        """
+        if zoom > self.max_zoom:
+            db = self.session_factory()
+            try:
+                pins = bbox_pins(db, bbox_filter(min_lat, max_lat, min_lon, max_lon, self.use_rtree))
+            finally:
+                db.close()
+            features = [
+                self._pin_feature(pin["id"], pin["lat"], pin["lon"], pin["title"], pin["theme"]) for pin in pins
+            ]
+            return {"type": "FeatureCollection", "features": features}
+
+        tiles = []
+        for low, high in _lon_ranges(min_lon, max_lon):
+            x0, y0 = lat_lon_to_tile_fraction(max_lat, low, zoom)
+            x1, y1 = lat_lon_to_tile_fraction(min_lat, high, zoom)
+            tiles.append((range(int(x0), int(x1) + 1), range(int(y0), int(y1) + 1)))
+        tile_count = sum(len(xs) * len(ys) for xs, ys in tiles)
+        if tile_count > self.max_layer_tiles:
+            raise ValueError(
+                f"Bounding box covers {tile_count} tiles at zoom {zoom} (at most {self.max_layer_tiles})"
+            )
+
+        features = []
+        for xs, ys in tiles:
+            for x in xs:
+                for y in ys:
+                    features.extend(self.tile(zoom, x, y)["features"])
+        return {"type": "FeatureCollection", "features": features}
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "stories": len(self._points),
+            "max_zoom": self.max_zoom,
+            "tile_cache": self.tile_cache.stats(),
+        }
+
+
+def register_story_listeners(cluster_index: ClusterIndex):
+    """
+    Keep the cluster index in sync with Story writes made through the ORM
+    (API endpoints and the background geocoding worker). Changes are collected
+    during flush and applied once the transaction commits, so a tile rendered
+    concurrently never caches a state the database has not committed.
+    """
+
+    def pending(target) -> list:
+        return object_session(target).info.setdefault("cluster_index_changes", [])
+
+    def after_insert(mapper, connection, target):
+        pending(target).append((target.id, target.lat, target.lon, target.title, target.theme))
+
+    def after_update(mapper, connection, target):
+        state = inspect(target)
+        if any(state.attrs[name].history.has_changes() for name in ("lat", "lon", "title", "theme")):
+            pending(target).append((target.id, target.lat, target.lon, target.title, target.theme))
+
+    def after_delete(mapper, connection, target):
+        pending(target).append((target.id, None, None, None, None))
+
+    def after_commit(session):
+        changes = session.info.pop("cluster_index_changes", [])
+        if changes:
+            cluster_index.apply_changes(changes)
+
+    def after_rollback(session):
+        session.info.pop("cluster_index_changes", None)
+
+    event.listen(Story, "after_insert", after_insert)
+    event.listen(Story, "after_update", after_update)
+    event.listen(Story, "after_delete", after_delete)
+    event.listen(Session, "after_commit", after_commit)
+    event.listen(Session, "after_rollback", after_rollback)
@@ -0,0 +1,246 @@
+"""
+Lightweight schema migrations for existing legacytree.db files.
+
+`Base.metadata.create_all` only creates missing tables, so columns added to
+models after a database was created are applied here. Every step is idempotent
+and runs at startup.
+
+Run directly to migrate without starting the server, or to rebuild the
+full-text index:
+
+    cd backend && python migrations.py --rebuild-full-text-index
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+from models import Base
+
+# (table, column, column DDL). Defaults apply to rows that already exist.
+COLUMN_MIGRATIONS = [
+    # Stories saved before background geocoding were geocoded synchronously
+    ("stories", "geocode_status", "VARCHAR(20) DEFAULT 'resolved'"),
+    # Illustration jobs queued before quality tiers were full renders
+    ("illustration_jobs", "tier", "VARCHAR(20) NOT NULL DEFAULT 'full'"),
+]
+
+
+def add_missing_columns(engine: Engine) -> list[str]:
+    """Add columns that exist on the models but not in the database"""
+    inspector = inspect(engine)
+    added = []
+    with engine.begin() as conn:
+        for table, column, ddl in COLUMN_MIGRATIONS:
+            if not inspector.has_table(table):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table)}
+            if column not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+                added.append(f"{table}.{column}")
+    return added
+
+
+def create_missing_indexes(engine: Engine) -> list[str]:
+    """Create indexes declared on the models that the database does not have yet"""
+    inspector = inspect(engine)
+    created = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                created.append(index.name)
+    if created:
+        # Refresh planner statistics so the new indexes are picked up
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+    return created
+
+
+def make_illustration_request_keys_unique(engine: Engine) -> int:
+    """
+    Replace the plain request_key index of illustration_jobs with a unique
+    one, so concurrent identical requests share a job. Earlier duplicates
+    (failed attempts that were submitted again) are deleted first, keeping the
+    newest job that did not fail, or else the newest. Returns the rows deleted.
+    """
+    inspector = inspect(engine)
+    if not inspector.has_table("illustration_jobs"):
+        return 0
+    index = next(
+        (i for i in inspector.get_indexes("illustration_jobs") if i["column_names"] == ["request_key"]), None
+    )
+    if index is not None and index["unique"]:
+        return 0
+    with engine.begin() as conn:
+        deleted = conn.execute(text("""
+            DELETE FROM illustration_jobs WHERE id NOT IN (
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (
+                        PARTITION BY request_key ORDER BY status = 'failed', created_at DESC
+                    ) AS position
+                    FROM illustration_jobs
+                ) WHERE position = 1
+            )
+        """)).rowcount
+        if index is not None:
+            conn.execute(text(f"DROP INDEX {index['name']}"))
+        conn.execute(text(
+            "CREATE UNIQUE INDEX ix_illustration_jobs_request_key ON illustration_jobs (request_key)"
+        ))
+    return deleted
+
+
+SPATIAL_INDEX_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS stories_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+    """CREATE TRIGGER IF NOT EXISTS stories_rtree_insert AFTER INSERT ON stories BEGIN
+        INSERT OR REPLACE INTO stories_rtree VALUES (new.id, new.lat, new.lat, new.lon, new.lon);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS stories_rtree_update AFTER UPDATE OF lat, lon ON stories BEGIN
+        INSERT OR REPLACE INTO stories_rtree VALUES (new.id, new.lat, new.lat, new.lon, new.lon);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS stories_rtree_delete AFTER DELETE ON stories BEGIN
+        DELETE FROM stories_rtree WHERE id = old.id;
+    END""",
+]
+
+
+def create_spatial_index(engine: Engine) -> bool:
+    """
+    Create the stories R*Tree and its sync triggers, backfilling existing rows.
+    Returns False if this SQLite build has no R*Tree module.
+    """
+    try:
+        with engine.begin() as conn:
+            for ddl in SPATIAL_INDEX_DDL:
+                conn.execute(text(ddl))
+            indexed = conn.execute(text("SELECT COUNT(*) FROM stories_rtree")).scalar()
+            stories = conn.execute(text("SELECT COUNT(*) FROM stories")).scalar()
+            if indexed != stories:
+                conn.execute(text("DELETE FROM stories_rtree"))
+                conn.execute(text(
+                    "INSERT INTO stories_rtree SELECT id, lat, lat, lon, lon FROM stories"
+                ))
+                print(f"✅ Built spatial index for {stories} stories")
+    except OperationalError as e:
+        print(f"⚠️ Spatial index not available, bounding-box queries will use ix_stories_lat_lon: {e}")
+        return False
+    return True
+
+
+# External-content FTS5 table: the text stays in `stories`, the index holds
+# only the terms. Triggers mirror every write, including the old values the
+# index needs to remove a row.
+FULL_TEXT_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS stories_fts USING fts5(
+        title, summary, message_to_future,
+        content='stories', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS stories_fts_insert AFTER INSERT ON stories BEGIN
+        INSERT INTO stories_fts(rowid, title, summary, message_to_future)
+        VALUES (new.id, new.title, new.summary, new.message_to_future);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS stories_fts_update AFTER UPDATE OF title, summary, message_to_future ON stories BEGIN
+        INSERT INTO stories_fts(stories_fts, rowid, title, summary, message_to_future)
+        VALUES ('delete', old.id, old.title, old.summary, old.message_to_future);
+        INSERT INTO stories_fts(rowid, title, summary, message_to_future)
+        VALUES (new.id, new.title, new.summary, new.message_to_future);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS stories_fts_delete AFTER DELETE ON stories BEGIN
+        INSERT INTO stories_fts(stories_fts, rowid, title, summary, message_to_future)
+        VALUES ('delete', old.id, old.title, old.summary, old.message_to_future);
+    END""",
+]
+
+
+def rebuild_full_text_index(engine: Engine) -> int:
+    """Re-index the text of every story; returns the number of stories"""
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO stories_fts(stories_fts) VALUES ('rebuild')"))
+        conn.execute(text("INSERT INTO stories_fts(stories_fts) VALUES ('optimize')"))
+        return conn.execute(text("SELECT COUNT(*) FROM stories")).scalar()
+
+
+def create_full_text_index(engine: Engine) -> bool:
+    """
+    Create the stories FTS5 index and its sync triggers, backfilling existing
+    rows when the index is new. Returns False if this SQLite build has no FTS5.
+    """
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'stories_fts'")).first()
+            for ddl in FULL_TEXT_INDEX_DDL:
+                conn.execute(text(ddl))
+    except OperationalError as e:
+        print(f"⚠️ Full-text index not available, story text search will scan stories: {e}")
+        return False
+    if not exists:
+        stories = rebuild_full_text_index(engine)
+        print(f"✅ Built full-text index for {stories} stories")
+    return True
+
+
+def migrate(engine: Engine) -> dict:
+    """
+    Bring an existing database up to date with the models.
+    Returns the optional features the database supports.
+    """
+    added = add_missing_columns(engine)
+    if added:
+        print(f"✅ Migrated database, added columns: {', '.join(added)}")
+    deleted = make_illustration_request_keys_unique(engine)
+    if deleted:
+        print(f"✅ Migrated database, removed {deleted} duplicate illustration jobs")
+    created = create_missing_indexes(engine)
+    if created:
+        print(f"✅ Migrated database, created indexes: {', '.join(created)}")
+    return {
+        "spatial_index": create_spatial_index(engine),
+        "full_text_index": create_full_text_index(engine),
+    }
+
+
+def move_inline_illustrations_to_blobs(engine: Engine, blob_store) -> int:
+    """Replace data: URLs stored in stories.illustration_url with blob store URLs"""
+    moved = 0
+    with engine.begin() as conn:
+        rows = conn.execute(text(
+            "SELECT id, illustration_url FROM stories WHERE illustration_url LIKE 'data:%'"
+        )).fetchall()
+        for story_id, url in rows:
+            try:
+                new_url = blob_store.put_url(url)
+            except ValueError as e:
+                print(f"⚠️ Could not move illustration of story {story_id} to the blob store: {e}")
+                continue
+            conn.execute(
+                text("UPDATE stories SET illustration_url = :url WHERE id = :id"),
+                {"url": new_url, "id": story_id}
+            )
+            moved += 1
+    if moved:
+        print(f"✅ Moved {moved} inline illustrations to the blob store")
+    return moved
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Bring legacytree.db up to date with the models")
+    parser.add_argument(
+        "--rebuild-full-text-index", action="store_true",
+        help="re-index the text of every story (e.g. after writing to the database with triggers disabled)"
+    )
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    features = migrate(engine)
+    if args.rebuild_full_text_index:
+        if not features["full_text_index"]:
+            raise SystemExit("❌ This SQLite build has no FTS5 module")
+        print(f"✅ Rebuilt full-text index for {rebuild_full_text_index(engine)} stories")
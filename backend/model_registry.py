@@ -0,0 +1,119 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+MODEL_PENDING = "pending"
+MODEL_LOADING = "loading"
+MODEL_READY = "ready"
+MODEL_FAILED = "failed"
+
+# Lower bound for Retry-After, so clients of a slow load don't poll every second
+MIN_RETRY_AFTER = 5
+
+
+class ModelNotReady(Exception):
+    """Raised when a model is requested before it has finished loading"""
+
+    def __init__(self, name: str, status: str, retry_after: Optional[int]):
+        super().__init__(f"Model '{name}' is {status}")
+        self.name = name
+        self.status = status
+        self.retry_after = retry_after
+
+
+class _ModelEntry:
+    def __init__(self, name: str, loader: Callable[[], Any], expected_seconds: float):
+        self.name = name
+        self.loader = loader
+        self.expected_seconds = expected_seconds
+        self.status = MODEL_PENDING
+        self.model = None
+        self.error = None
+        self.started_at = None
+        self.load_seconds = None
+
+
+class ModelRegistry:
+    """
+    Loads models concurrently in background threads once the server is up, so
+    startup never blocks on multi-GB downloads and loads. Callers ask for a
+    model with get(), which raises ModelNotReady instead of waiting while the
+    model is still loading.
+    """
+
+    def __init__(self):
+        self._entries: dict[str, _ModelEntry] = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def register(self, name: str, loader: Callable[[], Any], expected_seconds: float = 30.0):
+        """
+        Add a model. loader() returns the loaded model or raises; expected_seconds
+        is the typical load time, used for Retry-After hints.
+        """
+        self._entries[name] = _ModelEntry(name, loader, expected_seconds)
+
+    def start(self):
+        """Start loading every registered model, each on its own thread"""
+        if self._executor is not None or not self._entries:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=len(self._entries), thread_name_prefix="model-load")
+        for entry in self._entries.values():
+            self._executor.submit(self._load, entry)
+        self._executor.shutdown(wait=False)
+
+    def _load(self, entry: _ModelEntry):
+        with self._lock:
+            entry.status = MODEL_LOADING
+            entry.started_at = time.monotonic()
+        try:
+            model = entry.loader()
+        except Exception as e:
+            print(f"❌ Error loading model '{entry.name}': {e}")
+            with self._lock:
+                entry.status = MODEL_FAILED
+                entry.error = str(e)
+                entry.load_seconds = time.monotonic() - entry.started_at
+            return
+        with self._lock:
+            entry.model = model
+            entry.status = MODEL_READY
+            entry.load_seconds = time.monotonic() - entry.started_at
+        print(f"✅ Model '{entry.name}' ready in {entry.load_seconds:.1f}s")
+
+    def get(self, name: str) -> Any:
+        """The loaded model, or ModelNotReady while it is pending, loading or failed"""
+        entry = self._entries[name]
+        with self._lock:
+            if entry.status == MODEL_READY:
+                return entry.model
+            raise ModelNotReady(name, entry.status, self._retry_after(entry))
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def is_ready(self, name: str) -> bool:
+        entry = self._entries.get(name)
+        return entry is not None and entry.status == MODEL_READY
+
+    @staticmethod
+    def _retry_after(entry: _ModelEntry) -> Optional[int]:
+        """Seconds until the model is expected to be ready; None if it failed to load"""
+        if entry.status == MODEL_FAILED:
+            return None
+        if entry.status == MODEL_LOADING:
+            remaining = entry.expected_seconds - (time.monotonic() - entry.started_at)
+            return max(MIN_RETRY_AFTER, int(remaining))
+        return max(MIN_RETRY_AFTER, int(entry.expected_seconds))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    "status": entry.status,
+                    "load_seconds": round(entry.load_seconds, 2) if entry.load_seconds is not None else None,
+                    "error": entry.error,
+                }
+                for name, entry in self._entries.items()
+            }
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Float, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, Text, Float, DateTime, Boolean, Index, MetaData, Table
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 
@@ -6,6 +6,13 @@ Base = declarative_base()
 
 class Story(Base):
     __tablename__ = "stories"
+    __table_args__ = (
+        # Story list filters sort by date; the map looks stories up by position
+        Index("ix_stories_date", "date"),
+        Index("ix_stories_visibility_date", "visibility", "date"),
+        Index("ix_stories_theme_date", "theme", "date"),
+        Index("ix_stories_lat_lon", "lat", "lon"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(255), nullable=False)
@@ -14,6 +21,7 @@ class Story(Base):
     location = Column(String(255), nullable=False)
     lat = Column(Float, nullable=False)
     lon = Column(Float, nullable=False)
+    geocode_status = Column(String(20), default="pending")
     date = Column(DateTime, default=datetime.utcnow)
     message_to_future = Column(Text, nullable=True)
     visibility = Column(String(50), default="Public")
@@ -21,4 +29,48 @@ class Story(Base):
     image_path = Column(String(500), nullable=True)
     illustration_url = Column(String(500), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow) 
\ No newline at end of file
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow) 
+
+class IllustrationJob(Base):
+    __tablename__ = "illustration_jobs"
+
+    id = Column(String(32), primary_key=True)
+    # Hash of the generation inputs, so a retried request reuses the same job
+    request_key = Column(String(64), nullable=False, index=True, unique=True)
+    story_text = Column(Text, nullable=False)
+    style = Column(String(50), nullable=False)
+    # Quality tier: "full" or the fast low-resolution "preview"
+    tier = Column(String(20), nullable=False, default="full")
+    status = Column(String(20), nullable=False, default="queued")
+    step = Column(Integer, nullable=False, default=0)
+    total_steps = Column(Integer, nullable=True)
+    result_hash = Column(String(64), nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# SQLite R*Tree over story coordinates, kept in sync with `stories` by triggers.
+# It is a virtual table, so it lives outside Base.metadata and is created by
+# migrations.create_spatial_index() instead of create_all().
+stories_rtree = Table(
+    "stories_rtree",
+    MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("min_lat", Float),
+    Column("max_lat", Float),
+    Column("min_lon", Float),
+    Column("max_lon", Float),
+)
+
+
+# FTS5 index over story text, kept in sync with `stories` by triggers and
+# created by migrations.create_full_text_index(). rowid is the story id.
+stories_fts = Table(
+    "stories_fts",
+    MetaData(),
+    Column("rowid", Integer, primary_key=True),
+    Column("title", Text),
+    Column("summary", Text),
+    Column("message_to_future", Text),
+)
@@ -0,0 +1,60 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+    `rate` tokens are added per second, up to `capacity`. With capacity=1 the
+    bucket enforces a strict spacing of 1/rate seconds between acquisitions,
+    no matter how many threads are waiting.
+    """
+
+    def __init__(self, rate: float = 1.0, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+        self.total_acquired = 0
+        self.total_wait_seconds = 0.0
+
+    def _refill(self, now: float):
+        elapsed = now - self._last_refill
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._last_refill = now
+
+    def try_acquire(self) -> bool:
+        """Take a token without waiting, returns False if none is available"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.total_acquired += 1
+                return True
+            return False
+
+    def acquire(self):
+        """
+        Block until a token is available and take it.
+        Tokens are reserved under the lock (the balance may go negative), so
+        waiters are served in arrival order and never overshoot the rate.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            wait = 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+            self.total_acquired += 1
+            self.total_wait_seconds += wait
+
+        if wait > 0:
+            time.sleep(wait)
+
+    def stats(self) -> dict:
+        return {
+            "rate_per_second": self.rate,
+            "capacity": self.capacity,
+            "acquired": self.total_acquired,
+            "total_wait_seconds": round(self.total_wait_seconds, 3),
+        }
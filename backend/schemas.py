@@ -31,6 +31,7 @@ class StoryUpdate(BaseModel):
 
 class Story(StoryBase):
     id: int
+    geocode_status: Optional[str] = None
     created_at: datetime
     updated_at: datetime
 
@@ -38,4 +39,18 @@ class Story(StoryBase):
         from_attributes = True
 
 class ConversationRequest(BaseModel):
-    history: list[str] 
\ No newline at end of file
+    history: list[str] 
+
+class GeocodeBatchRequest(BaseModel):
+    locations: list[str]
+
+class ProcessStoryBatchRequest(BaseModel):
+    texts: list[str]
+    batch_size: Optional[int] = None
+
+class IllustrationJobRequest(BaseModel):
+    text: str
+    style: str = "realistic"
+    tier: str = "full"
+    # With tier "preview", also queue a full-quality render of the same story
+    refine: bool = False
@@ -1,21 +1,29 @@
-import whisper
 import tempfile
 import os
 from gtts import gTTS
 import base64
 import io
+import threading
 from typing import Optional, Tuple
-import torch
+
+import numpy as np
+
+from audio_decoding import decode_audio
 
 class SpeechService:
     def __init__(self):
         self.whisper_model = None
         self.model_loaded = False
+        # One transcription at a time: uploads and streams share the model
+        self._transcribe_lock = threading.Lock()
         
     def load_whisper_model(self):
         """Load the Whisper model for speech-to-text"""
         try:
             print("🔄 Loading Whisper model for speech recognition...")
+            # Deferred: importing whisper pulls in torch
+            import whisper
+
             # Use a smaller model for faster processing
             self.whisper_model = whisper.load_model("base")
             self.model_loaded = True
@@ -27,6 +35,7 @@ class SpeechService:
     def speech_to_text(self, audio_data: bytes, language: str = "en") -> Optional[str]:
         """
         Convert speech audio to text using Whisper
+        The audio is decoded in memory; AudioDecodeError is raised if it cannot be
         """
         if not self.model_loaded:
             print("⚠️ Whisper model not loaded, attempting to load now...")
@@ -34,19 +43,12 @@ class SpeechService:
             if not self.model_loaded:
                 return None
         
+        # 16 kHz float32 samples, passed to Whisper directly instead of a file path
+        audio = decode_audio(audio_data)
+
         try:
-            # Save audio data to temporary file
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-                temp_file.write(audio_data)
-                temp_file_path = temp_file.name
-            
             # Transcribe audio
-            result = self.whisper_model.transcribe(temp_file_path, language=language)
-            
-            # Clean up temporary file
-            os.unlink(temp_file_path)
-            
-            transcribed_text = result["text"].strip()
+            transcribed_text = self.transcribe_samples(audio, language)
             print(f"✅ Speech transcribed: {transcribed_text}")
             return transcribed_text
             
@@ -54,6 +56,12 @@ class SpeechService:
             print(f"❌ Error in speech-to-text: {e}")
             return None
     
+    def transcribe_samples(self, audio: np.ndarray, language: str = "en", **options) -> str:
+        """Transcribe 16 kHz mono float32 samples; options are passed to Whisper"""
+        with self._transcribe_lock:
+            result = self.whisper_model.transcribe(audio, language=language, **options)
+        return result["text"].strip()
+    
     def text_to_speech(self, text: str, language: str = "en", slow: bool = False) -> Optional[str]:
         """
         Convert text to speech using gTTS
@@ -0,0 +1,315 @@
+"""
+Story queries shared by the API endpoints and the benchmarks.
+"""
+import base64
+import json
+import re
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import Integer, and_, cast, func, literal_column, or_, select
+from sqlalchemy.orm import Query, Session
+
+from models import Story, stories_fts, stories_rtree
+
+STORY_FIELDS = [
+    "id", "title", "summary", "theme", "location", "lat", "lon", "date",
+    "message_to_future", "visibility", "illustration_url", "geocode_status",
+    "created_at", "updated_at",
+]
+
+# Named projections accepted by `fields=`
+FIELD_PRESETS = {
+    "pin": ["id", "title", "theme", "lat", "lon"],
+}
+
+
+# At or below this zoom level, bounding-box queries return clusters instead of pins
+CLUSTER_MAX_ZOOM = 10
+# Clusters are grid cells of 1/CLUSTER_CELLS_PER_TILE of a web map tile
+CLUSTER_CELLS_PER_TILE = 8
+MAX_BBOX_PINS = 5000
+
+# bm25 weights of the indexed columns: title, summary, message_to_future
+SEARCH_COLUMN_WEIGHTS = (5.0, 1.0, 1.0)
+SEARCH_SNIPPET_TOKENS = 16
+SEARCH_HIGHLIGHT = ("<mark>", "</mark>")
+
+
+class InvalidQueryParameter(ValueError):
+    pass
+
+
+def parse_fields(fields: Optional[str]) -> Optional[list[str]]:
+    """Turn a `fields=` value ("pin" or "id,title,lat") into a column list, None for all"""
+    if not fields:
+        return None
+    if fields in FIELD_PRESETS:
+        return FIELD_PRESETS[fields]
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in requested if name not in STORY_FIELDS]
+    if unknown:
+        raise InvalidQueryParameter(f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+
+def encode_cursor(date: Optional[datetime], story_id: int) -> str:
+    payload = json.dumps({"d": date.isoformat() if date else None, "i": story_id})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[Optional[datetime], int]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        date = datetime.fromisoformat(payload["d"]) if payload["d"] else None
+        return date, int(payload["i"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidQueryParameter("Invalid cursor") from e
+
+
+def list_stories_query(
+    db: Session, visibility: Optional[str] = None, theme: Optional[str] = None, descending: bool = False
+) -> Query:
+    """
+    Stories in date order, optionally filtered by visibility and theme.
+    Filtered listings are served by the (visibility, date) and (theme, date) indexes.
+    """
+    query = db.query(Story)
+    if visibility:
+        query = query.filter(Story.visibility == visibility)
+    if theme:
+        query = query.filter(Story.theme == theme)
+    if descending:
+        return query.order_by(Story.date.desc(), Story.id.desc())
+    return query.order_by(Story.date, Story.id)
+
+
+def encode_offset_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"o": offset}).encode()).decode()
+
+
+def decode_offset_cursor(cursor: str) -> int:
+    try:
+        offset = int(json.loads(base64.urlsafe_b64decode(cursor.encode()))["o"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidQueryParameter("Invalid cursor") from e
+    if offset < 0:
+        raise InvalidQueryParameter("Invalid cursor")
+    return offset
+
+
+def search_terms(q: str) -> list[str]:
+    """Words of a search query; a trailing * makes a word a prefix ("grand*")"""
+    terms = re.findall(r"\w+\*?", q)
+    if not terms:
+        raise InvalidQueryParameter("q must contain at least one word")
+    return terms
+
+
+def fts_match_expression(q: str) -> str:
+    """
+    FTS5 query matching stories that contain every word of q. Words are
+    quoted, so FTS5 syntax in q (AND, NEAR, quotes, column filters) is
+    searched for literally instead of failing to parse.
+    """
+    return " ".join(f'"{term.rstrip("*")}"' + ("*" if term.endswith("*") else "") for term in search_terms(q))
+
+
+def search_stories_query(
+    db: Session,
+    q: str,
+    visibility: Optional[str] = None,
+    theme: Optional[str] = None,
+    fields: Optional[list[str]] = None
+) -> Query:
+    """
+    Stories matching q through the FTS5 index, best match first (bm25, with
+    title matches weighted up), with a highlighted snippet of the best column.
+    """
+    fts = literal_column("stories_fts")
+    rank = func.bm25(fts, *SEARCH_COLUMN_WEIGHTS).label("bm25")
+    snippet = func.snippet(fts, -1, *SEARCH_HIGHLIGHT, "…", SEARCH_SNIPPET_TOKENS).label("snippet")
+    entities = [Story] if fields is None else [getattr(Story, name) for name in fields]
+    query = (
+        db.query(*entities, rank, snippet)
+        .join(stories_fts, stories_fts.c.rowid == Story.id)
+        .filter(fts.op("MATCH")(fts_match_expression(q)))
+    )
+    if visibility:
+        query = query.filter(Story.visibility == visibility)
+    if theme:
+        query = query.filter(Story.theme == theme)
+    return query.order_by(rank, Story.id)
+
+
+def text_search_filter(q: str):
+    """
+    Substring match of every word of q against the story text, for databases
+    without the FTS5 index. Scans every story.
+    """
+    return and_(*(
+        or_(*(
+            column.contains(term.rstrip("*"), autoescape=True)
+            for column in (Story.title, Story.summary, Story.message_to_future)
+        ))
+        for term in search_terms(q)
+    ))
+
+
+def fetch_search_page(
+    query: Query,
+    limit: Optional[int],
+    cursor: Optional[str] = None,
+    fields: Optional[list[str]] = None
+) -> tuple[list, Optional[str]]:
+    """
+    Run a search_stories_query, returning ([(story, score, snippet)], next cursor).
+    story is a Story, or a dict of `fields`; a higher score is a better match.
+    Results are ranked rather than date-ordered, so pages are cut by position.
+    """
+    offset = decode_offset_cursor(cursor) if cursor else 0
+    query = query.offset(offset)
+    rows = query.all() if limit is None else query.limit(limit + 1).all()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_offset_cursor(offset + limit)
+
+    hits = []
+    for row in rows:
+        story = row.Story if fields is None else {name: getattr(row, name) for name in fields}
+        hits.append((story, -row.bm25, row.snippet))
+    return hits, next_cursor
+
+
+def after_cursor(query: Query, cursor: str, descending: bool = False) -> Query:
+    """
+    Keyset pagination: continue a (date, id) ordered listing after the cursor row.
+    SQLite sorts NULL dates first, so they are handled as the lowest date.
+    """
+    date, story_id = decode_cursor(cursor)
+    if descending:
+        if date is None:
+            return query.filter(Story.date.is_(None), Story.id < story_id)
+        return query.filter(or_(
+            Story.date < date,
+            and_(Story.date == date, Story.id < story_id),
+            Story.date.is_(None),
+        ))
+
+    if date is None:
+        return query.filter(or_(
+            and_(Story.date.is_(None), Story.id > story_id),
+            Story.date.isnot(None),
+        ))
+    return query.filter(or_(
+        Story.date > date,
+        and_(Story.date == date, Story.id > story_id),
+    ))
+
+
+def fetch_story_page(
+    query: Query,
+    limit: Optional[int],
+    cursor: Optional[str] = None,
+    fields: Optional[list[str]] = None,
+    descending: bool = False
+) -> tuple[list, Optional[str]]:
+    """
+    Run a date-ordered story listing, returning (rows, next cursor).
+    With `fields`, only those columns are loaded and rows are plain dicts.
+    """
+    if cursor:
+        query = after_cursor(query, cursor, descending)
+
+    if fields is not None:
+        # id and date are always loaded so the next cursor can be built
+        columns = list(dict.fromkeys(fields + ["id", "date"]))
+        query = query.with_entities(*(getattr(Story, name) for name in columns))
+
+    if limit is None:
+        rows = query.all()
+        next_cursor = None
+    else:
+        rows = query.limit(limit + 1).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].date, rows[-1].id)
+
+    if fields is not None:
+        rows = [{name: getattr(row, name) for name in fields} for row in rows]
+    return rows, next_cursor
+
+
+def _lon_ranges(min_lon: float, max_lon: float) -> list[tuple[float, float]]:
+    """Split a longitude range that crosses the antimeridian (min_lon > max_lon)"""
+    if min_lon <= max_lon:
+        return [(min_lon, max_lon)]
+    return [(min_lon, 180.0), (-180.0, max_lon)]
+
+
+def bbox_filter(
+    min_lat: float, max_lat: float, min_lon: float, max_lon: float, use_rtree: bool = True
+):
+    """
+    Filter clause selecting stories inside a bounding box.
+    With the R*Tree, candidate ids come from the spatial index and are then
+    checked against the exact coordinates (the R*Tree stores 32-bit floats).
+    """
+    exact = [
+        and_(Story.lat.between(min_lat, max_lat), Story.lon.between(low, high))
+        for low, high in _lon_ranges(min_lon, max_lon)
+    ]
+    if not use_rtree:
+        return or_(*exact)
+
+    candidates = select(stories_rtree.c.id).where(
+        stories_rtree.c.max_lat >= min_lat,
+        stories_rtree.c.min_lat <= max_lat,
+        or_(*(
+            and_(stories_rtree.c.max_lon >= low, stories_rtree.c.min_lon <= high)
+            for low, high in _lon_ranges(min_lon, max_lon)
+        )),
+    )
+    return and_(Story.id.in_(candidates), or_(*exact))
+
+
+def cluster_cell_size(zoom: int) -> float:
+    """Width of a cluster grid cell in degrees at a web map zoom level"""
+    return 360.0 / (2 ** zoom) / CLUSTER_CELLS_PER_TILE
+
+
+def bbox_clusters(db: Session, zoom: int, bbox_clause, visibility: Optional[str] = None) -> list[dict]:
+    """Aggregate stories in a bounding box into grid cells (count and centroid per cell)"""
+    cell = cluster_cell_size(zoom)
+    # lat + 90 and lon + 180 are never negative, so the integer cast is a floor
+    cell_y = cast((Story.lat + 90.0) / cell, Integer)
+    cell_x = cast((Story.lon + 180.0) / cell, Integer)
+    query = db.query(
+        cell_y.label("cell_y"),
+        cell_x.label("cell_x"),
+        func.count(Story.id).label("count"),
+        func.avg(Story.lat).label("lat"),
+        func.avg(Story.lon).label("lon"),
+        func.min(Story.id).label("story_id"),
+    ).filter(bbox_clause)
+    if visibility:
+        query = query.filter(Story.visibility == visibility)
+
+    clusters = []
+    for row in query.group_by(cell_y, cell_x):
+        cluster = {"count": row.count, "lat": row.lat, "lon": row.lon}
+        if row.count == 1:
+            cluster["story_id"] = row.story_id
+        clusters.append(cluster)
+    return clusters
+
+
+def bbox_pins(db: Session, bbox_clause, visibility: Optional[str] = None, limit: int = MAX_BBOX_PINS) -> list[dict]:
+    """Pins (id, title, theme, lat, lon) for stories in a bounding box"""
+    fields = FIELD_PRESETS["pin"]
+    query = db.query(*(getattr(Story, name) for name in fields)).filter(bbox_clause)
+    if visibility:
+        query = query.filter(Story.visibility == visibility)
+    return [{name: getattr(row, name) for name in fields} for row in query.limit(limit)]
@@ -0,0 +1,534 @@
+import json
+import math
+import os
+import threading
+import time
+from typing import Callable, Iterable, List, Optional
+
+import numpy as np
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from cache import MISSING, LRUCache
+from models import Story
+
+INITIAL_CAPACITY = 1024
+# k-means sample size per inverted list when the IVF index is trained
+TRAIN_POINTS_PER_LIST = 32
+KMEANS_ITERATIONS = 10
+# Rows scored per matrix product when assigning rows to lists
+ASSIGN_CHUNK_ROWS = 65536
+QUERY_CACHE_MAX_ENTRIES = 1024
+# Delay before embedding a failed batch again, doubling while batches keep failing
+EMBED_RETRY_BACKOFF = 5.0
+EMBED_RETRY_MAX = 300.0
+
+
+def load_encoder(model_name: str):
+    """Sentence embedding model (imported here so startup never imports torch)"""
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name, device="cpu")
+
+
+def story_search_text(title: str, summary: str, location: str, theme: str) -> str:
+    """The text embedded for a story"""
+    return f"{title}. {summary} ({location}, {theme})"
+
+
+def _open_array(path: str, dtype, rows: int, cols: Optional[int] = None, fill=0) -> np.memmap:
+    """Memory-map a rows x cols file, creating or growing it (new rows are set to fill)"""
+    row_bytes = np.dtype(dtype).itemsize * (cols or 1)
+    old_rows = os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+    with open(path, "ab") as f:
+        f.truncate(max(old_rows, rows) * row_bytes)
+    array = np.memmap(path, dtype=dtype, mode="r+", shape=(rows, cols) if cols else (rows,))
+    if old_rows < rows:
+        array[old_rows:] = fill
+    return array
+
+
+def _kmeans(points: np.ndarray, n_lists: int, iterations: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on unit vectors; returns unit centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = points[rng.choice(len(points), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(points @ centroids.T, axis=1)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=n_lists)
+        occupied = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts[occupied])[:-1]))
+        centroids[occupied] = np.add.reduceat(points[order], starts, axis=0)
+        # Lists that lost all their points start again from a random point
+        empty = np.flatnonzero(counts == 0)
+        centroids[empty] = points[rng.choice(len(points), len(empty), replace=False)]
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    return centroids
+
+
+class VectorIndex:
+    """
+    Unit-length story embeddings in memory-mapped float32 files, searched by
+    inner product (cosine similarity).
+
+    vectors.f32 holds one row per story and ids.i64 the story id of each row
+    (-1 for free rows). A story keeps its row when it is re-embedded, and
+    deleted rows are reused, so the files only grow with the number of stories.
+
+    Below ivf_min_rows every row is scored. Beyond that, rows are grouped into
+    inverted lists around k-means centroids (IVF) and a query scores only the
+    rows of the nprobe lists nearest to it. New rows join the list of their
+    nearest centroid; the centroids are retrained in the background when the
+    index has doubled since they were trained. List membership is kept in
+    lists.i32, so reopening the index does not retrain it.
+    """
+
+    def __init__(self, directory: str, model_name: str, nprobe: int = 16, ivf_min_rows: int = 20000):
+        self.directory = directory
+        self.model_name = model_name
+        self.nprobe = nprobe
+        self.ivf_min_rows = ivf_min_rows
+        self.dim = None
+        self.rows = 0
+        self.trained_rows = 0
+        self.ready = False
+
+        self._vectors = None
+        self._ids = None
+        self._lists = None
+        self._centroids = None
+        self._row_of: dict[int, int] = {}
+        self._free_rows: list[int] = []
+        self._list_rows: dict[int, set] = {}
+        self._list_arrays: dict[int, np.ndarray] = {}
+        # Rows written while the centroids are being retrained
+        self._dirty_rows: Optional[set] = None
+        self._lock = threading.RLock()
+
+    # --- Files ---
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _write_meta(self):
+        meta = {"model": self.model_name, "dim": self.dim, "trained_rows": self.trained_rows}
+        temporary = self._path("meta.json.tmp")
+        with open(temporary, "w") as f:
+            json.dump(meta, f)
+        os.replace(temporary, self._path("meta.json"))
+
+    def _open(self, capacity: int):
+        self._vectors = _open_array(self._path("vectors.f32"), np.float32, capacity, self.dim)
+        self._ids = _open_array(self._path("ids.i64"), np.int64, capacity, fill=-1)
+        self._lists = _open_array(self._path("lists.i32"), np.int32, capacity, fill=-1)
+
+    def load(self):
+        """Open the index files, starting over if they were built with another model"""
+        os.makedirs(self.directory, exist_ok=True)
+        meta = {}
+        if os.path.exists(self._path("meta.json")):
+            with open(self._path("meta.json")) as f:
+                meta = json.load(f)
+        if meta and meta.get("model") != self.model_name:
+            print(f"⚠️ Search index was built with {meta.get('model')}, rebuilding for {self.model_name}")
+            for name in ("vectors.f32", "ids.i64", "lists.i32", "centroids.npy", "meta.json"):
+                if os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+            meta = {}
+
+        with self._lock:
+            if meta:
+                self.dim = meta["dim"]
+                self.trained_rows = meta.get("trained_rows", 0)
+                self._open(os.path.getsize(self._path("ids.i64")) // 8)
+                live = np.flatnonzero(self._ids >= 0)
+                self.rows = int(live[-1]) + 1 if len(live) else 0
+                self._row_of = dict(zip(self._ids[live].tolist(), live.tolist()))
+                self._free_rows = np.flatnonzero(self._ids[:self.rows] < 0).tolist()[::-1]
+                if os.path.exists(self._path("centroids.npy")):
+                    self._centroids = np.load(self._path("centroids.npy"))
+                    self._rebuild_lists(live)
+            self.ready = True
+        print(f"✅ Search index loaded with {len(self._row_of)} stories")
+
+    def _rebuild_lists(self, live: np.ndarray):
+        """Group live rows by inverted list, assigning any that have no list yet"""
+        unassigned = live[self._lists[live] < 0]
+        if len(unassigned):
+            self._lists[unassigned] = np.argmax(np.asarray(self._vectors[unassigned]) @ self._centroids.T, axis=1)
+        lists = self._lists[live]
+        order = np.argsort(lists, kind="stable")
+        lists, rows = lists[order], live[order]
+        boundaries = np.flatnonzero(np.diff(lists)) + 1
+        self._list_rows = {
+            int(list_group[0]): set(row_group.tolist())
+            for list_group, row_group in zip(np.split(lists, boundaries), np.split(rows, boundaries))
+            if len(list_group)
+        }
+        self._list_arrays = {}
+
+    def flush(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._ids.flush()
+                self._lists.flush()
+
+    # --- Updates ---
+
+    def _allocate_row(self) -> int:
+        if self._free_rows:
+            return self._free_rows.pop()
+        if self.rows == len(self._ids):
+            self._open(len(self._ids) * 2)
+        self.rows += 1
+        return self.rows - 1
+
+    def _move_to_list(self, row: int, list_id: int):
+        old = int(self._lists[row])
+        if old == list_id:
+            return
+        if old >= 0:
+            self._list_rows[old].discard(row)
+            self._list_arrays.pop(old, None)
+        if list_id >= 0:
+            self._list_rows.setdefault(list_id, set()).add(row)
+            self._list_arrays.pop(list_id, None)
+        self._lists[row] = list_id
+
+    def upsert(self, story_ids: List[int], vectors: np.ndarray):
+        """Add or replace the embeddings of stories (vectors are unit length)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._open(INITIAL_CAPACITY)
+                self._write_meta()
+            list_ids = (
+                np.argmax(vectors @ self._centroids.T, axis=1)
+                if self._centroids is not None else np.full(len(story_ids), -1)
+            )
+            for story_id, vector, list_id in zip(story_ids, vectors, list_ids.tolist()):
+                row = self._row_of.get(story_id)
+                if row is None:
+                    row = self._allocate_row()
+                    self._row_of[story_id] = row
+                self._vectors[row] = vector
+                self._ids[row] = story_id
+                self._move_to_list(row, list_id)
+                if self._dirty_rows is not None:
+                    self._dirty_rows.add(row)
+
+    def remove(self, story_id: int):
+        with self._lock:
+            row = self._row_of.pop(story_id, None)
+            if row is None:
+                return
+            self._ids[row] = -1
+            self._move_to_list(row, -1)
+            self._free_rows.append(row)
+            if self._dirty_rows is not None:
+                self._dirty_rows.discard(row)
+
+    def story_ids(self) -> set:
+        with self._lock:
+            return set(self._row_of)
+
+    # --- IVF training ---
+
+    def needs_training(self) -> bool:
+        live = len(self._row_of)
+        return live >= self.ivf_min_rows and (self._centroids is None or live >= 2 * self.trained_rows)
+
+    def train(self):
+        """
+        Cluster the current rows into about sqrt(n) inverted lists and assign
+        every row to one. Runs without blocking searches or updates; rows
+        written meanwhile are reassigned at the end.
+        """
+        start = time.monotonic()
+        with self._lock:
+            rows = self.rows
+            vectors = self._vectors
+            live = np.flatnonzero(self._ids[:rows] >= 0)
+            self._dirty_rows = set()
+        n_lists = max(1, int(math.sqrt(len(live))))
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(live, min(len(live), n_lists * TRAIN_POINTS_PER_LIST), replace=False))
+        centroids = _kmeans(np.asarray(vectors[sample]), n_lists, KMEANS_ITERATIONS)
+
+        assignments = np.full(rows, -1, dtype=np.int32)
+        for chunk_start in range(0, rows, ASSIGN_CHUNK_ROWS):
+            chunk_end = min(chunk_start + ASSIGN_CHUNK_ROWS, rows)
+            chunk = np.asarray(vectors[chunk_start:chunk_end])
+            assignments[chunk_start:chunk_end] = np.argmax(chunk @ centroids.T, axis=1)
+
+        with self._lock:
+            self._lists[:rows] = np.where(self._ids[:rows] >= 0, assignments, -1)
+            self._centroids = centroids
+            changed = np.array(sorted(self._dirty_rows | set(range(rows, self.rows))), dtype=np.int64)
+            changed = changed[self._ids[changed] >= 0]
+            if len(changed):
+                self._lists[changed] = np.argmax(np.asarray(self._vectors[changed]) @ centroids.T, axis=1)
+            self._dirty_rows = None
+            self._rebuild_lists(np.flatnonzero(self._ids[:self.rows] >= 0))
+            self.trained_rows = len(self._row_of)
+            np.save(self._path("centroids.npy"), centroids)
+            self.flush()
+            self._write_meta()
+        print(f"✅ Search index trained: {n_lists} lists over {len(live)} stories in {time.monotonic() - start:.1f}s")
+
+    # --- Search ---
+
+    def _list_array(self, list_id: int) -> np.ndarray:
+        array = self._list_arrays.get(list_id)
+        if array is None:
+            array = np.fromiter(self._list_rows.get(list_id, ()), dtype=np.int64)
+            array.sort()
+            self._list_arrays[list_id] = array
+        return array
+
+    def search(self, query: np.ndarray, k: int, nprobe: Optional[int] = None) -> List[tuple[int, float]]:
+        """
+        (story_id, similarity) of the k nearest stories, most similar first.
+        With IVF lists, only the stories of the nprobe lists nearest to the
+        query (default self.nprobe) are scored, so fewer than k may be found.
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        with self._lock:
+            if not self._row_of:
+                return []
+            if self._centroids is None:
+                rows = np.arange(self.rows)
+                scores = self._vectors[:self.rows] @ query
+                scores[self._ids[:self.rows] < 0] = -np.inf
+            else:
+                nprobe = min(nprobe or self.nprobe, len(self._centroids))
+                probe = np.argpartition(-(self._centroids @ query), nprobe - 1)[:nprobe]
+                rows = np.concatenate([self._list_array(list_id) for list_id in probe.tolist()])
+                scores = self._vectors[rows] @ query
+            if len(scores) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                top = np.arange(len(scores))
+            top = top[np.argsort(-scores[top])]
+            return [(int(self._ids[rows[i]]), float(scores[i])) for i in top.tolist() if scores[i] > -np.inf]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "stories": len(self._row_of),
+                "dim": self.dim,
+                "ivf_lists": len(self._centroids) if self._centroids is not None else 0,
+                "nprobe": self.nprobe,
+            }
+
+
+class StoryEmbeddingWorker:
+    """
+    Background worker that embeds stories after they are saved and keeps the
+    vector index in sync. Story ids are queued once however often a story is
+    edited before it is embedded, and embedded in batches.
+    """
+
+    def __init__(
+        self,
+        index: VectorIndex,
+        session_factory: Callable[[], Session],
+        get_encoder: Callable[[], Optional[object]],
+        batch_size: int = 32
+    ):
+        self.index = index
+        self.session_factory = session_factory
+        self.get_encoder = get_encoder
+        self.batch_size = batch_size
+
+        self._pending: set[int] = set()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._failures = 0
+        self.embedded = 0
+
+    def start(self):
+        """Load the index, then queue stories saved while it was not running"""
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="story-embedding", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def enqueue(self, story_ids: Iterable[int]):
+        with self._condition:
+            self._pending.update(story_ids)
+            self._condition.notify()
+
+    def remove(self, story_id: int):
+        with self._condition:
+            self._pending.discard(story_id)
+        self.index.remove(story_id)
+
+    def resume_pending(self):
+        """Embed stories missing from the index and drop index rows of deleted stories"""
+        db = self.session_factory()
+        try:
+            story_ids = {story_id for (story_id,) in db.query(Story.id)}
+        finally:
+            db.close()
+        indexed = self.index.story_ids()
+        for story_id in indexed - story_ids:
+            self.index.remove(story_id)
+        missing = story_ids - indexed
+        if missing:
+            print(f"🔄 Embedding {len(missing)} stories for search")
+            self.enqueue(missing)
+
+    def _run(self):
+        self.index.load()
+        self.resume_pending()
+        if self.index.needs_training():
+            self.index.train()
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+            encoder = self.get_encoder()
+            if encoder is None:
+                # Model still loading
+                with self._condition:
+                    self._condition.wait(1.0)
+                continue
+            with self._condition:
+                batch = [self._pending.pop() for _ in range(min(self.batch_size, len(self._pending)))]
+            try:
+                self._embed(encoder, batch)
+            except Exception as e:
+                self._failures += 1
+                delay = min(EMBED_RETRY_MAX, EMBED_RETRY_BACKOFF * 2 ** (self._failures - 1))
+                print(f"❌ Error embedding stories for search, retrying in {delay:.0f}s: {e}")
+                deadline = time.monotonic() + delay
+                with self._condition:
+                    self._pending.update(batch)
+                    # New stories notify the condition; keep waiting out the delay
+                    while not self._stopping and time.monotonic() < deadline:
+                        self._condition.wait(deadline - time.monotonic())
+                continue
+            self._failures = 0
+            if not self._pending and self.index.needs_training():
+                self.index.train()
+
+    def _embed(self, encoder, story_ids: List[int]):
+        db = self.session_factory()
+        try:
+            stories = db.query(Story.id, Story.title, Story.summary, Story.location, Story.theme).filter(
+                Story.id.in_(story_ids)
+            ).all()
+        finally:
+            db.close()
+        texts = [story_search_text(story.title, story.summary, story.location, story.theme) for story in stories]
+        if texts:
+            vectors = encoder.encode(texts, batch_size=self.batch_size, normalize_embeddings=True, convert_to_numpy=True)
+            self.index.upsert([story.id for story in stories], vectors)
+            self.index.flush()
+            self.embedded += len(stories)
+        # Stories deleted before they were embedded
+        for story_id in set(story_ids) - {story.id for story in stories}:
+            self.index.remove(story_id)
+
+    def stats(self) -> dict:
+        with self._condition:
+            pending = len(self._pending)
+        return {"pending": pending, "embedded": self.embedded, "index": self.index.stats()}
+
+
+_query_cache = LRUCache(max_entries=QUERY_CACHE_MAX_ENTRIES)
+
+
+def search_stories(
+    index: VectorIndex,
+    encoder,
+    query: str,
+    k: int,
+    keep: Optional[Callable[[List[int]], set]] = None
+) -> List[tuple[int, float]]:
+    """
+    (story_id, similarity) of the k stories nearest to a text query.
+
+    keep(story_ids) returns the ids a filter lets through. The search is then
+    widened, four times as many neighbours at a time and then more IVF lists,
+    until k stories pass or every story has been scored.
+    """
+    key = f"{index.model_name}:{query}"
+    vector = _query_cache.get(key)
+    if vector is MISSING:
+        vector = encoder.encode([query], normalize_embeddings=True, convert_to_numpy=True)[0]
+        _query_cache.set(key, vector)
+    if keep is None:
+        return index.search(vector, k)
+
+    wanted = k * 4
+    nprobe = index.nprobe
+    checked, kept = set(), set()
+    while True:
+        hits = index.search(vector, wanted, nprobe)
+        unchecked = [story_id for story_id, _ in hits if story_id not in checked]
+        checked.update(unchecked)
+        kept |= keep(unchecked) if unchecked else set()
+        results = [hit for hit in hits if hit[0] in kept]
+        if len(results) >= k:
+            return results[:k]
+        if len(hits) == wanted:
+            wanted *= 4
+        elif nprobe < index.stats()["ivf_lists"]:
+            # The probed lists are used up; probe more
+            nprobe *= 2
+        else:
+            return results
+
+
+def register_story_listeners(worker: StoryEmbeddingWorker):
+    """
+    Re-embed stories when their title, summary, location or theme change
+    through the ORM, and drop deleted stories from the index. Changes are
+    applied once the transaction commits.
+    """
+
+    def pending(target) -> list:
+        return object_session(target).info.setdefault("search_index_changes", [])
+
+    def after_insert(mapper, connection, target):
+        pending(target).append((target.id, False))
+
+    def after_update(mapper, connection, target):
+        state = inspect(target)
+        if any(state.attrs[name].history.has_changes() for name in ("title", "summary", "location", "theme")):
+            pending(target).append((target.id, False))
+
+    def after_delete(mapper, connection, target):
+        pending(target).append((target.id, True))
+
+    def after_commit(session):
+        for story_id, deleted in session.info.pop("search_index_changes", []):
+            if deleted:
+                worker.remove(story_id)
+            else:
+                worker.enqueue([story_id])
+
+    def after_rollback(session):
+        session.info.pop("search_index_changes", None)
+
+    event.listen(Story, "after_insert", after_insert)
+    event.listen(Story, "after_update", after_update)
+    event.listen(Story, "after_delete", after_delete)
+    event.listen(Session, "after_commit", after_commit)
+    event.listen(Session, "after_rollback", after_rollback)
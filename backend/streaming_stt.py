@@ -0,0 +1,235 @@
+"""
+Streaming speech-to-text: raw PCM frames in over a WebSocket, partial and
+final transcripts out while the speaker is still talking.
+"""
+import asyncio
+import collections
+import json
+import math
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+from fastapi import WebSocket, WebSocketDisconnect
+
+import config
+from audio_decoding import pcm_to_float32, resample
+
+FRAME_MS = 30
+
+# (kind, utterance index, samples) with kind "partial" or "final"
+TranscriptionRequest = Tuple[str, int, np.ndarray]
+
+
+class VoiceActivityDetector:
+    """
+    Energy-based voice activity detection on FRAME_MS frames.
+
+    A frame is speech when its level is threshold_db above the background
+    noise and above min_level_db. The noise level follows quiet frames
+    quickly and louder frames slowly, so it adapts to a noisy room without
+    taking a long utterance for background.
+    """
+
+    def __init__(self, threshold_db: float = 9.0, min_level_db: float = -45.0):
+        self.threshold_db = threshold_db
+        self.min_level_db = min_level_db
+        self.noise_db = min_level_db - threshold_db
+
+    def is_speech(self, frame: np.ndarray) -> bool:
+        rms = math.sqrt(float(np.mean(frame * frame))) if len(frame) else 0.0
+        level_db = 20 * math.log10(max(rms, 1e-6))
+        speech = level_db > max(self.min_level_db, self.noise_db + self.threshold_db)
+        if level_db < self.noise_db:
+            rate = 0.3
+        else:
+            rate = 0.002 if speech else 0.05
+        self.noise_db += rate * (level_db - self.noise_db)
+        return speech
+
+
+class SpeechSegmenter:
+    """
+    Cuts a stream of samples into utterances with the voice activity detector.
+
+    An utterance starts after start_frames speech frames, keeping pre_roll_ms
+    of audio before them so the first syllable is not clipped, and ends after
+    silence_ms without speech or at max_segment_seconds. feed() returns the
+    transcription requests the new samples trigger: a "partial" of the
+    utterance so far every partial_interval seconds, and a "final" when it ends.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int,
+        vad: Optional[VoiceActivityDetector] = None,
+        partial_interval: float = 1.0,
+        silence_ms: int = 700,
+        max_segment_seconds: float = 20.0,
+        pre_roll_ms: int = 300,
+        start_frames: int = 3
+    ):
+        self.sample_rate = sample_rate
+        self.vad = vad or VoiceActivityDetector()
+        self.frame_size = sample_rate * FRAME_MS // 1000
+        self.partial_frames = max(1, int(partial_interval * 1000 / FRAME_MS))
+        self.silence_frames = max(1, silence_ms // FRAME_MS)
+        self.max_frames = int(max_segment_seconds * 1000 / FRAME_MS)
+        self.start_frames = start_frames
+
+        self.index = 0
+        self._leftover = np.zeros(0, dtype=np.float32)
+        self._pre_roll = collections.deque(maxlen=max(start_frames, pre_roll_ms // FRAME_MS))
+        self._frames: List[np.ndarray] = []
+        self._in_speech = False
+        self._voiced_run = 0
+        self._silent_run = 0
+        self._since_partial = 0
+
+    def feed(self, samples: np.ndarray) -> List[TranscriptionRequest]:
+        samples = np.concatenate((self._leftover, samples))
+        whole = len(samples) - len(samples) % self.frame_size
+        self._leftover = samples[whole:]
+        requests = []
+        for start in range(0, whole, self.frame_size):
+            request = self._feed_frame(samples[start:start + self.frame_size])
+            if request:
+                requests.append(request)
+        return requests
+
+    def _feed_frame(self, frame: np.ndarray) -> Optional[TranscriptionRequest]:
+        speech = self.vad.is_speech(frame)
+        if not self._in_speech:
+            self._pre_roll.append(frame)
+            self._voiced_run = self._voiced_run + 1 if speech else 0
+            if self._voiced_run >= self.start_frames:
+                self._in_speech = True
+                self._frames = list(self._pre_roll)
+                self._pre_roll.clear()
+                self._silent_run = 0
+                self._since_partial = 0
+            return None
+
+        self._frames.append(frame)
+        self._since_partial += 1
+        self._silent_run = 0 if speech else self._silent_run + 1
+        if self._silent_run >= self.silence_frames or len(self._frames) >= self.max_frames:
+            return self._end_utterance()
+        if self._since_partial >= self.partial_frames:
+            self._since_partial = 0
+            return ("partial", self.index, np.concatenate(self._frames))
+        return None
+
+    def _end_utterance(self) -> TranscriptionRequest:
+        request = ("final", self.index, np.concatenate(self._frames))
+        self.index += 1
+        self._frames = []
+        self._in_speech = False
+        self._voiced_run = 0
+        return request
+
+    def flush(self) -> List[TranscriptionRequest]:
+        """Final request for the utterance in progress, if any"""
+        if not self._in_speech:
+            return []
+        return [self._end_utterance()]
+
+
+async def stream_transcripts(
+    websocket: WebSocket,
+    transcribe: Callable[[np.ndarray, str], str],
+    sample_rate: int
+):
+    """
+    Run a streaming transcription over an accepted WebSocket.
+
+    The client sends binary messages of 16-bit little-endian mono PCM at
+    sample_rate, and the text message {"type": "end"} when it stops
+    recording. The server sends {"type": "partial" | "final", "segment": n,
+    "text": ...} for each utterance, then {"type": "done"} after "end".
+
+    transcribe(samples, previous_text) runs Whisper on 16 kHz samples, with
+    the last final transcript as context. It runs in a worker thread, one
+    call at a time: finals are transcribed in order, and a partial that has
+    been overtaken by a newer one is skipped, so a slow model falls behind
+    on partials only.
+    """
+    segmenter = SpeechSegmenter(
+        sample_rate,
+        vad=VoiceActivityDetector(threshold_db=config.STT_VAD_THRESHOLD_DB),
+        partial_interval=config.STT_PARTIAL_INTERVAL,
+        silence_ms=config.STT_SILENCE_MS,
+        max_segment_seconds=config.STT_MAX_SEGMENT_SECONDS
+    )
+    finals = collections.deque()
+    latest_partial = None
+    wake = asyncio.Event()
+    ending = False
+
+    def enqueue(requests: List[TranscriptionRequest]):
+        nonlocal latest_partial
+        for request in requests:
+            if request[0] == "final":
+                finals.append(request)
+                if latest_partial is not None and latest_partial[1] == request[1]:
+                    latest_partial = None
+            else:
+                latest_partial = request
+        if requests:
+            wake.set()
+
+    async def transcribe_requests():
+        nonlocal latest_partial
+        previous_text = ""
+        while True:
+            await wake.wait()
+            wake.clear()
+            while finals or latest_partial is not None:
+                if finals:
+                    kind, index, samples = finals.popleft()
+                else:
+                    (kind, index, samples), latest_partial = latest_partial, None
+                try:
+                    text = await asyncio.to_thread(transcribe, resample(samples, sample_rate), previous_text)
+                except Exception as e:
+                    print(f"❌ Error in streaming speech-to-text: {e}")
+                    await websocket.send_json({"type": "error", "segment": index, "detail": str(e)})
+                    continue
+                if kind == "final":
+                    previous_text = text
+                await websocket.send_json({"type": kind, "segment": index, "text": text})
+            if ending:
+                return
+
+    worker = asyncio.create_task(transcribe_requests())
+    leftover = b""
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes"):
+                data = leftover + message["bytes"]
+                # Keep an odd trailing byte for the next message
+                whole = len(data) - len(data) % 2
+                leftover = data[whole:]
+                enqueue(segmenter.feed(pcm_to_float32(data[:whole], 2)))
+            elif message.get("text") and _is_end_message(message["text"]):
+                break
+
+        enqueue(segmenter.flush())
+        ending = True
+        wake.set()
+        await worker
+        await websocket.send_json({"type": "done"})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        worker.cancel()
+
+
+def _is_end_message(text: str) -> bool:
+    try:
+        return json.loads(text).get("type") == "end"
+    except (ValueError, AttributeError):
+        return text.strip() == "end"
@@ -1,19 +1,41 @@
-from transformers import pipeline, AutoTokenizer, AutoModelForSeq2SeqLM
-import torch
+import hashlib
+from typing import Any, Callable, Iterator, List, Optional
+
+import config
+from cache import MISSING, LRUCache, SQLiteCache, TwoTierCache
+from keyword_matcher import KEYWORDS_VERSION, story_keywords, theme_for, title_for
+
+SUMMARY_BACKENDS = ("pytorch", "int8", "onnx")
+
+SUMMARY_CACHE_DB_PATH = "./legacytree.db"
+SUMMARY_CACHE_TABLE = "summary_cache"
+SUMMARY_CACHE_MAX_ENTRIES = 2048  # Summaries are a few hundred bytes each
+SUMMARY_CACHE_MAX_PERSISTENT = 50000
+SUMMARY_CACHE_TTL = 30 * 24 * 3600
+LABEL_CACHE_MAX_ENTRIES = 4096
 
 class SummarizationService:
-    def __init__(self, use_ai_model=True):
+    def __init__(
+        self,
+        use_ai_model=True,
+        backend: Optional[str] = None,
+        cache_db_path: Optional[str] = SUMMARY_CACHE_DB_PATH
+    ):
         self.model_name = "sshleifer/distilbart-cnn-12-6"
         self.use_ai_model = use_ai_model
+        self.backend = backend or config.SUMMARY_BACKEND
+        # Summaries keyed by a hash of the normalized text, the model and the lengths
+        self.cache = TwoTierCache(
+            LRUCache(max_entries=SUMMARY_CACHE_MAX_ENTRIES),
+            SQLiteCache(cache_db_path, SUMMARY_CACHE_TABLE, SUMMARY_CACHE_MAX_PERSISTENT) if cache_db_path else None
+        )
+        # Titles and themes are cheap keyword matches, so they are only kept in memory
+        self.label_cache = LRUCache(max_entries=LABEL_CACHE_MAX_ENTRIES)
         
         if use_ai_model:
             try:
-                self.summarizer = pipeline(
-                    "summarization", 
-                    model=self.model_name,
-                    device=0 if torch.cuda.is_available() else -1
-                )
-                print(f"✅ Summarization model loaded: {self.model_name}")
+                self.summarizer = self._load_summarizer()
+                print(f"✅ Summarization model loaded: {self.model_name} ({self.backend})")
             except Exception as e:
                 print(f"❌ Error loading summarization model: {e}")
                 print("🔄 Falling back to lightweight mode")
@@ -23,9 +45,67 @@ class SummarizationService:
             self.summarizer = None
             print("🔄 Running in lightweight mode (no AI model)")
     
-    def summarize_text(self, text: str, max_length: int = 150, min_length: int = 50) -> str:
+    def _load_summarizer(self):
+        """
+        Build the summarization pipeline for the configured backend:
+        - pytorch: the fp32 model as published
+        - int8: dynamic int8 quantization of the Linear layers (CPU only)
+        - onnx: the model exported to ONNX and run with onnxruntime (needs optimum[onnxruntime])
+        """
+        # Deferred so lightweight mode never imports torch/transformers
+        import torch
+        from transformers import AutoTokenizer, pipeline
+
+        if self.backend not in SUMMARY_BACKENDS:
+            raise ValueError(f"Unknown summarization backend: {self.backend}")
+        if self.backend == "pytorch" or torch.cuda.is_available():
+            if self.backend != "pytorch":
+                print(f"⚠️ {self.backend} summarization backend is for CPU, using pytorch on GPU")
+                self.backend = "pytorch"
+            return pipeline(
+                "summarization", 
+                model=self.model_name,
+                device=0 if torch.cuda.is_available() else -1
+            )
+
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        if self.backend == "int8":
+            from transformers import AutoModelForSeq2SeqLM
+
+            model = AutoModelForSeq2SeqLM.from_pretrained(self.model_name)
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        else:
+            try:
+                from optimum.onnxruntime import ORTModelForSeq2SeqLM
+            except ImportError:
+                print("⚠️ optimum[onnxruntime] is not installed, using the pytorch summarization backend")
+                self.backend = "pytorch"
+                return pipeline("summarization", model=self.model_name, device=-1)
+            model = ORTModelForSeq2SeqLM.from_pretrained(self.model_name, export=True)
+        return pipeline("summarization", model=model, tokenizer=tokenizer, device=-1)
+
+    def _cache_key(self, kind: str, cleaned_text: str, *params: Any) -> str:
+        """Content hash of the normalized text plus everything else the result depends on"""
+        digest = hashlib.sha256(cleaned_text.encode()).hexdigest()
+        model = f"{self.model_name}:{self.backend}" if kind == "summary" else f"keywords:{KEYWORDS_VERSION}"
+        return ":".join([kind, model, *map(str, params), digest])
+
+    def cache_stats(self) -> dict:
+        stats = self.cache.stats()
+        stats["labels"] = self.label_cache.stats()
+        return stats
+
+    def summarize_text(
+        self,
+        text: str,
+        max_length: int = 150,
+        min_length: int = 50,
+        progress_callback: Optional[Callable[[int, int, int], None]] = None
+    ) -> str:
         """
         Summarize text using AI
+        Texts longer than the model input are summarized chunk by chunk, see
+        _summarize_long; progress_callback(level, done, total) reports its progress
         """
         if not self.summarizer:
             return self._fallback_summarize(text)
@@ -37,6 +117,17 @@ class SummarizationService:
             # If text is too short, return as is
             if len(cleaned_text.split()) < 20:
                 return cleaned_text
+
+            key = self._cache_key("summary", cleaned_text, max_length, min_length)
+            cached = self.cache.get(key)
+            if cached is not MISSING:
+                return cached
+            
+            token_ids = self._token_ids(cleaned_text)
+            if len(token_ids) > config.SUMMARY_CHUNK_TOKENS:
+                summary = self._summarize_long(token_ids, max_length, min_length, progress_callback)
+                self.cache.set(key, summary, SUMMARY_CACHE_TTL)
+                return summary
             
             # Generate summary
             summary = self.summarizer(
@@ -45,24 +136,156 @@ class SummarizationService:
                 min_length=min_length,
                 do_sample=False,
                 truncation=True
-            )
+            )[0]['summary_text']
             
-            return summary[0]['summary_text']
+            self.cache.set(key, summary, SUMMARY_CACHE_TTL)
+            return summary
             
         except Exception as e:
             print(f"Summarization error: {e}")
             return self._fallback_summarize(text)
     
+    def _token_ids(self, text: str) -> List[int]:
+        return self.summarizer.tokenizer(text, add_special_tokens=False, verbose=False)["input_ids"]
+
+    def _chunk(self, token_ids: List[int]) -> List[str]:
+        """
+        Split token ids into overlapping windows that fit the model input.
+        Beyond SUMMARY_MAX_CHUNKS, evenly spaced windows are kept so the cost
+        of one level stays bounded however long the transcript is.
+        """
+        size = config.SUMMARY_CHUNK_TOKENS
+        stride = max(1, size - config.SUMMARY_CHUNK_OVERLAP)
+        starts = list(range(0, max(1, len(token_ids) - config.SUMMARY_CHUNK_OVERLAP), stride))
+        if len(starts) > config.SUMMARY_MAX_CHUNKS:
+            print(f"⚠️ Transcript needs {len(starts)} chunks, summarizing {config.SUMMARY_MAX_CHUNKS} evenly spaced ones")
+            step = len(starts) / config.SUMMARY_MAX_CHUNKS
+            starts = [starts[int(i * step)] for i in range(config.SUMMARY_MAX_CHUNKS)]
+        decode = self.summarizer.tokenizer.decode
+        return [decode(token_ids[start:start + size], skip_special_tokens=True) for start in starts]
+
+    def _summarize_long(
+        self,
+        token_ids: List[int],
+        max_length: int,
+        min_length: int,
+        progress_callback: Optional[Callable[[int, int, int], None]] = None
+    ) -> str:
+        """
+        Hierarchical (map-reduce) summary of a text longer than the model input:
+        summarize overlapping chunks in batches, join the chunk summaries and
+        repeat until they fit in one model input, then summarize that.
+        Only one level of chunk summaries is held at a time.
+        """
+        level = 1
+        while len(token_ids) > config.SUMMARY_CHUNK_TOKENS:
+            chunks = self._chunk(token_ids)
+            summaries = []
+            batch_size = config.SUMMARY_BATCH_SIZE
+            for start in range(0, len(chunks), batch_size):
+                batch = chunks[start:start + batch_size]
+                outputs = self.summarizer(
+                    batch,
+                    max_length=config.SUMMARY_CHUNK_SUMMARY_TOKENS,
+                    min_length=min(min_length, config.SUMMARY_CHUNK_SUMMARY_TOKENS // 2),
+                    do_sample=False,
+                    truncation=True,
+                    batch_size=len(batch)
+                )
+                summaries.extend(output['summary_text'] for output in outputs)
+                if progress_callback:
+                    progress_callback(level, len(summaries), len(chunks))
+
+            next_ids = self._token_ids(" ".join(summaries))
+            if len(next_ids) >= len(token_ids):
+                # Summaries did not shrink the text; stop recursing and truncate
+                next_ids = next_ids[:config.SUMMARY_CHUNK_TOKENS]
+            token_ids = next_ids
+            level += 1
+
+        text = self.summarizer.tokenizer.decode(token_ids, skip_special_tokens=True)
+        summary = self.summarizer(
+            text,
+            max_length=max_length,
+            min_length=min_length,
+            do_sample=False,
+            truncation=True
+        )[0]['summary_text']
+        if progress_callback:
+            progress_callback(level, 1, 1)
+        return summary
+
+    def summarize_batch(
+        self,
+        texts: List[str],
+        batch_size: Optional[int] = None,
+        max_length: int = 150,
+        min_length: int = 50
+    ) -> Iterator[str]:
+        """
+        Summarize many texts, yielding summaries in input order.
+        Texts are sorted by length so each model batch holds similar lengths
+        and wastes little padding; a summary is yielded as soon as all earlier
+        inputs are done. Texts longer than one model input are summarized
+        with summarize_text after the batches.
+        """
+        batch_size = batch_size or config.SUMMARY_BATCH_SIZE
+        cleaned = [self._clean_text(text) for text in texts]
+        results = {}
+        model_inputs = []
+        long_inputs = []
+        for i, text in enumerate(cleaned):
+            if not self.summarizer:
+                results[i] = self._fallback_summarize(texts[i])
+                continue
+            if len(text.split()) < 20:
+                # If text is too short, return as is
+                results[i] = text
+                continue
+            cached = self.cache.get(self._cache_key("summary", text, max_length, min_length))
+            if cached is not MISSING:
+                results[i] = cached
+            elif len(self._token_ids(text)) > config.SUMMARY_CHUNK_TOKENS:
+                long_inputs.append(i)
+            else:
+                model_inputs.append(i)
+        model_inputs.sort(key=lambda i: len(cleaned[i]))
+
+        next_index = 0
+        for start in range(0, len(model_inputs) + 1, batch_size):
+            batch = model_inputs[start:start + batch_size]
+            if batch:
+                try:
+                    summaries = self.summarizer(
+                        [cleaned[i] for i in batch],
+                        max_length=max_length,
+                        min_length=min_length,
+                        do_sample=False,
+                        truncation=True,
+                        batch_size=len(batch)
+                    )
+                    for i, summary in zip(batch, summaries):
+                        results[i] = summary['summary_text']
+                        key = self._cache_key("summary", cleaned[i], max_length, min_length)
+                        self.cache.set(key, results[i], SUMMARY_CACHE_TTL)
+                except Exception as e:
+                    print(f"Summarization error: {e}")
+                    for i in batch:
+                        results[i] = self._fallback_summarize(texts[i])
+            while next_index in results:
+                yield results.pop(next_index)
+                next_index += 1
+
+        for i in long_inputs:
+            results[i] = self.summarize_text(texts[i], max_length=max_length, min_length=min_length)
+            while next_index in results:
+                yield results.pop(next_index)
+                next_index += 1
+    
     def _clean_text(self, text: str) -> str:
         """Clean and prepare text for summarization"""
-        # Remove extra whitespace
-        text = ' '.join(text.split())
-        
-        # Limit text length (models have input limits)
-        if len(text) > 1000:
-            text = text[:1000] + "..."
-        
-        return text
+        # Remove extra whitespace; long texts are chunked, not truncated
+        return ' '.join(text.split())
     
     def _fallback_summarize(self, text: str) -> str:
         """Fallback summarization when AI model fails"""
@@ -71,65 +294,28 @@ class SummarizationService:
             return ' '.join(words[:50]) + "..."
         return text
     
+    def _cached(self, kind: str, text: str, compute: Callable[[str], str]) -> str:
+        key = self._cache_key(kind, self._clean_text(text))
+        result = self.label_cache.get(key)
+        if result is MISSING:
+            result = compute(text)
+            self.label_cache.set(key, result)
+        return result
+
     def generate_title(self, text: str) -> str:
         """Generate a title based on the story content"""
-        # Simple keyword-based title generation
-        text_lower = text.lower()
-        
-        # Check for family members
-        if any(word in text_lower for word in ["grandfather", "grandpa", "grandad"]):
-            return "Memories of Grandfather"
-        elif any(word in text_lower for word in ["grandmother", "grandma", "nana"]):
-            return "Memories of Grandmother"
-        elif any(word in text_lower for word in ["father", "dad", "papa"]):
-            return "Memories of Father"
-        elif any(word in text_lower for word in ["mother", "mom", "mama"]):
-            return "Memories of Mother"
-        
-        # Check for themes
-        elif "war" in text_lower:
-            return "War Time Memories"
-        elif any(word in text_lower for word in ["migration", "immigration", "journey"]):
-            return "The Great Journey"
-        elif "love" in text_lower:
-            return "A Love Story"
-        elif "wedding" in text_lower:
-            return "Wedding Day Memories"
-        elif "birth" in text_lower or "born" in text_lower:
-            return "Birth Story"
-        elif "school" in text_lower or "education" in text_lower:
-            return "School Days"
-        elif "work" in text_lower or "job" in text_lower:
-            return "Working Life"
-        
-        return "A Special Memory"
-    
+        return self._cached("title", text, self._generate_title)
+
     def classify_theme(self, text: str) -> str:
         """Classify the theme of the story"""
-        text_lower = text.lower()
-        
-        # Define theme keywords
-        themes = {
-            "love": ["love", "romance", "marriage", "wedding", "kiss", "heart"],
-            "war": ["war", "battle", "soldier", "military", "army", "conflict"],
-            "migration": ["migration", "immigration", "journey", "travel", "move", "country"],
-            "family": ["family", "children", "parents", "grandparents", "home"],
-            "tradition": ["tradition", "culture", "custom", "ceremony", "ritual"],
-            "adventure": ["adventure", "explore", "discover", "travel", "journey"],
-            "struggle": ["struggle", "difficult", "hard", "challenge", "overcome"],
-            "success": ["success", "achieve", "accomplish", "win", "victory"]
-        }
-        
-        # Count theme matches
-        theme_scores = {}
-        for theme, keywords in themes.items():
-            score = sum(1 for keyword in keywords if keyword in text_lower)
-            theme_scores[theme] = score
-        
-        # Return the theme with highest score, default to family
-        if theme_scores:
-            best_theme = max(theme_scores, key=theme_scores.get)
-            if theme_scores[best_theme] > 0:
-                return best_theme
-        
-        return "family" 
\ No newline at end of file
+        return self._cached("theme", text, self._classify_theme)
+
+    def _generate_title(self, text: str) -> str:
+        return title_for(story_keywords(text))
+
+    def _classify_theme(self, text: str) -> str:
+        return theme_for(story_keywords(text))
+
+    def classify_batch(self, texts: List[str]) -> List[tuple]:
+        """(title, theme) for many texts, through the cache; one keyword scan per uncached text"""
+        return [(self.generate_title(text), self.classify_theme(text)) for text in texts]